@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 优先级类别，数值越小越优先
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_NAMES = {"interactive": PRIORITY_INTERACTIVE, "batch": PRIORITY_BATCH}
+
+# 默认准入参数，可通过 provider_admission 表按提供商覆盖
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_MAX_QUEUE = 256
+DEFAULT_QUEUE_TIMEOUT = 10.0  # 秒
+INTERACTIVE_RESERVE_RATIO = 0.2  # 为交互式请求预留的并发比例，批处理请求不能占用
+
+
+class AdmissionRejected(Exception):
+    """排队已满或排队超时，应快速返回 503"""
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """已获得的并发名额，release 可重复调用"""
+
+    def __init__(self, gate: "ProviderGate", priority: int, wait_time: float):
+        self.gate = gate
+        self.priority = priority
+        self.wait_time = wait_time
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.gate.release()
+
+
+class ProviderGate:
+    """
+    单个提供商的并发限制器
+
+    超出并发上限的请求进入有界优先队列；名额释放时优先唤醒交互式请求，
+    批处理请求只能使用扣除预留后的名额。
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_queue: int = DEFAULT_MAX_QUEUE, queue_timeout: float = DEFAULT_QUEUE_TIMEOUT):
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.configure(max_concurrency, max_queue, queue_timeout)
+
+        # 指标
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=1000)
+
+    def configure(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        reserve = int(self.max_concurrency * INTERACTIVE_RESERVE_RATIO)
+        self.batch_limit = max(1, self.max_concurrency - reserve)
+        self._wake_waiters()
+
+    def _limit_for(self, priority: int) -> int:
+        return self.max_concurrency if priority == PRIORITY_INTERACTIVE else self.batch_limit
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        return sum(1 for p, _, future in self._waiters
+                   if not future.done() and (priority is None or p == priority))
+
+    def _record_wait(self, wait_time: float):
+        self.admitted += 1
+        self.total_wait += wait_time
+        self.max_wait = max(self.max_wait, wait_time)
+        self.recent_waits.append(wait_time)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> AdmissionTicket:
+        start = time.perf_counter()
+        # 有空闲名额且没有同级或更高优先级的排队者时直接放行，保证不插队
+        if self.active < self._limit_for(priority) and not any(
+                p <= priority and not future.done() for p, _, future in self._waiters):
+            self.active += 1
+            self._record_wait(0.0)
+            return AdmissionTicket(self, priority, 0.0)
+
+        if self.queue_depth() >= self.max_queue:
+            self.rejected_full += 1
+            raise AdmissionRejected("提供商繁忙，排队已满", retry_after=max(1.0, self.queue_timeout / 2))
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # 超时的同时被唤醒，名额已经分配给我们，直接使用
+                pass
+            else:
+                future.cancel()
+                self.rejected_timeout += 1
+                raise AdmissionRejected("提供商繁忙，排队超时", retry_after=self.queue_timeout)
+        except asyncio.CancelledError:
+            # 客户端断开：如果名额已分配则归还
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+        wait_time = time.perf_counter() - start
+        self._record_wait(wait_time)
+        return AdmissionTicket(self, priority, wait_time)
+
+    def release(self):
+        self.active -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.active >= self._limit_for(priority):
+                break
+            heapq.heappop(self._waiters)
+            self.active += 1
+            future.set_result(True)
+
+    def percentile_wait(self, percentile: float) -> float:
+        if not self.recent_waits:
+            return 0.0
+        waits = sorted(self.recent_waits)
+        return waits[min(len(waits) - 1, int(len(waits) * percentile))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "batch_limit": self.batch_limit,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "active": self.active,
+            "queue_depth": {
+                "interactive": self.queue_depth(PRIORITY_INTERACTIVE),
+                "batch": self.queue_depth(PRIORITY_BATCH)
+            },
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_ms": {
+                "avg": round(self.total_wait / self.admitted * 1000, 2) if self.admitted else 0.0,
+                "p50": round(self.percentile_wait(0.5) * 1000, 2),
+                "p95": round(self.percentile_wait(0.95) * 1000, 2),
+                "max": round(self.max_wait * 1000, 2)
+            }
+        }
+
+
+class AdmissionController:
+    """按提供商管理 ProviderGate，并根据个性化密钥确定优先级"""
+
+    def __init__(self, provider_loader: Optional[Callable[[], List[Tuple]]] = None,
+                 priority_loader: Optional[Callable[[], List[Tuple]]] = None):
+        """
+        Args:
+            provider_loader: 返回 (provider_id, max_concurrency, max_queue, queue_timeout) 列表
+            priority_loader: 返回 (personalized_key, priority) 列表，priority 为 interactive 或 batch
+        """
+        self.provider_loader = provider_loader
+        self.priority_loader = priority_loader
+        self.provider_policies: Dict[int, Tuple[int, int, float]] = {}
+        self.priorities: Dict[str, int] = {}
+        self.gates: Dict[int, ProviderGate] = {}
+        self.logger = logging.getLogger('nexusai.admission')
+        self.reload()
+
+    def reload(self):
+        """重新加载准入配置，已有的 gate 原地更新参数"""
+        try:
+            if self.provider_loader:
+                self.provider_policies = {
+                    int(provider_id): (max_concurrency, max_queue, queue_timeout)
+                    for provider_id, max_concurrency, max_queue, queue_timeout in self.provider_loader()
+                }
+            if self.priority_loader:
+                self.priorities = {
+                    key: PRIORITY_NAMES.get(priority, PRIORITY_INTERACTIVE)
+                    for key, priority in self.priority_loader()
+                }
+        except Exception as e:
+            self.logger.error(f"加载准入配置失败: {str(e)}")
+            return
+        for provider_id, gate in self.gates.items():
+            gate.configure(*self._policy(provider_id))
+
+    def _policy(self, provider_id: int) -> Tuple[int, int, float]:
+        return self.provider_policies.get(
+            provider_id, (DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_QUEUE, DEFAULT_QUEUE_TIMEOUT)
+        )
+
+    def gate(self, provider_id: int) -> ProviderGate:
+        gate = self.gates.get(provider_id)
+        if gate is None:
+            gate = ProviderGate(*self._policy(provider_id))
+            self.gates[provider_id] = gate
+        return gate
+
+    def priority_for(self, personalized_key: str) -> int:
+        return self.priorities.get(personalized_key, PRIORITY_INTERACTIVE)
+
+    async def acquire(self, provider_id: int, personalized_key: str = "") -> AdmissionTicket:
+        ticket = await self.gate(provider_id).acquire(self.priority_for(personalized_key))
+        if ticket.wait_time > 1.0:
+            self.logger.info(f"提供商 {provider_id} 排队 {ticket.wait_time:.2f} 秒后获得名额")
+        return ticket
+
+    def snapshot(self) -> Dict[int, Dict[str, Any]]:
+        return {provider_id: gate.snapshot() for provider_id, gate in self.gates.items()}
@@ -0,0 +1,82 @@
+"""
+微基准测试的公共配置
+
+安装了 pytest-benchmark 时直接使用它的 benchmark fixture（支持 --benchmark-autosave /
+--benchmark-compare 等回归对比）；未安装时提供一个接口兼容的简易计时 fixture，
+在测试结束后输出各用例的耗时统计。
+"""
+import os
+import statistics
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+try:
+    import pytest_benchmark  # noqa: F401
+    HAS_PYTEST_BENCHMARK = True
+except ImportError:
+    HAS_PYTEST_BENCHMARK = False
+
+_fallback_results = []
+
+
+class FallbackBenchmark:
+    """pytest-benchmark 的最小替代：支持 benchmark(fn, ...) 和 benchmark.pedantic(...)"""
+
+    def __init__(self, name: str, min_time: float = 0.2, min_rounds: int = 5, max_rounds: int = 10000):
+        self.name = name
+        self.min_time = min_time
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.timings = []
+        self.extra_info = {}
+
+    def __call__(self, fn, *args, **kwargs):
+        result = fn(*args, **kwargs)  # 预热
+        start = time.perf_counter()
+        while len(self.timings) < self.min_rounds or (
+                time.perf_counter() - start < self.min_time and len(self.timings) < self.max_rounds):
+            begin = time.perf_counter()
+            result = fn(*args, **kwargs)
+            self.timings.append(time.perf_counter() - begin)
+        self._report()
+        return result
+
+    def pedantic(self, target, args=(), kwargs=None, setup=None, rounds=1, warmup_rounds=0, iterations=1):
+        result = None
+        for index in range(warmup_rounds + rounds):
+            call_args, call_kwargs = args, kwargs or {}
+            if setup is not None:
+                prepared = setup()
+                if prepared is not None:
+                    call_args, call_kwargs = prepared
+            begin = time.perf_counter()
+            for _ in range(iterations):
+                result = target(*call_args, **call_kwargs)
+            if index >= warmup_rounds:
+                self.timings.append((time.perf_counter() - begin) / iterations)
+        self._report()
+        return result
+
+    def _report(self):
+        _fallback_results.append((self.name, list(self.timings), dict(self.extra_info)))
+
+
+if not HAS_PYTEST_BENCHMARK:
+    @pytest.fixture
+    def benchmark(request):
+        return FallbackBenchmark(request.node.name)
+
+    def pytest_terminal_summary(terminalreporter):
+        if not _fallback_results:
+            return
+        terminalreporter.section("microbenchmarks (未安装 pytest-benchmark，使用简易计时)")
+        terminalreporter.write_line(f"{'name':<48} {'rounds':>7} {'min(us)':>11} {'median(us)':>11} {'mean(us)':>11}")
+        for name, timings, extra_info in _fallback_results:
+            line = (f"{name:<48} {len(timings):>7} {min(timings) * 1e6:>11.1f} "
+                    f"{statistics.median(timings) * 1e6:>11.1f} {statistics.mean(timings) * 1e6:>11.1f}")
+            if extra_info:
+                line += "  " + " ".join(f"{key}={value}" for key, value in extra_info.items())
+            terminalreporter.write_line(line)
@@ -0,0 +1,176 @@
+"""
+压测负载生成器
+
+支持两种模式：
+- 闭环（concurrency）：固定数量的并发用户，每个用户收到完整响应后立即发下一个请求
+- 开环（rate）：按固定速率（请求/秒）发出请求，不等待前一个请求完成，更接近真实流量
+"""
+import asyncio
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+@dataclass
+class RequestResult:
+    status: int
+    ttft: Optional[float]  # 首个内容块耗时（秒），非流式请求为 None
+    ttlt: float            # 完整响应耗时（秒）
+    chunks: int = 0        # 收到的内容块数
+    error: Optional[str] = None
+
+
+@dataclass
+class LoadConfig:
+    url: str
+    api_key: str
+    model: str
+    stream: bool = True
+    concurrency: int = 10
+    rate: float = 0.0            # 大于 0 时使用开环模式
+    duration: float = 10.0       # 持续时间（秒）
+    max_requests: int = 0        # 大于 0 时达到该数量后停止
+    prompt: str = "你好，请简单介绍一下你自己"
+    timeout: float = 60.0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """线性插值的分位数，q 取 0-100"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "p50_ms": ms(percentile(values, 50)),
+        "p90_ms": ms(percentile(values, 90)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(max(values)) if values else None
+    }
+
+
+def summarize(results: List[RequestResult], elapsed: float) -> Dict[str, Any]:
+    """汇总吞吐量、错误率和 TTFT/TTLT 分位数"""
+    ok = [result for result in results if result.status == 200 and result.error is None]
+    statuses: Dict[str, int] = {}
+    for result in results:
+        key = str(result.status) if result.error is None else f"{result.status}:{result.error}"
+        statuses[key] = statuses.get(key, 0) + 1
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed > 0 else 0.0,
+        "chunks_per_s": round(sum(result.chunks for result in ok) / elapsed, 2) if elapsed > 0 else 0.0,
+        "statuses": statuses,
+        "ttft": _distribution([result.ttft for result in ok if result.ttft is not None]),
+        "ttlt": _distribution([result.ttlt for result in ok])
+    }
+
+
+async def send_request(client: httpx.AsyncClient, config: LoadConfig) -> RequestResult:
+    """发送一个聊天补全请求并记录时间点"""
+    body = {
+        "model": config.model,
+        "messages": [{"role": "user", "content": config.prompt}],
+        "stream": config.stream,
+        **config.extra
+    }
+    headers = {"Authorization": f"Bearer {config.api_key}"}
+    start = time.perf_counter()
+    try:
+        if not config.stream:
+            response = await client.post(config.url, json=body, headers=headers, timeout=config.timeout)
+            return RequestResult(response.status_code, None, time.perf_counter() - start,
+                                 chunks=1 if response.status_code == 200 else 0)
+
+        ttft = None
+        chunks = 0
+        async with client.stream("POST", config.url, json=body, headers=headers, timeout=config.timeout) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return RequestResult(response.status_code, None, time.perf_counter() - start)
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line[6:].strip() == "[DONE]":
+                    continue
+                try:
+                    data = json.loads(line[6:])
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(data, dict) and data.get("error"):
+                    # 网关在流中转发的上游错误
+                    return RequestResult(200, ttft, time.perf_counter() - start, chunks=chunks, error="stream_error")
+                chunks += 1
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+        return RequestResult(200, ttft, time.perf_counter() - start, chunks=chunks)
+    except httpx.HTTPError as e:
+        return RequestResult(0, None, time.perf_counter() - start, error=type(e).__name__)
+
+
+async def run_load(config: LoadConfig, client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+    """
+    按配置施加负载并返回 summarize() 的结果
+
+    Args:
+        config: 负载配置
+        client: 自定义客户端（测试时可传入 ASGI 客户端），默认新建一个连接数足够的客户端
+    """
+    own_client = client is None
+    if own_client:
+        limit = max(config.concurrency, int(config.rate * config.timeout) + 1, 10)
+        client = httpx.AsyncClient(limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit))
+
+    results: List[RequestResult] = []
+    start = time.perf_counter()
+    deadline = start + config.duration
+    sent = 0
+
+    def should_continue() -> bool:
+        if config.max_requests and sent >= config.max_requests:
+            return False
+        return time.perf_counter() < deadline
+
+    async def tracked():
+        results.append(await send_request(client, config))
+
+    try:
+        if config.rate > 0:
+            # 开环：按计划时间发出请求，落后于计划时立即发出，不等待前面的请求完成
+            interval = 1.0 / config.rate
+            tasks = []
+            next_send = start
+            while should_continue():
+                sent += 1
+                tasks.append(asyncio.create_task(tracked()))
+                next_send += interval
+                await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+            await asyncio.gather(*tasks)
+        else:
+            async def user():
+                nonlocal sent
+                while should_continue():
+                    sent += 1
+                    await tracked()
+
+            await asyncio.gather(*(user() for _ in range(config.concurrency)))
+    finally:
+        if own_client:
+            await client.aclose()
+
+    summary = summarize(results, time.perf_counter() - start)
+    summary["config"] = {key: value for key, value in asdict(config).items() if key != "api_key"}
+    return summary
@@ -0,0 +1,135 @@
+"""
+本地模拟的 OpenAI 兼容上游，用于压测网关
+
+python -m bench.mock_upstream --port 9100 --latency 0.05 --token-rate 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ["the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "你好", "世界"]
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.05       # 返回首字节前的延迟（秒）
+    token_rate: float = 0.0     # 生成速度（tokens/秒），0 表示不限速
+    completion_tokens: int = 64  # 每个回复的 token 数
+    chunk_tokens: int = 1       # 每个流式数据块包含的 token 数
+    error_rate: float = 0.0     # 注入错误的比例
+    error_status: int = 500
+    grok_style: bool = False    # 使用非标准格式（message/text 字段、缺少 id/object），测试网关的 Grok 兼容处理
+
+
+def _completion_words(config: MockConfig):
+    return [random.choice(WORDS) for _ in range(config.completion_tokens)]
+
+
+def create_mock_upstream(config: MockConfig = None) -> FastAPI:
+    config = config or MockConfig()
+    app = FastAPI()
+    app.state.config = config
+    app.state.requests = 0
+
+    def chunk_payload(model: str, text: str, index: int) -> dict:
+        if config.grok_style:
+            # 交替使用几种非标准格式
+            variants = [
+                {"choices": [{"message": {"content": text}}]},
+                {"choices": [{"text": text}]},
+                {"choices": [{"delta": text}]},
+            ]
+            return variants[index % len(variants)]
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        model = body.get("model", "mock-model")
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages", []))
+
+        await asyncio.sleep(config.latency)
+        if config.error_rate and random.random() < config.error_rate:
+            return JSONResponse(
+                {"error": {"message": "injected error", "type": "mock_error", "code": config.error_status}},
+                status_code=config.error_status
+            )
+
+        words = _completion_words(config)
+        if not body.get("stream"):
+            if config.token_rate:
+                await asyncio.sleep(len(words) / config.token_rate)
+            content = " ".join(words)
+            message = {"choices": [{"message": content}]} if config.grok_style else {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                          "total_tokens": prompt_tokens + len(words)}
+            }
+            return JSONResponse(message)
+
+        async def stream():
+            step = max(1, config.chunk_tokens)
+            for index in range(0, len(words), step):
+                if config.token_rate:
+                    await asyncio.sleep(step / config.token_rate)
+                text = " ".join(words[index:index + step]) + " "
+                yield f"data: {json.dumps(chunk_payload(model, text, index // step), ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]}
+
+    @app.post("/v1/tokenize")
+    async def tokenize(request: Request):
+        """与网关 Tokenizer 使用的分词 API 格式一致"""
+        body = await request.json()
+        return {"data": [{"total_tokens": max(1, len(text.split()))} for text in body.get("text", [])]}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟的 OpenAI 兼容上游")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--token-rate", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=64)
+    parser.add_argument("--chunk-tokens", type=int, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--grok-style", action="store_true")
+    args = parser.parse_args()
+
+    import uvicorn
+    config = MockConfig(
+        latency=args.latency, token_rate=args.token_rate, completion_tokens=args.completion_tokens,
+        chunk_tokens=args.chunk_tokens, error_rate=args.error_rate, error_status=args.error_status,
+        grok_style=args.grok_style
+    )
+    uvicorn.run(create_mock_upstream(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+一键压测：启动本地模拟上游和网关，分别直接压测上游和经网关压测，输出网关引入的额外开销
+
+python -m bench.run_bench --concurrency 20 --duration 15
+python -m bench.run_bench --rate 50 --duration 30 --latency 0.2 --token-rate 40
+python -m bench.run_bench --workers 4 --compare bench/results/20250101-120000.json
+
+结果以 JSON 保存在 bench/results/ 下（包含配置、git 版本、吞吐量、TTFT/TTLT 分位数、网关 CPU/内存），
+可用 --compare 与之前的结果对比。--workers 大于 1 时通过 run.py 启动（固定使用 5231/8000 端口）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from bench.loadgen import LoadConfig, run_load
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = REPO_ROOT / "bench" / "results"
+BENCH_KEY = "bench-key"
+BENCH_MODEL = "mock-model"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed_workdir(workdir: Path, upstream_url: str):
+    """在临时目录中准备网关运行所需的数据库和静态文件，不影响仓库中的 data/"""
+    (workdir / "static").symlink_to(REPO_ROOT / "static")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # database 使用相对路径 data/config.db，需要在临时目录中导入和初始化
+        sys.path.insert(0, str(REPO_ROOT))
+        from database import init_db, add_service_provider, add_provider_model
+        Path("data").mkdir(exist_ok=True)
+        init_db()
+        provider_id = add_service_provider("bench", upstream_url, "mock-key", BENCH_KEY, "压测用模拟上游")
+        add_provider_model(provider_id, BENCH_MODEL)
+    finally:
+        os.chdir(cwd)
+
+
+def process_tree(pid: int) -> List[int]:
+    """返回进程及其所有子进程的 pid（读取 /proc，仅 Linux）"""
+    pids = [pid]
+    index = 0
+    while index < len(pids):
+        current = pids[index]
+        index += 1
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def resource_usage(pid: int) -> Dict[str, float]:
+    """进程树累计 CPU 时间（秒）和当前常驻内存（MB）"""
+    cpu = 0.0
+    rss = 0
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # 去掉 "pid (comm)" 后，utime/stime 是第 12/13 个字段，rss 是第 22 个字段
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            rss += int(fields[21]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+    return {"cpu_seconds": cpu, "rss_mb": round(rss / 1024 / 1024, 1)}
+
+
+def wait_ready(url: str, timeout: float = 30.0, process: Optional[subprocess.Popen] = None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"进程已退出（返回码 {process.returncode}）: {url}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"等待服务启动超时: {url}")
+
+
+def start_upstream(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "bench.mock_upstream", "--port", str(port),
+        "--latency", str(args.latency), "--token-rate", str(args.token_rate),
+        "--completion-tokens", str(args.completion_tokens), "--chunk-tokens", str(args.chunk_tokens),
+        "--error-rate", str(args.error_rate)
+    ]
+    if args.grok_style:
+        command.append("--grok-style")
+    return subprocess.Popen(command, cwd=REPO_ROOT)
+
+
+def start_gateway(args, workdir: Path, port: int, upstream_port: int) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": str(REPO_ROOT),
+        "NEXUSAI_TOKENIZER_URL": f"http://127.0.0.1:{upstream_port}/v1/tokenize",
+        "NEXUSAI_LOG_LEVEL": args.log_level,
+        "NEXUSAI_API_WORKERS": str(args.workers),
+        "NEXUSAI_ADMIN_WORKERS": "1",
+    })
+    if args.workers > 1:
+        command = [sys.executable, str(REPO_ROOT / "run.py")]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app_api", "--host", "127.0.0.1",
+                   "--port", str(port), "--log-level", "warning"]
+    # 网关的控制台日志写入临时目录，避免干扰压测输出
+    log = open(workdir / "gateway.log", "w", encoding="utf-8")
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop(process: Optional[subprocess.Popen]):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def load_config(args, url: str) -> LoadConfig:
+    return LoadConfig(
+        url=url, api_key=BENCH_KEY, model=BENCH_MODEL, stream=not args.no_stream,
+        concurrency=args.concurrency, rate=args.rate, duration=args.duration,
+        max_requests=args.max_requests
+    )
+
+
+def overhead(direct: Dict[str, Any], gateway: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """网关相对直连上游增加的延迟（毫秒）"""
+    result = {}
+    for metric in ("ttft", "ttlt"):
+        for key in ("p50_ms", "p90_ms", "p99_ms"):
+            a, b = direct[metric][key], gateway[metric][key]
+            result[f"{metric}_{key}"] = round(b - a, 2) if a is not None and b is not None else None
+    return result
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """与之前的结果逐项对比，返回可读的文本行"""
+    lines = [f"对比 {previous.get('git')} ({previous.get('timestamp')}) -> {current.get('git')}"]
+    rows = [("吞吐量 rps", ("gateway", "throughput_rps"))]
+    for metric in ("ttft", "ttlt"):
+        for key in ("p50_ms", "p90_ms", "p99_ms"):
+            rows.append((f"{metric} {key}", ("gateway", metric, key)))
+            rows.append((f"开销 {metric} {key}", ("overhead", f"{metric}_{key}")))
+    rows += [("CPU 秒/千请求", ("resources", "cpu_seconds_per_1k")), ("RSS MB", ("resources", "rss_mb"))]
+
+    def lookup(data, path):
+        for key in path:
+            if not isinstance(data, dict):
+                return None
+            data = data.get(key)
+        return data
+
+    for label, path in rows:
+        old, new = lookup(previous, path), lookup(current, path)
+        if old is None or new is None:
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        lines.append(f"  {label:<20} {old:>10} -> {new:>10}  ({change})")
+    return lines
+
+
+def print_summary(name: str, summary: Dict[str, Any]):
+    print(f"[{name}] 请求 {summary['requests']}，成功 {summary['ok']}，"
+          f"吞吐量 {summary['throughput_rps']} rps，错误率 {summary['error_rate']}")
+    for metric in ("ttft", "ttlt"):
+        values = summary[metric]
+        print(f"  {metric}: p50={values['p50_ms']}ms p90={values['p90_ms']}ms p99={values['p99_ms']}ms")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="NexusAI 网关压测")
+    load = parser.add_argument_group("负载")
+    load.add_argument("--concurrency", type=int, default=10, help="闭环模式的并发数")
+    load.add_argument("--rate", type=float, default=0.0, help="开环模式的请求速率（请求/秒），大于 0 时启用")
+    load.add_argument("--duration", type=float, default=10.0, help="每轮压测持续时间（秒）")
+    load.add_argument("--max-requests", type=int, default=0, help="每轮最多请求数")
+    load.add_argument("--no-stream", action="store_true", help="使用非流式请求")
+    load.add_argument("--warmup", type=float, default=2.0, help="正式压测前的预热时间（秒）")
+    load.add_argument("--skip-direct", action="store_true", help="不压测直连上游（不计算网关开销）")
+
+    upstream = parser.add_argument_group("模拟上游")
+    upstream.add_argument("--latency", type=float, default=0.05)
+    upstream.add_argument("--token-rate", type=float, default=0.0)
+    upstream.add_argument("--completion-tokens", type=int, default=64)
+    upstream.add_argument("--chunk-tokens", type=int, default=1)
+    upstream.add_argument("--error-rate", type=float, default=0.0)
+    upstream.add_argument("--grok-style", action="store_true")
+
+    gateway = parser.add_argument_group("网关")
+    gateway.add_argument("--workers", type=int, default=1, help="API 工作进程数，大于 1 时通过 run.py 启动")
+    gateway.add_argument("--log-level", default="INFO", help="网关日志级别，默认与生产配置一致")
+
+    parser.add_argument("--output", help="结果文件路径，默认 bench/results/<时间>.json")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    upstream_port = free_port()
+    gateway_port = 5231 if args.workers > 1 else free_port()
+    upstream_process = gateway_process = None
+
+    with tempfile.TemporaryDirectory(prefix="nexusai-bench-") as workdir:
+        workdir = Path(workdir)
+        try:
+            upstream_process = start_upstream(args, upstream_port)
+            upstream_base = f"http://127.0.0.1:{upstream_port}/v1"
+            wait_ready(f"{upstream_base}/models", process=upstream_process)
+
+            seed_workdir(workdir, f"{upstream_base}/")
+            gateway_process = start_gateway(args, workdir, gateway_port, upstream_port)
+            gateway_url = f"http://127.0.0.1:{gateway_port}/v1/chat/completions"
+            wait_ready(f"http://127.0.0.1:{gateway_port}/v1/models", process=gateway_process)
+
+            results: Dict[str, Any] = {}
+            if not args.skip_direct:
+                results["direct"] = asyncio.run(run_load(load_config(args, f"{upstream_base}/chat/completions")))
+                print_summary("直连上游", results["direct"])
+
+            if args.warmup:
+                warmup = load_config(args, gateway_url)
+                warmup.duration = args.warmup
+                asyncio.run(run_load(warmup))
+
+            before = resource_usage(gateway_process.pid)
+            results["gateway"] = asyncio.run(run_load(load_config(args, gateway_url)))
+            after = resource_usage(gateway_process.pid)
+            print_summary("经网关", results["gateway"])
+        finally:
+            stop(gateway_process)
+            stop(upstream_process)
+
+    cpu = after["cpu_seconds"] - before["cpu_seconds"]
+    requests = results["gateway"]["requests"]
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "args": vars(args),
+        **results,
+        "resources": {
+            "cpu_seconds": round(cpu, 3),
+            "cpu_seconds_per_1k": round(cpu / requests * 1000, 3) if requests else None,
+            "cpu_utilization": round(cpu / results["gateway"]["elapsed_s"], 3),
+            "rss_mb": after["rss_mb"]
+        }
+    }
+    if "direct" in results:
+        report["overhead"] = overhead(results["direct"], results["gateway"])
+        print(f"网关开销: {report['overhead']}")
+    print(f"网关资源: {report['resources']}")
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"结果已保存到 {output}")
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(previous, report)))
+    return report
+
+
+if __name__ == "__main__":
+    main()
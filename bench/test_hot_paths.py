@@ -0,0 +1,218 @@
+"""
+网关热点路径的微基准测试
+
+python -m pytest bench/test_hot_paths.py
+# 安装 pytest-benchmark 后可保存并对比结果，例如超过 10% 的回归时失败：
+python -m pytest bench/test_hot_paths.py --benchmark-autosave --benchmark-compare --benchmark-compare-fail=mean:10%
+"""
+import asyncio
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from chat_processing import SSE_DONE, flatten_messages, normalize_grok_chunk, parse_sse_line
+from routing import RoutingIndex
+from save_messages import get_china_time, save_message_to_file
+from stats_tracker import StatsTracker
+
+PARAGRAPH = ("请根据下面的材料总结要点，并给出三条改进建议。The quick brown fox jumps over the lazy dog. "
+             "在高并发场景下，网关需要尽量减少每个请求的额外开销。") * 3
+STREAM_CHUNKS = 10_000
+
+
+@pytest.fixture(scope="module")
+def long_conversation():
+    """200 轮的多轮对话（含 system 消息）"""
+    messages = [{"role": "system", "content": "你是一个乐于助人的助手。"}]
+    for turn in range(200):
+        role = "user" if turn % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": f"第 {turn} 轮：{PARAGRAPH}"})
+    return messages
+
+
+@pytest.fixture(scope="module")
+def multimodal_conversation():
+    """100 条多模态消息，每条包含多个文本片段和图片"""
+    messages = []
+    for turn in range(100):
+        messages.append({"role": "user", "content": [
+            {"type": "text", "text": f"图片 {turn} 的说明：{PARAGRAPH}"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64," + "A" * 2048}},
+            {"type": "text", "text": "请描述图片中的内容。"},
+        ]})
+    return messages
+
+
+def sse_lines(chunks, grok_style=False):
+    """构造上游的 SSE 行：每 100 块一个心跳注释，最后是结束标记"""
+    lines = []
+    for index in range(chunks):
+        text = f"词{index} "
+        if grok_style:
+            variants = ({"choices": [{"delta": text}]}, {"choices": [{"message": {"content": text}}]},
+                        {"choices": [{"text": text}]})
+            payload = variants[index % 3]
+        else:
+            payload = {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 1700000000,
+                       "model": "gpt-4o", "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+        lines.append("data: " + json.dumps(payload, ensure_ascii=False))
+        lines.append("")
+        if index % 100 == 99:
+            lines.append(": keep-alive")
+    lines.append("data: [DONE]")
+    return lines
+
+
+def relay(lines, is_grok_model, model_name="grok-3"):
+    """与 stream_generator 相同的逐行处理：解析、（Grok）规范化、重新序列化"""
+    output = []
+    content = []
+    for line in lines:
+        data_str = parse_sse_line(line)
+        if data_str is None:
+            continue
+        if data_str == SSE_DONE:
+            output.append(b"data: [DONE]\n\n")
+            continue
+        data = json.loads(data_str)
+        if is_grok_model:
+            text = normalize_grok_chunk(data, model_name)
+            if text:
+                content.append(text)
+        output.append(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+    return output, "".join(content)
+
+
+@pytest.fixture(scope="module")
+def standard_stream():
+    return sse_lines(STREAM_CHUNKS)
+
+
+@pytest.fixture(scope="module")
+def grok_stream():
+    return sse_lines(STREAM_CHUNKS, grok_style=True)
+
+
+def test_flatten_long_conversation(benchmark, long_conversation):
+    text = benchmark(flatten_messages, long_conversation)
+    assert PARAGRAPH in text
+
+
+def test_flatten_multimodal(benchmark, multimodal_conversation):
+    text = benchmark(flatten_messages, multimodal_conversation)
+    assert "base64" not in text
+
+
+def test_sse_relay_standard(benchmark, standard_stream):
+    output, _ = benchmark(relay, standard_stream, False)
+    assert len(output) == STREAM_CHUNKS + 1
+
+
+def test_sse_relay_grok(benchmark, grok_stream):
+    output, content = benchmark(relay, grok_stream, True)
+    assert len(output) == STREAM_CHUNKS + 1
+    assert content.startswith("词0 词1 ")
+
+
+def test_grok_normalize_only(benchmark, grok_stream):
+    # 只测规范化本身：预先解析好数据块，每轮使用新副本（规范化会就地修改）
+    chunks = [json.loads(parse_sse_line(line)) for line in grok_stream[:3000]
+              if parse_sse_line(line) not in (None, SSE_DONE)]
+
+    def setup():
+        return ([json.loads(json.dumps(chunk)) for chunk in chunks],), {}
+
+    def normalize_all(batch):
+        for chunk in batch:
+            normalize_grok_chunk(chunk, "grok-3")
+
+    benchmark.pedantic(normalize_all, setup=setup, rounds=20)
+
+
+@pytest.mark.parametrize("existing", [0, 200])
+def test_save_message_to_file(benchmark, tmp_path, monkeypatch, long_conversation, existing):
+    """existing 为本分钟的文件中已有的记录数（当前实现每次都读出并重写整个文件）"""
+    monkeypatch.chdir(tmp_path)
+    record = {
+        "timestamp": "2025-01-01T00:00:00",
+        "headers": {"content-type": "application/json", "user-agent": "bench"},
+        "target_url": "http://localhost:5231/v1/chat/completions",
+        "client_host": "127.0.0.1",
+        "request_body": {"model": "gpt-4o", "messages": long_conversation[:20], "stream": True},
+        "conversation_content": {"prompt": flatten_messages(long_conversation[:20]), "completion": ""}
+    }
+
+    def setup():
+        now = get_china_time()
+        dir_path = tmp_path / "messages" / f"{now.year}" / f"{now.month:02d}" / f"{now.day:02d}" / f"{now.hour:02d}"
+        dir_path.mkdir(parents=True, exist_ok=True)
+        file_path = dir_path / f"messages_{now.strftime('%Y%m%d-%H%M')}.json"
+        if existing:
+            file_path.write_text(json.dumps([record] * existing, ensure_ascii=False), encoding="utf-8")
+        elif file_path.exists():
+            file_path.unlink()
+        return (record,), {}
+
+    benchmark.pedantic(save_message_to_file, setup=setup, rounds=20)
+
+
+def test_record_chat(benchmark, tmp_path):
+    """单次统计写入（token 计数替换为本地估算，只测数据库写入路径）"""
+    tracker = StatsTracker(db_path=tmp_path / "stats.db")
+
+    async def count_tokens(text, provider_key=None):
+        return len(text.encode('utf-8')) // 4
+
+    tracker.tokenizer.count_tokens = count_tokens
+    loop = asyncio.new_event_loop()
+    try:
+        benchmark(lambda: loop.run_until_complete(
+            tracker.record_chat("conv-1", 1, "gpt-4o", 0, False, message=PARAGRAPH, personalized_key="k")
+        ))
+    finally:
+        loop.close()
+
+
+@pytest.fixture(scope="module")
+def large_routing_index():
+    """50 个提供商 x 40 个模型"""
+    providers = []
+    model_id = 0
+    for provider_id in range(1, 51):
+        records = []
+        for index in range(40):
+            model_id += 1
+            records.append((model_id, f"model-{index}", 1700000000 + model_id))
+        providers.append({
+            "id": provider_id, "name": f"provider-{provider_id}", "server_url": "https://example.com",
+            "server_key": "sk", "personalized_key": f"key-{provider_id % 5}", "description": "",
+            "models": [name for _, name, _ in records], "model_records": records
+        })
+    return RoutingIndex(lambda: providers)
+
+
+def test_list_models_cold(benchmark, large_routing_index):
+    """路由索引重建后的首次 /v1/models 序列化（全部模型）"""
+    def setup():
+        large_routing_index._models_cache = {}
+        return (None,), {}
+
+    body, _ = benchmark.pedantic(large_routing_index.models_payload, setup=setup, rounds=50)
+    assert len(json.loads(body)["data"]) == 2000
+
+
+def test_list_models_cold_for_key(benchmark, large_routing_index):
+    def setup():
+        large_routing_index._models_cache = {}
+        return ("key-1",), {}
+
+    body, _ = benchmark.pedantic(large_routing_index.models_payload, setup=setup, rounds=50)
+    assert len(json.loads(body)["data"]) == 400
+
+
+def test_list_models_cached(benchmark, large_routing_index):
+    large_routing_index.models_payload(None)
+    benchmark(large_routing_index.models_payload, None)
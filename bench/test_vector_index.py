@@ -0,0 +1,97 @@
+"""
+向量检索的延迟与召回率基准
+
+python -m pytest bench/test_vector_index.py -s
+# 默认 20 万 x 128 维；百万级：
+NEXUSAI_BENCH_VECTORS=1000000 python -m pytest bench/test_vector_index.py -s
+"""
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from embedding_store import normalize_rows
+from vector_index import ExactIndex, IVFIndex
+
+VECTORS = int(os.environ.get("NEXUSAI_BENCH_VECTORS", 200_000))
+DIM = int(os.environ.get("NEXUSAI_BENCH_DIM", 128))
+QUERIES = 100
+TOP_K = 10
+# 批量检索（例如评测）的问题数
+BATCH_QUERIES = 2000
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    """带簇结构的归一化向量（近似真实嵌入的分布）和附近的查询"""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(1000, DIM)).astype(np.float32)
+    matrix = np.empty((VECTORS, DIM), dtype=np.float32)
+    for start in range(0, VECTORS, 100_000):
+        size = min(100_000, VECTORS - start)
+        block = centers[rng.integers(0, len(centers), size)] + 1.0 * rng.normal(size=(size, DIM)).astype(np.float32)
+        matrix[start:start + size] = normalize_rows(block)
+    queries = matrix[rng.choice(VECTORS, QUERIES, replace=False)] + 0.3 * rng.normal(size=(QUERIES, DIM)).astype(np.float32)
+    return matrix, queries
+
+
+@pytest.fixture(scope="module")
+def exact(corpus):
+    return ExactIndex(corpus[0])
+
+
+@pytest.fixture(scope="module")
+def ivf(corpus):
+    return IVFIndex.build(corpus[0])
+
+
+@pytest.fixture(scope="module")
+def ground_truth(corpus, exact):
+    return [set(exact.search(query, TOP_K)[0].tolist()) for query in corpus[1]]
+
+
+def recall(index, queries, ground_truth, **kwargs):
+    hits = sum(len(truth & set(index.search(query, TOP_K, **kwargs)[0].tolist()))
+               for query, truth in zip(queries, ground_truth))
+    return hits / (len(queries) * TOP_K)
+
+
+def test_exact_search(benchmark, corpus, exact):
+    query = corpus[1][0]
+    indices, _ = benchmark(exact.search, query, TOP_K)
+    assert len(indices) == TOP_K
+
+
+@pytest.mark.parametrize("nprobe", [8, 32, None])
+def test_ivf_search(benchmark, corpus, ivf, ground_truth, nprobe):
+    """nprobe 为 None 时使用索引的默认值（nlist / 16）"""
+    measured = recall(ivf, corpus[1], ground_truth, nprobe=nprobe)
+    benchmark.extra_info["recall_at_10"] = measured
+    print(f"\nIVF nlist={ivf.nlist} nprobe={nprobe or ivf.nprobe} recall@{TOP_K}={measured:.3f}")
+    benchmark(ivf.search, corpus[1][0], TOP_K, nprobe)
+    if nprobe is None:
+        assert measured >= 0.9
+
+
+@pytest.fixture(scope="module")
+def batch_queries(corpus):
+    rng = np.random.default_rng(1)
+    return corpus[1][rng.integers(0, QUERIES, BATCH_QUERIES)] + 0.05 * rng.normal(size=(BATCH_QUERIES, DIM)).astype(np.float32)
+
+
+@pytest.mark.parametrize("kind", ["exact", "ivf"])
+def test_search_batch(benchmark, request, batch_queries, kind):
+    """BATCH_QUERIES 个问题一次批量检索（精确检索为分块矩阵乘），对比逐个检索"""
+    index = request.getfixturevalue(kind)
+    sample = batch_queries[:100]
+    start = time.perf_counter()
+    for query in sample:
+        index.search(query, TOP_K)
+    loop_seconds = (time.perf_counter() - start) * BATCH_QUERIES / len(sample)
+    results = benchmark(index.search_batch, batch_queries, TOP_K)
+    benchmark.extra_info["loop_seconds_estimate"] = loop_seconds
+    print(f"\n{kind}: {BATCH_QUERIES} 个问题逐个检索约 {loop_seconds:.2f}s")
+    assert len(results) == BATCH_QUERIES
@@ -0,0 +1,177 @@
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+# parse_sse_line 的返回值：上游发送的结束标记
+SSE_DONE = "[DONE]"
+
+
+def flatten_messages(messages: Any) -> str:
+    """
+    把请求中的 messages 拼接为用于计算 prompt token 的文本
+
+    支持字符串内容和多模态内容列表（只取 type 为 text 的部分），文件数据以占位文本代替。
+    """
+    if not isinstance(messages, list):
+        return str(messages)
+
+    parts = []
+    for msg in messages:
+        if isinstance(msg, dict):
+            content = msg.get("content", "")
+            if isinstance(content, list):
+                for item in content:
+                    if isinstance(item, dict) and item.get("type") == "text":
+                        parts.append(item.get("text", ""))
+            elif isinstance(content, str):
+                parts.append(content)
+        elif isinstance(msg, str):
+            parts.append(msg)
+        elif isinstance(msg, list):
+            # 文件数据（如图片）
+            parts.append("包含文件数据")
+    return "".join(parts)
+
+
+def parse_sse_line(line: str) -> Optional[str]:
+    """
+    解析上游的一行 SSE 数据
+
+    Returns:
+        数据内容（去掉 data: 前缀）；结束标记返回 SSE_DONE；空行和注释/心跳行返回 None
+    """
+    line = line.strip()
+    if not line or line.startswith(':'):
+        return None
+    if line.startswith('data:'):
+        line = line[5:].strip()
+        if not line:
+            return None
+    return line
+
+
+def normalize_grok_chunk(data: Dict[str, Any], model_name: str) -> str:
+    """
+    把 Grok 等非标准格式的流式数据块就地转换为 OpenAI chat.completion.chunk 格式
+
+    兼容 delta 为字符串、message、text、content 等字段形式，并补齐 id/object/created/model。
+
+    Returns:
+        该数据块中的文本内容
+    """
+    if not data.get("choices"):
+        data["choices"] = [{"index": 0}]
+
+    choice = data["choices"][0]
+    content = ""
+
+    if "delta" in choice:
+        delta = choice["delta"]
+        if isinstance(delta, dict):
+            if "content" in delta:
+                content = delta["content"]
+            if "role" not in delta:
+                delta["role"] = "assistant"
+        elif isinstance(delta, str):
+            content = delta
+            choice["delta"] = {"role": "assistant", "content": content}
+    elif "message" in choice:
+        message = choice.pop("message")
+        if isinstance(message, dict):
+            content = message.get("content", "")
+            role = message.get("role", "assistant")
+        else:
+            content = str(message)
+            role = "assistant"
+        choice["delta"] = {"role": role, "content": content}
+    elif "text" in choice:
+        content = choice.pop("text")
+        choice["delta"] = {"role": "assistant", "content": content}
+    elif "content" in choice:
+        content = choice.pop("content")
+        choice["delta"] = {"role": "assistant", "content": content}
+    else:
+        choice["delta"] = {"role": "assistant", "content": ""}
+
+    if "index" not in choice:
+        choice["index"] = 0
+
+    if "id" not in data:
+        data["id"] = f"chatcmpl-{uuid.uuid4()}"
+    if "object" not in data:
+        data["object"] = "chat.completion.chunk"
+    if "created" not in data:
+        data["created"] = int(time.time())
+    if "model" not in data:
+        data["model"] = model_name
+
+    return content or ""
+
+
+def delta_content(data: Dict[str, Any]) -> str:
+    """返回标准 chat.completion.chunk 数据块中的增量文本"""
+    choices = data.get("choices")
+    if not choices or not isinstance(choices, list) or not isinstance(choices[0], dict):
+        return ""
+    delta = choices[0].get("delta")
+    if not isinstance(delta, dict):
+        return ""
+    return delta.get("content") or ""
+
+
+class CompletionAccumulator:
+    """
+    累计流式响应的完成内容和 token 数
+
+    文本片段保存在列表中，结束时才拼接；每个片段到达时用本地计数函数累加 token 数。
+    上游在数据块中返回 usage（例如 stream_options.include_usage）时以上游的数值为准。
+    """
+
+    def __init__(self, counter: Callable[[str], int]):
+        """
+        Args:
+            counter: 本地 token 计数函数，例如 my_tokenizer.count_tokens_local
+        """
+        self.counter = counter
+        self.parts: List[str] = []
+        self.counted_tokens = 0
+        self.usage: Optional[Dict[str, Any]] = None
+        self._text: Optional[str] = None
+
+    def add(self, content: str):
+        if not content:
+            return
+        self.parts.append(content)
+        self.counted_tokens += self.counter(content)
+        self._text = None
+
+    def observe_usage(self, data: Dict[str, Any]):
+        usage = data.get("usage")
+        if isinstance(usage, dict) and isinstance(usage.get("completion_tokens"), int):
+            self.usage = usage
+
+    def feed(self, data: Dict[str, Any]) -> str:
+        """处理一个标准格式的数据块，返回其中的增量文本"""
+        content = delta_content(data)
+        self.add(content)
+        self.observe_usage(data)
+        return content
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "".join(self.parts)
+        return self._text
+
+    @property
+    def completion_tokens(self) -> int:
+        if self.usage is not None:
+            return self.usage["completion_tokens"]
+        return self.counted_tokens
+
+    @property
+    def prompt_tokens(self) -> Optional[int]:
+        """上游返回的 prompt token 数（没有 usage 时为 None）"""
+        if self.usage is not None and isinstance(self.usage.get("prompt_tokens"), int):
+            return self.usage["prompt_tokens"]
+        return None
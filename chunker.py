@@ -0,0 +1,135 @@
+import re
+from typing import Callable, List, Tuple
+
+from my_tokenizer import count_tokens_local
+
+# 每个文本块的目标 token 数和相邻文本块的重叠 token 数
+DEFAULT_CHUNK_TOKENS = 512
+DEFAULT_OVERLAP_TOKENS = 64
+
+# 中日韩字符的范围（用于正则字符类）
+CJK_CHARS = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+# 句子：中文句末标点（可跟引号/括号）后直接断开，英文句末标点后需有空白，换行也是边界
+_SENTENCE_PATTERN = re.compile(
+    r'.+?(?:[。！？；…]+[”’"\'）)》」』]*\s*|[.!?;]+[”’"\')\]]*(?:\s+|$)|\n\s*|$)', re.S
+)
+# 分句：逗号、顿号、冒号等
+_CLAUSE_PATTERN = re.compile(r'.+?(?:[，、：,:]\s*|$)', re.S)
+# 最小切分单位：单个中日韩字符或一个英文单词（连同后面的空白）
+_UNIT_PATTERN = re.compile(rf'[{CJK_CHARS}]\s*|[^\s{CJK_CHARS}]+\s*|\s+')
+# 段落结束：句子以空行结尾
+_PARAGRAPH_END = re.compile(r'\n\s*\n\s*$')
+
+Piece = Tuple[str, int, bool]  # (文本, token 数, 是否为段落结尾)
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    按句子切分文本，保留原有的标点和空白（各部分直接拼接即为原文）
+
+    中日韩文本在 。！？； 等标点处断开，英文在 . ! ? 后跟空白处断开，换行也视为边界。
+    """
+    return [sentence for sentence in _SENTENCE_PATTERN.findall(text) if sentence]
+
+
+def _split_long(piece: str, max_tokens: int, counter: Callable[[str], int]) -> List[str]:
+    """把超过 max_tokens 的句子依次按分句、单词/字符切开"""
+    for pattern in (_CLAUSE_PATTERN, _UNIT_PATTERN):
+        parts = [part for part in pattern.findall(piece) if part]
+        if len(parts) > 1:
+            break
+    else:
+        # 没有可用边界的超长单词（例如很长的 URL）按字符截断
+        return [piece[start:start + max_tokens] for start in range(0, len(piece), max_tokens)]
+
+    pieces, current, current_tokens = [], "", 0
+    for part in parts:
+        tokens = counter(part)
+        if tokens > max_tokens:
+            if current:
+                pieces.append(current)
+                current, current_tokens = "", 0
+            pieces.extend(_split_long(part, max_tokens, counter))
+        elif current and current_tokens + tokens > max_tokens:
+            pieces.append(current)
+            current, current_tokens = part, tokens
+        else:
+            current += part
+            current_tokens += tokens
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _paragraph_cut(window: List[Piece], chunk_tokens: int) -> int:
+    """窗口后半部分中最后一个段落结尾之后的位置，没有时返回窗口长度"""
+    total = 0
+    cut = len(window)
+    for position, (_, tokens, paragraph_end) in enumerate(window[:-1]):
+        total += tokens
+        if paragraph_end and total >= chunk_tokens // 2:
+            cut = position + 1
+    return cut
+
+
+def _overlap(window: List[Piece], overlap_tokens: int) -> List[Piece]:
+    """窗口末尾不超过 overlap_tokens 的完整句子"""
+    overlap, total = [], 0
+    for piece in reversed(window):
+        if total + piece[1] > overlap_tokens:
+            break
+        overlap.insert(0, piece)
+        total += piece[1]
+    return overlap
+
+
+def chunk_text(text: str, chunk_tokens: int = DEFAULT_CHUNK_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+               counter: Callable[[str], int] = count_tokens_local) -> List[str]:
+    """
+    按 token 数把文本切成大小相近的文本块
+
+    以句子为单位装箱，文本块不超过 chunk_tokens（按各句 token 数之和计）；超长的句子再按
+    分句、单词或字符切开。文本块已超过一半时优先在段落结尾处断开，此时不重叠；否则相邻
+    文本块重叠末尾不超过 overlap_tokens 的完整句子，使跨块的内容在两个文本块中都有上下文。
+
+    Args:
+        text: 文本
+        chunk_tokens: 每个文本块的最大 token 数
+        overlap_tokens: 相邻文本块的最大重叠 token 数（须小于 chunk_tokens）
+        counter: token 计数函数，默认使用本地 tokenizer
+
+    Returns:
+        去除首尾空白后的文本块列表
+    """
+    if chunk_tokens <= 0:
+        raise ValueError("chunk_tokens 必须大于 0")
+    if not 0 <= overlap_tokens < chunk_tokens:
+        raise ValueError("overlap_tokens 必须不小于 0 且小于 chunk_tokens")
+
+    pieces: List[Piece] = []
+    for sentence in split_sentences(text):
+        paragraph_end = bool(_PARAGRAPH_END.search(sentence))
+        tokens = counter(sentence)
+        if tokens > chunk_tokens:
+            parts = _split_long(sentence, chunk_tokens, counter)
+            pieces.extend((part, counter(part), paragraph_end and index == len(parts) - 1)
+                          for index, part in enumerate(parts))
+        else:
+            pieces.append((sentence, tokens, paragraph_end))
+
+    chunks = []
+    window: List[Piece] = []
+    for piece in pieces:
+        while window and sum(p[1] for p in window) + piece[1] > chunk_tokens:
+            cut = _paragraph_cut(window, chunk_tokens)
+            chunks.append("".join(p[0] for p in window[:cut]))
+            if cut < len(window):
+                window = window[cut:]
+                continue
+            window = _overlap(window, overlap_tokens)
+            while window and sum(p[1] for p in window) + piece[1] > chunk_tokens:
+                window.pop(0)
+        window.append(piece)
+    if window:
+        chunks.append("".join(p[0] for p in window))
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
@@ -0,0 +1,4 @@
+# Tokenizer API配置
+TOKENIZER_API_KEY = "your_tokenizer_api_key_here"
+TOKENIZER_API_URL = "https://ark.cn-beijing.volces.com/api/v3/tokenization" 
+TOKENIZER_MODEL_ID = "ep-20250211xxxxx-xxxxx"  # 替换为实际的模型ID 
\ No newline at end of file
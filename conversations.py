@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List
+
+# 内存中保留的会话数上限（最近使用的优先保留）
+DEFAULT_MAX_CONVERSATIONS = 256
+# 每次请求携带的历史 + 新消息的 token 预算
+DEFAULT_MAX_CONTEXT_TOKENS = 4096
+
+
+@dataclass
+class HistoryMessage:
+    role: str
+    content: str
+    tokens: int  # 写入时计算一次，之后截断历史时直接使用
+
+
+@dataclass
+class Conversation:
+    conversation_id: str
+    messages: List[HistoryMessage] = field(default_factory=list)
+    # 同一会话的多轮请求依次进行，保证每轮都能看到上一轮的回复
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def append(self, role: str, content: str, tokens: int):
+        self.messages.append(HistoryMessage(role, content, tokens))
+
+    def context(self, max_tokens: int) -> List[HistoryMessage]:
+        """
+        返回 token 数不超过预算的最近若干条消息
+
+        从最新的消息向前累加缓存的 token 数，超出预算时停止；最新一条总是保留。
+        截断后如果以 assistant 消息开头则去掉它，使上下文从用户消息开始。
+        """
+        total = 0
+        start = len(self.messages)
+        for index in range(len(self.messages) - 1, -1, -1):
+            total += self.messages[index].tokens
+            if total > max_tokens and index < len(self.messages) - 1:
+                break
+            start = index
+        while start < len(self.messages) - 1 and self.messages[start].role != "user":
+            start += 1
+        return self.messages[start:]
+
+
+class ConversationStore:
+    """
+    WebSocket 多轮对话的服务端历史
+
+    会话按 conversation_id 保存在有界的 LRU 中。每条消息在记录统计时已写入 chat_messages，
+    所以淘汰时只需丢弃内存中的副本；再次使用被淘汰（或其他进程创建）的会话时，
+    通过 loader 从 chat_messages 读回，包括每条消息已保存的 token 数，不需要重新计算。
+    """
+
+    def __init__(self, loader: Callable[[str], Awaitable[List[Dict[str, Any]]]],
+                 max_conversations: int = DEFAULT_MAX_CONVERSATIONS,
+                 max_context_tokens: int = DEFAULT_MAX_CONTEXT_TOKENS):
+        """
+        Args:
+            loader: 根据会话ID返回历史消息（包含 role、content、tokens_count），
+                例如 StatsTracker.get_conversation_messages
+            max_conversations: 内存中保留的会话数上限
+            max_context_tokens: 每次请求的历史 token 预算
+        """
+        self.loader = loader
+        self.max_conversations = max_conversations
+        self.max_context_tokens = max_context_tokens
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self.logger = logging.getLogger('nexusai.conversations')
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def __contains__(self, conversation_id: str):
+        return conversation_id in self._conversations
+
+    async def get(self, conversation_id: str) -> Conversation:
+        """返回会话（不存在时从 chat_messages 加载，没有记录则新建）"""
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            self._conversations.move_to_end(conversation_id)
+            return conversation
+
+        conversation = Conversation(conversation_id)
+        try:
+            for row in await self.loader(conversation_id):
+                conversation.append(row["role"], row["content"], row.get("tokens_count") or 0)
+        except Exception as e:
+            self.logger.error(f"加载会话历史失败 [会话ID: {conversation_id}]: {str(e)}")
+
+        # 加载期间可能已有同一会话的其他请求创建了它
+        existing = self._conversations.get(conversation_id)
+        if existing is not None:
+            self._conversations.move_to_end(conversation_id)
+            return existing
+
+        self._conversations[conversation_id] = conversation
+        while len(self._conversations) > self.max_conversations:
+            # 正在进行中的会话持有引用，淘汰后仍可完成本轮
+            self._conversations.popitem(last=False)
+        return conversation
+
+    def discard(self, conversation_id: str):
+        self._conversations.pop(conversation_id, None)
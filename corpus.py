@@ -0,0 +1,286 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+from lexical_index import DEFAULT_RRF_K, BM25Index, fused_search
+from pdf_pipeline import abatches
+from vector_index import build_index, load_index
+
+STORE_DIR = "store"
+INDEX_DIR = "index"
+LEXICAL_DIR = "lexical"
+MANIFEST_FILE = "documents.json"
+# 导入文档时每批读取的文本块数和同时进行的嵌入批次数
+DEFAULT_INGEST_BATCH = 256
+DEFAULT_INGEST_CONCURRENCY = 2
+
+EmbedFunc = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+
+def content_hash(text: str) -> str:
+    """文本块的内容哈希（忽略空白差异）"""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class DocumentCorpus:
+    """
+    多文档语料库：文本块按内容哈希去重，支持增量更新和删除文档
+
+    目录结构：
+        documents.json  文档清单：每个文档的来源、更新时间和文本块（哈希 + 页码等元数据）
+        store/          去重后的文本块向量（EmbeddingStore），记录中带 hash
+        store/index/    向量索引
+        store/lexical/  BM25 词法索引
+
+    相同内容的文本块只嵌入一次，所以重新导入修改过的文档时只为变化的文本块请求嵌入接口，
+    不同文档中的相同段落也共享同一个向量。add_document / remove_document 的结果在 save()
+    后写入磁盘并对检索可见；save() 同时清理不再被任何文档引用的文本块。
+    """
+
+    def __init__(self, directory: Union[str, Path], embedding_model: str = "", dtype: str = "float32"):
+        """
+        Args:
+            directory: 语料库目录（不存在时在 save() 时创建）
+            embedding_model: 嵌入模型，与已有语料库不一致时报错（不同模型的向量不能混用）
+            dtype: 向量的存储精度，见 EmbeddingStore
+        """
+        self.directory = Path(directory)
+        self.embedding_model = embedding_model
+        self.dtype = dtype
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.store: Optional[EmbeddingStore] = None
+        self.index = None
+        self.lexical: Optional[BM25Index] = None
+        self.rows: Dict[str, int] = {}  # 哈希 -> store 中的行号
+        self.pending: Dict[str, tuple] = {}  # 哈希 -> (文本, 向量)，尚未保存
+        self._owners: Optional[Dict[str, List[str]]] = None  # 哈希 -> 引用它的文档ID，检索时按需构建
+        self.logger = logging.getLogger('nexusai.corpus')
+        self._load()
+
+    def _load(self):
+        manifest_path = self.directory / MANIFEST_FILE
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            stored_model = manifest.get("embedding_model", "")
+            if self.embedding_model and stored_model and stored_model != self.embedding_model:
+                raise ValueError(f"语料库使用的嵌入模型为 {stored_model}，与 {self.embedding_model} 不一致")
+            self.embedding_model = self.embedding_model or stored_model
+            self.documents = manifest.get("documents", {})
+            self.rows = {chunk_hash: row for row, chunk_hash in enumerate(manifest.get("rows", []))}
+        store_path = self.directory / STORE_DIR
+        if (store_path / "meta.json").exists():
+            self.store = EmbeddingStore.load(store_path)
+            if len(self.store) != len(self.rows):
+                # 保存过程中断时清单可能与向量不一致，以向量存储中的记录为准
+                self.rows = {self.store.chunks[row]["hash"]: row for row in range(len(self.store))}
+            index_path = store_path / INDEX_DIR
+            if index_path.exists():
+                self.index = load_index(index_path, self.store.matrix())
+            else:
+                self.index = build_index(self.store.matrix())
+            lexical_path = store_path / LEXICAL_DIR
+            if (lexical_path / "lexical.json").exists():
+                self.lexical = BM25Index.load(lexical_path)
+            else:
+                # 早期版本保存的语料库没有词法索引，在内存中构建（下次 save() 时写入）
+                self.lexical = BM25Index.build(self.store.texts)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, doc_id: str):
+        return doc_id in self.documents
+
+    def _references(self, exclude: Optional[str] = None) -> set:
+        return {chunk["hash"] for doc_id, document in self.documents.items() if doc_id != exclude
+                for chunk in document["chunks"]}
+
+    async def add_document(self, doc_id: str, chunks: Iterable[Union[str, Dict[str, Any]]], embed: EmbedFunc,
+                           source: Optional[str] = None, batch_size: int = DEFAULT_INGEST_BATCH,
+                           concurrency: int = DEFAULT_INGEST_CONCURRENCY) -> Dict[str, Any]:
+        """
+        添加或更新文档，只为语料库中还没有的文本块请求嵌入
+
+        chunks 可以是生成器（例如 pdf_pipeline.iter_chunks）：在后台线程中按批读取，
+        读取下一批的同时前面的批次在请求嵌入，不需要先得到整个文档的文本。
+
+        Args:
+            doc_id: 文档ID，已存在时替换该文档的文本块
+            chunks: 文本或 {"text": ..., 其他元数据（例如 page）} 记录
+            embed: 批量嵌入函数，例如 EmbeddingClient.embed
+            source: 文档来源（例如文件路径）
+            batch_size: 每批读取的文本块数
+            concurrency: 同时进行的嵌入批次数
+
+        Returns:
+            统计：文本块数、新嵌入数、复用数、不再引用的文本块数
+        """
+        entries: List[Dict[str, Any]] = []
+        hashes = set()
+        requested = set()
+        embedded = 0
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = []
+
+        async def embed_missing(missing: Dict[str, str]):
+            async with semaphore:
+                vectors = await embed(list(missing.values()))
+            for (chunk_hash, text), vector in zip(missing.items(), vectors):
+                self.pending[chunk_hash] = (text, vector)
+
+        try:
+            async for batch in abatches(chunks, batch_size):
+                missing: Dict[str, str] = {}
+                for chunk in batch:
+                    record = chunk if isinstance(chunk, dict) else {"text": chunk}
+                    chunk_hash = content_hash(record["text"])
+                    entries.append({"hash": chunk_hash, **{key: value for key, value in record.items() if key != "text"}})
+                    hashes.add(chunk_hash)
+                    if chunk_hash not in self.rows and chunk_hash not in self.pending and chunk_hash not in requested:
+                        missing[chunk_hash] = record["text"]
+                        requested.add(chunk_hash)
+                if missing:
+                    embedded += len(missing)
+                    tasks.append(asyncio.create_task(embed_missing(missing)))
+                # 在途的嵌入批次达到上限时等待，避免读取远快于嵌入时积压
+                while sum(not task.done() for task in tasks) >= concurrency:
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        previous = {chunk["hash"] for chunk in self.documents.get(doc_id, {}).get("chunks", [])}
+        self.documents[doc_id] = {
+            "source": source,
+            "updated_at": datetime.now().isoformat(),
+            "chunks": entries
+        }
+        self._owners = None
+        orphaned = previous - hashes - self._references(exclude=doc_id)
+        stats = {"document": doc_id, "chunks": len(entries), "embedded": embedded,
+                 "reused": len(hashes) - embedded, "orphaned": len(orphaned)}
+        self.logger.info(f"文档已更新: {stats}")
+        return stats
+
+    def remove_document(self, doc_id: str) -> bool:
+        """删除文档（只被该文档引用的文本块在 save() 时清理）"""
+        self._owners = None
+        return self.documents.pop(doc_id, None) is not None
+
+    def save(self):
+        """写入新增的向量、清理不再引用的文本块、重建索引并保存文档清单"""
+        referenced = self._references()
+        kept = [chunk_hash for chunk_hash, _ in sorted(self.rows.items(), key=lambda item: item[1])
+                if chunk_hash in referenced]
+        added = [chunk_hash for chunk_hash in self.pending if chunk_hash in referenced]
+        order = kept + added
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        store_path = self.directory / STORE_DIR
+        if order:
+            parts = []
+            if kept:
+                parts.append(np.asarray(self.store.matrix()[[self.rows[h] for h in kept]], dtype=np.float32))
+            if added:
+                parts.append(np.asarray([self.pending[h][1] for h in added], dtype=np.float32))
+            matrix = np.concatenate(parts)
+            records = [{"text": self.store.chunks[self.rows[h]]["text"], "hash": h} for h in kept]
+            records += [{"text": self.pending[h][0], "hash": h} for h in added]
+
+            # 先写到临时目录再替换，旧的映射在替换前一直可用
+            tmp_path = self.directory / (STORE_DIR + ".tmp")
+            if tmp_path.exists():
+                shutil.rmtree(tmp_path)
+            store = EmbeddingStore.save(tmp_path, matrix, records, dtype=self.dtype,
+                                        extra={"embedding_model": self.embedding_model})
+            index = build_index(store.matrix())
+            index.save(tmp_path / INDEX_DIR)
+            BM25Index.build(record["text"] for record in records).save(tmp_path / LEXICAL_DIR)
+            store.close()
+            self._replace_store(tmp_path, store_path)
+            self.store = EmbeddingStore.load(store_path)
+            self.index = load_index(store_path / INDEX_DIR, self.store.matrix())
+            self.lexical = BM25Index.load(store_path / LEXICAL_DIR)
+        else:
+            self._replace_store(None, store_path)
+            self.store = None
+            self.index = None
+            self.lexical = None
+
+        self.rows = {chunk_hash: row for row, chunk_hash in enumerate(order)}
+        self.pending = {}
+        self._owners = None
+        manifest = {"embedding_model": self.embedding_model, "rows": order, "documents": self.documents}
+        tmp_manifest = self.directory / (MANIFEST_FILE + ".tmp")
+        tmp_manifest.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_manifest, self.directory / MANIFEST_FILE)
+
+    def _replace_store(self, new_path: Optional[Path], store_path: Path):
+        if self.store is not None:
+            self.store.close()
+        if store_path.exists():
+            old_path = self.directory / (STORE_DIR + ".old")
+            if old_path.exists():
+                shutil.rmtree(old_path)
+            os.replace(store_path, old_path)
+            shutil.rmtree(old_path)
+        if new_path is not None:
+            os.replace(new_path, store_path)
+
+    def search(self, query_vector, k: int = 3, query_text: Optional[str] = None, mode: Optional[str] = None,
+               rrf_k: int = DEFAULT_RRF_K, weights: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """
+        检索最相关的文本块
+
+        Args:
+            query_vector: 查询向量（lexical 模式可为 None）
+            k: 返回的文本块数
+            query_text: 查询文本，提供时默认使用 hybrid 模式
+            mode: vector / lexical / hybrid，见 lexical_index.fused_search
+            rrf_k: hybrid 模式的 RRF 平滑常数
+            weights: hybrid 模式下 (向量, 词法) 两路的权重
+
+        Returns:
+            [{"text", "score", "hash", "documents": [引用该文本块的文档ID]}]，按分数从高到低
+            （vector 为余弦相似度，lexical 为 BM25 分数，hybrid 为 RRF 分数）
+        """
+        return self.search_batch([query_vector], k, None if query_text is None else [query_text],
+                                 mode, rrf_k, weights)[0]
+
+    def search_batch(self, query_vectors, k: int = 3, query_texts: Optional[List[str]] = None,
+                     mode: Optional[str] = None, rrf_k: int = DEFAULT_RRF_K,
+                     weights: Optional[List[float]] = None) -> List[List[Dict[str, Any]]]:
+        """批量检索（向量检索为一次矩阵乘），参数和每个查询的结果格式同 search"""
+        count = len(query_texts) if query_texts is not None else len(query_vectors)
+        if self.index is None:
+            return [[] for _ in range(count)]
+        if self._owners is None:
+            self._owners = {}
+            # 复制一份再遍历：检索可能在线程中进行，同时事件循环中在导入文档
+            for doc_id, document in list(self.documents.items()):
+                for chunk in document["chunks"]:
+                    owners = self._owners.setdefault(chunk["hash"], [])
+                    if doc_id not in owners:
+                        owners.append(doc_id)
+        mode = mode or ("vector" if query_texts is None else "hybrid")
+        results = []
+        for indices, scores in fused_search(self.index, self.lexical, query_vectors, query_texts, k,
+                                            mode, rrf_k, weights):
+            hits = []
+            for row, score in zip(indices, scores):
+                record = self.store.chunks[int(row)]
+                hits.append({"text": record["text"], "score": float(score), "hash": record["hash"],
+                             "documents": list(self._owners.get(record["hash"], []))})
+            results.append(hits)
+        return results
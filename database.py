@@ -1,4 +1,5 @@
 import sqlite3
+import time
 from pathlib import Path
 
 # 使用相对路径存储数据库文件
@@ -37,6 +38,59 @@ def init_db():
     )
     ''')
     
+    # 旧数据库迁移：为模型添加稳定的创建时间（/v1/models 的 created 字段）
+    cursor.execute("PRAGMA table_info(provider_models)")
+    if "created_at" not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE provider_models ADD COLUMN created_at INTEGER")
+        cursor.execute("UPDATE provider_models SET created_at = ? WHERE created_at IS NULL", (int(time.time()),))
+    
+    # 创建限流配置表，scope 为 key（个性化密钥）或 provider（提供商ID）
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        scope TEXT NOT NULL,
+        target TEXT NOT NULL,
+        rpm INTEGER NOT NULL DEFAULT 0,
+        tpm INTEGER NOT NULL DEFAULT 0,
+        daily_tokens INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (scope, target)
+    )
+    ''')
+    
+    # 创建提供商准入（并发/排队）配置表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS provider_admission (
+        provider_id INTEGER PRIMARY KEY,
+        max_concurrency INTEGER NOT NULL,
+        max_queue INTEGER NOT NULL,
+        queue_timeout REAL NOT NULL,
+        FOREIGN KEY (provider_id) REFERENCES service_providers (id)
+    )
+    ''')
+    
+    # 创建个性化密钥优先级表，priority 为 interactive 或 batch
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS key_priorities (
+        personalized_key TEXT PRIMARY KEY,
+        priority TEXT NOT NULL DEFAULT 'interactive'
+    )
+    ''')
+    
+    # 创建模型健康表，由 test_all_url.py 的巡检写入，路由按首 token 延迟选择提供商
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS model_health (
+        provider_id INTEGER NOT NULL,
+        model_name TEXT NOT NULL,
+        success INTEGER NOT NULL,
+        supports_stream INTEGER NOT NULL DEFAULT 0,
+        ttft_ms REAL,
+        tokens_per_second REAL,
+        total_time REAL,
+        error TEXT,
+        checked_at TEXT NOT NULL,
+        PRIMARY KEY (provider_id, model_name)
+    )
+    ''')
+    
     conn.commit()
     conn.close()
 
@@ -66,9 +120,9 @@ def add_provider_model(provider_id: int, model_name: str, description: str = "")
     try:
         cursor.execute(
             """INSERT INTO provider_models 
-               (provider_id, model_name, description) 
-               VALUES (?, ?, ?)""",
-            (provider_id, model_name, description)
+               (provider_id, model_name, description, created_at) 
+               VALUES (?, ?, ?, ?)""",
+            (provider_id, model_name, description, int(time.time()))
         )
         conn.commit()
         return cursor.lastrowid
@@ -144,6 +198,7 @@ def delete_provider(provider_id: int):
     try:
         # 首先删除关联的模型
         cursor.execute("DELETE FROM provider_models WHERE provider_id = ?", (provider_id,))
+        cursor.execute("DELETE FROM model_health WHERE provider_id = ?", (provider_id,))
         # 然后删除提供商
         cursor.execute("DELETE FROM service_providers WHERE id = ?", (provider_id,))
         conn.commit()
@@ -277,3 +332,187 @@ def get_all_models():
         return models
     finally:
         conn.close()
+
+def get_providers_with_models():
+    """
+    获取所有提供商及其模型列表
+    
+    models 为模型名称列表，model_records 为 (模型ID, 模型名称, 创建时间) 列表
+    """
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """SELECT id, name, server_url, server_key, personalized_key, description 
+               FROM service_providers 
+               ORDER BY id"""
+        )
+        providers = [{
+            "id": row[0],
+            "name": row[1],
+            "server_url": row[2],
+            "server_key": row[3],
+            "personalized_key": row[4],
+            "description": row[5] or "",
+            "models": [],
+            "model_records": []
+        } for row in cursor.fetchall()]
+        
+        providers_by_id = {provider["id"]: provider for provider in providers}
+        cursor.execute("SELECT id, provider_id, model_name, created_at FROM provider_models ORDER BY id")
+        for model_id, provider_id, model_name, created_at in cursor.fetchall():
+            if provider_id in providers_by_id:
+                providers_by_id[provider_id]["models"].append(model_name)
+                providers_by_id[provider_id]["model_records"].append((model_id, model_name, created_at or 0))
+        return providers
+    finally:
+        conn.close()
+
+def get_rate_limits():
+    """获取所有限流配置"""
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT scope, target, rpm, tpm, daily_tokens FROM rate_limits ORDER BY scope, target")
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def set_rate_limit(scope: str, target: str, rpm: int = 0, tpm: int = 0, daily_tokens: int = 0):
+    """新增或更新限流配置"""
+    if scope not in ("key", "provider"):
+        raise Exception("scope 只能是 key 或 provider")
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """INSERT OR REPLACE INTO rate_limits 
+               (scope, target, rpm, tpm, daily_tokens) 
+               VALUES (?, ?, ?, ?, ?)""",
+            (scope, str(target), rpm, tpm, daily_tokens)
+        )
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def delete_rate_limit(scope: str, target: str):
+    """删除限流配置（恢复默认限额）"""
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM rate_limits WHERE scope = ? AND target = ?", (scope, str(target)))
+        if cursor.rowcount == 0:
+            raise Exception("限流配置不存在")
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_provider_admission():
+    """获取所有提供商的准入配置"""
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """SELECT provider_id, max_concurrency, max_queue, queue_timeout 
+               FROM provider_admission ORDER BY provider_id"""
+        )
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def set_provider_admission(provider_id: int, max_concurrency: int, max_queue: int, queue_timeout: float):
+    """新增或更新提供商的准入配置"""
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM service_providers WHERE id = ?", (provider_id,))
+        if not cursor.fetchone():
+            raise Exception("提供商不存在")
+        cursor.execute(
+            """INSERT OR REPLACE INTO provider_admission 
+               (provider_id, max_concurrency, max_queue, queue_timeout) 
+               VALUES (?, ?, ?, ?)""",
+            (provider_id, max_concurrency, max_queue, queue_timeout)
+        )
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_key_priorities():
+    """获取所有个性化密钥的优先级"""
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT personalized_key, priority FROM key_priorities ORDER BY personalized_key")
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def set_key_priority(personalized_key: str, priority: str):
+    """设置个性化密钥的优先级"""
+    if priority not in ("interactive", "batch"):
+        raise Exception("priority 只能是 interactive 或 batch")
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT OR REPLACE INTO key_priorities (personalized_key, priority) VALUES (?, ?)",
+            (personalized_key, priority)
+        )
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_model_health():
+    """获取所有模型的最近一次巡检结果"""
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """SELECT provider_id, model_name, success, supports_stream, ttft_ms, 
+                      tokens_per_second, total_time, error, checked_at 
+               FROM model_health ORDER BY provider_id, model_name"""
+        )
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def save_model_health(provider_id: int, model_name: str, success: bool, supports_stream: bool,
+                      ttft_ms: float = None, tokens_per_second: float = None,
+                      total_time: float = None, error: str = None, checked_at: str = None):
+    """保存模型巡检结果（每个提供商的每个模型只保留最近一次）"""
+    conn = sqlite3.connect(str(DATABASE_PATH))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """INSERT OR REPLACE INTO model_health 
+               (provider_id, model_name, success, supports_stream, ttft_ms, 
+                tokens_per_second, total_time, error, checked_at) 
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (provider_id, model_name, int(success), int(supports_stream), ttft_ms,
+             tokens_per_second, total_time, error,
+             checked_at or time.strftime("%Y-%m-%dT%H:%M:%S"))
+        )
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
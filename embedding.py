@@ -1,14 +1,34 @@
+import argparse
+import asyncio
+import os
+import httpx
 import requests
-from PyPDF2 import PdfReader
-import json
-import numpy as np
-from typing import List, Dict, Tuple
-from sklearn.metrics.pairwise import cosine_similarity
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+from embedding_client import (DEFAULT_BATCH_SIZE, DEFAULT_CACHE_SIZE, DEFAULT_CONCURRENCY,
+                              DEFAULT_MAX_BATCH_TOKENS, EmbeddingCache, EmbeddingClient)
+from chunker import DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS, chunk_text
+from corpus import DocumentCorpus
+from my_tokenizer import load_local_encoder
+from pdf_pipeline import iter_chunks, iter_pages
+from embedding_store import EmbeddingStore, normalize_rows
+from lexical_index import DEFAULT_RRF_K, BM25Index, fused_search
+from vector_index import build_index, load_index
 
 class PDFEmbedding:
     def __init__(self, embedding_url: str, embedding_api_key: str, 
                  chat_url: str, chat_api_key: str,
-                 embedding_model: str, chat_model: str):
+                 embedding_model: str, chat_model: str,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 page_workers: int = 0,
+                 chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+                 overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                 query_cache_size: int = DEFAULT_CACHE_SIZE,
+                 retrieval_mode: str = "hybrid",
+                 rrf_k: int = DEFAULT_RRF_K):
         # 嵌入API的配置
         self.embedding_api_key = embedding_api_key
         self.embedding_headers = {
@@ -17,6 +37,20 @@ class PDFEmbedding:
         }
         self.embedding_url = embedding_url
         self.embedding_model = embedding_model
+        # 批量请求：单次最多 batch_size 条、max_batch_tokens 个 token，最多 concurrency 个请求并发
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.concurrency = concurrency
+        # 大于 1 时使用多进程逐页提取PDF文本
+        self.page_workers = page_workers
+        # 文本块大小和相邻文本块的重叠（token 数），chunk_tokens 应小于嵌入模型的上下文长度
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        # 问题向量的 LRU 缓存（以规范化文本为键），0 表示不缓存
+        self.query_cache = EmbeddingCache(query_cache_size)
+        # 默认的检索方式：vector / lexical / hybrid（向量与 BM25 的 RRF 融合），可按问题覆盖
+        self.retrieval_mode = retrieval_mode
+        self.rrf_k = rrf_k
 
         # Chat API的配置
         self.chat_api_key = chat_api_key
@@ -29,85 +63,148 @@ class PDFEmbedding:
 
         self.chunks = []
         self.embeddings = []
+        self.store = None
+        self.index = None
+        self.lexical = None
+        self.corpus = None
     
     def read_pdf(self, pdf_path: str) -> str:
         """读取PDF文件并提取文本"""
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-        return text
+        return "".join(text for _, text in iter_pages(pdf_path, self.page_workers))
+
+    def iter_pdf_chunks(self, pdf_path: str):
+        """逐页提取并分块，产出带页码的文本块记录（不拼接整个文档）"""
+        load_local_encoder()
+        return iter_chunks(iter_pages(pdf_path, self.page_workers), self.create_chunks)
     
-    def create_chunks(self, text: str, chunk_size: int = 1000) -> List[str]:
-        """将文本分割成较小的块"""
-        words = text.split()
-        chunks = []
-        current_chunk = []
-        current_size = 0
-        
-        for word in words:
-            current_chunk.append(word)
-            current_size += len(word) + 1
-            if current_size >= chunk_size:
-                chunks.append(" ".join(current_chunk))
-                current_chunk = []
-                current_size = 0
-        
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
-        
-        return chunks
+    def create_chunks(self, text: str) -> List[str]:
+        """按句子边界将文本分割成 token 数相近、相邻有重叠的块（见 chunker.chunk_text）"""
+        return chunk_text(text, self.chunk_tokens, self.overlap_tokens)
     
+    def embedding_client(self) -> EmbeddingClient:
+        return EmbeddingClient(self.embedding_url, self.embedding_api_key, self.embedding_model,
+                               batch_size=self.batch_size, max_batch_tokens=self.max_batch_tokens,
+                               concurrency=self.concurrency)
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """异步批量生成嵌入向量，返回顺序与 texts 相同"""
+        async with self.embedding_client() as client:
+            return await client.embed(texts)
+
     def get_embeddings(self, text_chunks: List[str]) -> List[List[float]]:
-        """使用Embedding API生成文本嵌入向量"""
-        embeddings = []
-        for chunk in text_chunks:
-            payload = {
-                "model": self.embedding_model,
-                "input": chunk
-            }
-            
-            response = requests.post(
-                self.embedding_url,
-                headers=self.embedding_headers,  # 使用embedding专用的headers
-                json=payload
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                embeddings.append(result['data'][0]['embedding'])
-            else:
-                raise Exception(f"API调用失败: {response.status_code}, {response.text}")
-                
-        return embeddings
+        """使用Embedding API批量生成文本嵌入向量，返回顺序与 text_chunks 相同"""
+        return asyncio.run(self.embed_texts(text_chunks))
     
-    def save_embeddings(self, embeddings: List[List[float]], file_path: str):
-        """将嵌入向量保存到文件"""
-        with open(file_path, 'w') as f:
-            json.dump(embeddings, f)
+    def save_embeddings(self, embeddings: List[List[float]], output_path: str, dtype: str = "float32",
+                        records: List[Dict] = None):
+        """
+        将嵌入向量和文本块保存到目录（二进制向量矩阵 + 文本块记录，见 EmbeddingStore）
+
+        dtype 可选 float32 / float16 / int8，后两者分别约为 float32 体积的 1/2 和 1/4。
+        records 为带元数据（例如页码）的文本块记录，不提供时保存 self.chunks。
+        """
+        self.store = EmbeddingStore.save(output_path, embeddings, records or self.chunks, dtype=dtype,
+                                         extra={"embedding_model": self.embedding_model})
+        self.embeddings = self.store.matrix()
+        self.index = build_index(self.embeddings)
+        self.index.save(Path(output_path) / "index")
+        self.lexical = BM25Index.build(self.store.texts)
+        self.lexical.save(Path(output_path) / "lexical")
+
+    def load_embeddings(self, store_path: str):
+        """以内存映射方式加载 save_embeddings 保存的目录，不解析全部内容"""
+        self.store = EmbeddingStore.load(store_path)
+        self.embeddings = self.store.matrix()
+        self.chunks = self.store.texts
+        index_path = Path(store_path) / "index"
+        self.index = load_index(index_path, self.embeddings) if index_path.exists() else None
+        lexical_path = Path(store_path) / "lexical"
+        self.lexical = BM25Index.load(lexical_path) if (lexical_path / "lexical.json").exists() else None
     
-    def process_pdf(self, pdf_path: str, output_path: str):
+    def process_pdf(self, pdf_path: str, output_path: str, dtype: str = "float32"):
         """处理PDF文件的完整流程"""
-        # 读取PDF
-        text = self.read_pdf(pdf_path)
-        
-        # 分块
-        self.chunks = self.create_chunks(text)
+        # 逐页读取并分块（文本块记录带页码）
+        records = list(self.iter_pdf_chunks(pdf_path))
+        self.chunks = [record["text"] for record in records]
         
         # 生成嵌入向量
         self.embeddings = self.get_embeddings(self.chunks)
         
         # 保存结果
-        self.save_embeddings(self.embeddings, output_path)
+        self.save_embeddings(self.embeddings, output_path, dtype, records)
         
         return self.embeddings
 
-    def get_question_embedding(self, question: str) -> List[float]:
-        """获取问题的embedding"""
-        payload = {
+    def open_corpus(self, corpus_path: str, dtype: str = "float32"):
+        """打开（或新建）多文档语料库，之后的检索基于语料库中的全部文档"""
+        self.corpus = DocumentCorpus(corpus_path, self.embedding_model, dtype)
+        self._use_corpus()
+
+    def _use_corpus(self):
+        self.store = self.corpus.store
+        self.index = self.corpus.index
+        self.lexical = self.corpus.lexical
+        self.embeddings = self.store.matrix() if self.store is not None else []
+        self.chunks = self.store.texts if self.store is not None else []
+
+    def add_pdf(self, pdf_path: str, doc_id: str = None) -> Dict:
+        """
+        把PDF加入语料库（文档ID默认为文件名）；重新导入修改过的文档时只嵌入变化的文本块
+
+        Returns:
+            DocumentCorpus.add_document 的统计
+        """
+        if self.corpus is None:
+            raise RuntimeError("请先调用 open_corpus 打开语料库")
+        async def ingest():
+            # 提取、分块与嵌入请求流水线进行，整个文档共用一个嵌入客户端（连接池）
+            async with self.embedding_client() as client:
+                return await self.corpus.add_document(doc_id or Path(pdf_path).name,
+                                                      self.iter_pdf_chunks(pdf_path), client.embed,
+                                                      source=str(pdf_path))
+
+        stats = asyncio.run(ingest())
+        self._commit_corpus()
+        return stats
+
+    def _commit_corpus(self):
+        self.corpus.save()
+        self._use_corpus()
+
+    def remove_document(self, doc_id: str) -> bool:
+        """从语料库中删除文档"""
+        if self.corpus is None or not self.corpus.remove_document(doc_id):
+            return False
+        self._commit_corpus()
+        return True
+
+    def question_payload(self, question: str) -> Dict:
+        return {
             "model": self.embedding_model,
             "input": question
         }
+
+    def chat_payload(self, messages: List[Dict]) -> Dict:
+        return {
+            "model": self.chat_model,
+            "messages": messages,
+            "temperature": 0.7
+        }
+
+    def build_messages(self, question: str, relevant_chunks: List[Tuple[str, float]]) -> List[Dict]:
+        """用检索到的文本块构建提示信息"""
+        context = "\n".join([chunk for chunk, _ in relevant_chunks])
+        return [
+            {"role": "system", "content": "你是一个专业的助手。请基于提供的上下文信息回答用户的问题。如果无法从上下文中找到答案，请说明。"},
+            {"role": "user", "content": f"上下文信息：\n{context}\n\n问题：{question}"}
+        ]
+
+    def get_question_embedding(self, question: str) -> List[float]:
+        """获取问题的embedding（命中缓存时不请求接口）"""
+        cached = self.query_cache.get(question)
+        if cached is not None:
+            return cached
+        payload = self.question_payload(question)
         
         response = requests.post(
             self.embedding_url,
@@ -117,31 +214,61 @@ class PDFEmbedding:
         
         if response.status_code == 200:
             result = response.json()
-            return result['data'][0]['embedding']
+            embedding = result['data'][0]['embedding']
+            self.query_cache.put(question, embedding)
+            return embedding
         else:
             raise Exception(f"API调用失败: {response.status_code}, {response.text}")
 
-    def find_relevant_chunks(self, question_embedding: List[float], top_k: int = 3) -> List[Tuple[str, float]]:
-        """找到最相关的文本块"""
-        # 计算问题embedding与所有文档块embedding的相似度
-        similarities = cosine_similarity(
-            [question_embedding],
-            self.embeddings
-        )[0]
-        
-        # 获取最相关的文本块索引
-        most_relevant_indices = np.argsort(similarities)[-top_k:][::-1]
-        
-        # 返回最相关的文本块及其相似度
-        return [(self.chunks[i], similarities[i]) for i in most_relevant_indices]
+    def get_question_embeddings(self, questions: List[str]) -> List[List[float]]:
+        """批量获取问题的embedding：未缓存的问题去重后批量请求，返回顺序与 questions 相同"""
+        found, missing = self.query_cache.lookup(questions)
+        vectors = self.get_embeddings(missing) if missing else []
+        return self.query_cache.resolve(questions, found, missing, vectors)
+
+    def _mode(self, questions, mode: Optional[str]) -> str:
+        # 没有问题文本时只能做向量检索
+        return "vector" if questions is None else (mode or self.retrieval_mode)
+
+    def _search(self, question_embeddings, top_k: int, questions: Optional[List[str]] = None,
+                mode: str = "vector") -> List[List[Tuple[str, float]]]:
+        count = len(questions) if questions is not None else len(question_embeddings)
+        if len(self.embeddings) == 0:
+            return [[] for _ in range(count)]
+        if self.index is None:
+            self.index = build_index(normalize_rows(self.embeddings))
+        if self.lexical is None and mode != "vector":
+            self.lexical = BM25Index.build(self.chunks)
+        return [[(self.chunks[i], float(score)) for i, score in zip(indices, scores)]
+                for indices, scores in fused_search(self.index, self.lexical, question_embeddings, questions,
+                                                    top_k, mode, self.rrf_k)]
+
+    def find_relevant_chunks(self, question_embedding: List[float], top_k: int = 3, question: Optional[str] = None,
+                             mode: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        找到最相关的文本块（小规模语料精确检索，大规模语料使用 IVF 近似检索）
+
+        提供 question 时按 mode（默认 retrieval_mode）与 BM25 词法检索融合，
+        能命中错误码、标识符、人名等向量检索容易漏掉的精确匹配。
+        """
+        questions = None if question is None else [question]
+        return self._search([question_embedding], top_k, questions, self._mode(questions, mode))[0]
+
+    def find_relevant_chunks_batch(self, question_embeddings: List[List[float]], top_k: int = 3,
+                                   questions: Optional[List[str]] = None,
+                                   mode: Optional[str] = None) -> List[List[Tuple[str, float]]]:
+        """批量检索：精确检索时所有问题与向量矩阵做一次矩阵乘，每行取 top-k"""
+        return self._search(question_embeddings, top_k, questions, self._mode(questions, mode))
+
+    def retrieve(self, questions: List[str], top_k: int = 3, mode: Optional[str] = None) -> List[List[Tuple[str, float]]]:
+        """批量获取问题的embedding并检索，适合对大量问题做评测（lexical 模式不请求嵌入接口）"""
+        mode = self._mode(questions, mode)
+        embeddings = None if mode == "lexical" else self.get_question_embeddings(questions)
+        return self.find_relevant_chunks_batch(embeddings, top_k, questions, mode)
 
     def chat_completion(self, messages: List[Dict]) -> str:
         """调用ChatGPT进行对话"""
-        payload = {
-            "model": self.chat_model,
-            "messages": messages,
-            "temperature": 0.7
-        }
+        payload = self.chat_payload(messages)
         
         response = requests.post(
             self.chat_url,
@@ -155,51 +282,231 @@ class PDFEmbedding:
         else:
             raise Exception(f"API调用失败: {response.status_code}, {response.text}")
 
-    def answer_question(self, question: str) -> str:
-        """回答问题的完整流程"""
+    def answer_question(self, question: str, mode: Optional[str] = None) -> str:
+        """回答问题的完整流程（mode 见 find_relevant_chunks）"""
+        mode = mode or self.retrieval_mode
         # 获取问题的embedding
-        question_embedding = self.get_question_embedding(question)
+        question_embedding = None if mode == "lexical" else self.get_question_embedding(question)
         
         # 找到相关的文本块
-        relevant_chunks = self.find_relevant_chunks(question_embedding)
+        relevant_chunks = self.find_relevant_chunks(question_embedding, question=question, mode=mode)
         
         # 构建提示信息
-        context = "\n".join([chunk for chunk, _ in relevant_chunks])
-        messages = [
-            {"role": "system", "content": "你是一个专业的助手。请基于提供的上下文信息回答用户的问题。如果无法从上下文中找到答案，请说明。"},
-            {"role": "user", "content": f"上下文信息：\n{context}\n\n问题：{question}"}
-        ]
+        messages = self.build_messages(question, relevant_chunks)
         
         # 获取回答
         answer = self.chat_completion(messages)
         return answer
 
-# 使用示例
+
+class AsyncPDFEmbedding(PDFEmbedding):
+    """
+    PDFEmbedding 的异步版本，可在事件循环中（例如网关内）为多个用户并发调用
+
+    网络请求共用一个 httpx.AsyncClient（可传入网关的连接池客户端，不提供时自行创建）；
+    PDF 解析与分块、存储读写和大矩阵上的相似度计算在线程中执行（page_workers 大于 1 时
+    逐页提取再使用多进程），不阻塞事件循环。涉及网络或磁盘的方法均为协程。
+
+    检索可以并发进行；导入/删除文档依次进行，替换存储的短暂时间内新的检索会等待，
+    已在进行的检索完成后才替换。
+    """
+
+    def __init__(self, *args, client: Optional[httpx.AsyncClient] = None, timeout: float = 120.0, **kwargs):
+        """
+        参数同 PDFEmbedding，另外：
+
+        Args:
+            client: 共享的 httpx 客户端，不提供时自行创建（aclose 时关闭）
+            timeout: 聊天请求的超时（秒）
+        """
+        super().__init__(*args, **kwargs)
+        self._client = client
+        self._own_client = client is None
+        self.timeout = timeout
+        self._write_lock = asyncio.Lock()
+        self._state = asyncio.Condition()
+        self._searches = 0
+        self._committing = False
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=max(self.concurrency, 16))
+            self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        return self._client
+
+    async def aclose(self):
+        if self._own_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def embedding_client(self) -> EmbeddingClient:
+        return EmbeddingClient(self.embedding_url, self.embedding_api_key, self.embedding_model,
+                               batch_size=self.batch_size, max_batch_tokens=self.max_batch_tokens,
+                               concurrency=self.concurrency, client=self.client)
+
+    async def get_embeddings(self, text_chunks: List[str]) -> List[List[float]]:
+        """批量生成文本嵌入向量，返回顺序与 text_chunks 相同"""
+        return await self.embed_texts(text_chunks)
+
+    async def get_question_embedding(self, question: str) -> List[float]:
+        """获取问题的embedding（命中缓存时不请求接口，失败时按 EmbeddingClient 的策略重试）"""
+        cached = self.query_cache.get(question)
+        if cached is not None:
+            return cached
+        embedding = (await self.embedding_client().embed_batch([question]))[0]
+        self.query_cache.put(question, embedding)
+        return embedding
+
+    async def get_question_embeddings(self, questions: List[str]) -> List[List[float]]:
+        """批量获取问题的embedding，见 PDFEmbedding.get_question_embeddings"""
+        found, missing = self.query_cache.lookup(questions)
+        vectors = await self.embed_texts(missing) if missing else []
+        return self.query_cache.resolve(questions, found, missing, vectors)
+
+    async def chat_completion(self, messages: List[Dict]) -> str:
+        """调用聊天接口"""
+        response = await self.client.post(self.chat_url, headers=self.chat_headers,
+                                          json=self.chat_payload(messages), timeout=self.timeout)
+        if response.status_code == 200:
+            return response.json()['choices'][0]['message']['content']
+        raise Exception(f"API调用失败: {response.status_code}, {response.text}")
+
+    @asynccontextmanager
+    async def _searching(self):
+        async with self._state:
+            await self._state.wait_for(lambda: not self._committing)
+            self._searches += 1
+        try:
+            yield
+        finally:
+            async with self._state:
+                self._searches -= 1
+                self._state.notify_all()
+
+    async def find_relevant_chunks(self, question_embedding: List[float], top_k: int = 3,
+                                   question: Optional[str] = None, mode: Optional[str] = None) -> List[Tuple[str, float]]:
+        """找到最相关的文本块（在线程中计算），参数见 PDFEmbedding.find_relevant_chunks"""
+        questions = None if question is None else [question]
+        return (await self.find_relevant_chunks_batch([question_embedding], top_k, questions, mode))[0]
+
+    async def find_relevant_chunks_batch(self, question_embeddings: List[List[float]], top_k: int = 3,
+                                         questions: Optional[List[str]] = None,
+                                         mode: Optional[str] = None) -> List[List[Tuple[str, float]]]:
+        """批量检索（在线程中计算）"""
+        async with self._searching():
+            return await asyncio.to_thread(self._search, question_embeddings, top_k, questions,
+                                           self._mode(questions, mode))
+
+    async def retrieve(self, questions: List[str], top_k: int = 3,
+                       mode: Optional[str] = None) -> List[List[Tuple[str, float]]]:
+        """批量获取问题的embedding并检索"""
+        mode = self._mode(questions, mode)
+        embeddings = None if mode == "lexical" else await self.get_question_embeddings(questions)
+        return await self.find_relevant_chunks_batch(embeddings, top_k, questions, mode)
+
+    async def answer_question(self, question: str, mode: Optional[str] = None) -> str:
+        """回答问题的完整流程"""
+        mode = mode or self.retrieval_mode
+        question_embedding = None if mode == "lexical" else await self.get_question_embedding(question)
+        relevant_chunks = await self.find_relevant_chunks(question_embedding, question=question, mode=mode)
+        return await self.chat_completion(self.build_messages(question, relevant_chunks))
+
+    async def _replace(self, func, *args):
+        """等待进行中的检索完成后，在线程中执行替换存储/索引的操作"""
+        async with self._state:
+            self._committing = True
+            await self._state.wait_for(lambda: self._searches == 0)
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            async with self._state:
+                self._committing = False
+                self._state.notify_all()
+
+    async def process_pdf(self, pdf_path: str, output_path: str, dtype: str = "float32"):
+        """处理PDF文件的完整流程"""
+        records = await asyncio.to_thread(lambda: list(self.iter_pdf_chunks(pdf_path)))
+        chunks = [record["text"] for record in records]
+        embeddings = await self.get_embeddings(chunks)
+        def save():
+            self.chunks = chunks
+            self.save_embeddings(embeddings, output_path, dtype, records)
+
+        async with self._write_lock:
+            await self._replace(save)
+        return self.embeddings
+
+    async def load_embeddings(self, store_path: str):
+        async with self._write_lock:
+            await self._replace(super().load_embeddings, store_path)
+
+    async def open_corpus(self, corpus_path: str, dtype: str = "float32"):
+        async with self._write_lock:
+            await self._replace(super().open_corpus, corpus_path, dtype)
+
+    async def add_pdf(self, pdf_path: str, doc_id: str = None) -> Dict:
+        """把PDF加入语料库，见 PDFEmbedding.add_pdf"""
+        if self.corpus is None:
+            raise RuntimeError("请先调用 open_corpus 打开语料库")
+        async with self._write_lock:
+            chunks = await asyncio.to_thread(self.iter_pdf_chunks, pdf_path)
+            stats = await self.corpus.add_document(doc_id or Path(pdf_path).name, chunks,
+                                                   self.embedding_client().embed, source=str(pdf_path))
+            await self._replace(self._commit_corpus)
+        return stats
+
+    async def remove_document(self, doc_id: str) -> bool:
+        """从语料库中删除文档"""
+        async with self._write_lock:
+            if self.corpus is None or not self.corpus.remove_document(doc_id):
+                return False
+            await self._replace(self._commit_corpus)
+        return True
+
+# 默认经本地网关调用嵌入和聊天接口，密钥为网关的个性化密钥
+GATEWAY_URL = os.environ.get("NEXUSAI_GATEWAY_URL", "http://localhost:5231")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="把PDF导入语料库并基于其内容问答")
+    parser.add_argument("pdfs", nargs="*", help="要导入的PDF文件")
+    parser.add_argument("--corpus", default="embedding/corpus", help="语料库目录")
+    parser.add_argument("--embedding-url", default=os.environ.get("NEXUSAI_EMBEDDING_URL", f"{GATEWAY_URL}/v1/embeddings"))
+    parser.add_argument("--embedding-api-key", default=os.environ.get("NEXUSAI_EMBEDDING_API_KEY", os.environ.get("NEXUSAI_API_KEY")))
+    parser.add_argument("--embedding-model", default=os.environ.get("NEXUSAI_EMBEDDING_MODEL", "BAAI/bge-m3"))
+    parser.add_argument("--chat-url", default=os.environ.get("NEXUSAI_CHAT_URL", f"{GATEWAY_URL}/v1/chat/completions"))
+    parser.add_argument("--chat-api-key", default=os.environ.get("NEXUSAI_CHAT_API_KEY", os.environ.get("NEXUSAI_API_KEY")))
+    parser.add_argument("--chat-model", default=os.environ.get("NEXUSAI_CHAT_MODEL", "deepseek-ai/DeepSeek-R1"))
+    parser.add_argument("--no-chat", action="store_true", help="只导入，不进入问答")
+    args = parser.parse_args()
+    if not args.embedding_api_key or (not args.no_chat and not args.chat_api_key):
+        parser.error("缺少API密钥：设置 NEXUSAI_API_KEY（或 NEXUSAI_EMBEDDING_API_KEY / NEXUSAI_CHAT_API_KEY）")
+    return args
+
 if __name__ == "__main__":
-    # API配置
-    embedding_api_key = "sk-jqbfbbypkqogtlaaeyuefolvvwprknojgcrdinzlwwzjseps"
-    chat_api_key = "kuangren777"
-    embedding_url = "https://api.siliconflow.cn/v1/embeddings"
-    chat_url = "https://kr777.top/v1/chat/completions"
-    
-    # 模型配置
-    embedding_model = "BAAI/bge-m3"
-    chat_model = "deepseek-ai/DeepSeek-R1"
-    
+    args = parse_args()
     pdf_processor = PDFEmbedding(
-        embedding_url=embedding_url,
-        embedding_api_key=embedding_api_key,
-        chat_url=chat_url,
-        chat_api_key=chat_api_key,
-        embedding_model=embedding_model,
-        chat_model=chat_model
+        embedding_url=args.embedding_url,
+        embedding_api_key=args.embedding_api_key,
+        chat_url=args.chat_url,
+        chat_api_key=args.chat_api_key or "",
+        embedding_model=args.embedding_model,
+        chat_model=args.chat_model
     )
     
-    # 处理PDF文件
-    pdf_processor.process_pdf(
-        pdf_path="embedding/test.pdf",
-        output_path="embedding/embeddings.json"
-    )
+    # 把PDF加入语料库（再次运行时只嵌入变化的文本块）
+    pdf_processor.open_corpus(args.corpus)
+    for pdf_path in args.pdfs:
+        print(pdf_processor.add_pdf(pdf_path))
+    print(f"语料库 {args.corpus}: {len(pdf_processor.corpus.documents)} 个文档，{len(pdf_processor.corpus)} 个文本块")
+    if args.no_chat:
+        raise SystemExit(0)
     
     # 进行对话
     while True:
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import random
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from my_tokenizer import count_tokens_local
+
+# 单次请求的最大条数和 token 预算（按本地计数估算）
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_MAX_BATCH_TOKENS = 8192
+# 同时进行的请求数
+DEFAULT_CONCURRENCY = 4
+# 需要重试的上游状态码
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 问题向量缓存的默认条数
+DEFAULT_CACHE_SIZE = 1024
+
+
+class EmbeddingAPIError(Exception):
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"API调用失败: {status_code}, {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+def make_batches(texts: List[str], batch_size: int, max_batch_tokens: int,
+                 counter: Callable[[str], int] = count_tokens_local) -> List[List[int]]:
+    """
+    按条数和 token 预算把文本分组
+
+    Returns:
+        每组文本在原列表中的下标；单条超过预算的文本单独成组
+    """
+    batches = []
+    current: List[int] = []
+    current_tokens = 0
+    for index, text in enumerate(texts):
+        tokens = counter(text)
+        if current and (len(current) >= batch_size or current_tokens + tokens > max_batch_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class EmbeddingClient:
+    """
+    OpenAI 兼容 /embeddings 接口的批量异步客户端
+
+    文本按条数和 token 预算分批，每批一个请求（input 为列表），并发数有上限；
+    429/5xx 和连接错误按指数退避重试（优先使用 Retry-After），结果按原顺序返回。
+    """
+
+    def __init__(self, url: str, api_key: str, model: str,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 max_retries: int = 5, backoff: float = 0.5, max_backoff: float = 30.0,
+                 timeout: float = 60.0, client: Optional[httpx.AsyncClient] = None):
+        """
+        Args:
+            url: 嵌入接口地址，例如 https://api.example.com/v1/embeddings
+            api_key: API 密钥
+            model: 嵌入模型
+            batch_size: 单次请求的最大条数
+            max_batch_tokens: 单次请求的 token 预算
+            concurrency: 同时进行的请求数
+            max_retries: 最大重试次数
+            backoff: 首次重试的等待时间（秒），之后每次翻倍
+            max_backoff: 单次等待的上限（秒）
+            timeout: 单次请求超时（秒）
+            client: 共享的 httpx 客户端（例如网关的连接池），不提供时自行创建
+        """
+        self.url = url
+        self.model = model
+        self.headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._client = client
+        self._own_client = client is None
+        self.logger = logging.getLogger('nexusai.embedding')
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        return self._client
+
+    async def aclose(self):
+        if self._own_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """生成嵌入向量，返回顺序与 texts 相同"""
+        if not texts:
+            return []
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(indices: List[int]):
+            async with semaphore:
+                vectors = await self.embed_batch([texts[index] for index in indices])
+            for index, vector in zip(indices, vectors):
+                results[index] = vector
+
+        await asyncio.gather(*(run(indices) for indices in
+                               make_batches(texts, self.batch_size, self.max_batch_tokens)))
+        return results
+
+    async def embed_batch(self, inputs: List[str]) -> List[List[float]]:
+        """发送一个批量请求（带重试），按返回的 index 排序"""
+        payload = {"model": self.model, "input": inputs}
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = await self.client.post(self.url, json=payload, headers=self.headers,
+                                                  timeout=self.timeout)
+                if response.status_code == 200:
+                    data = response.json()["data"]
+                    if len(data) != len(inputs):
+                        raise EmbeddingAPIError(200, f"返回 {len(data)} 条结果，请求 {len(inputs)} 条")
+                    data.sort(key=lambda item: item.get("index", 0))
+                    return [item["embedding"] for item in data]
+                if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    raise EmbeddingAPIError(response.status_code, response.text)
+                retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+                reason = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                reason = f"{type(e).__name__}: {str(e)}"
+
+            if retry_after is not None:
+                delay = min(self.max_backoff, retry_after)
+            else:
+                delay = min(self.max_backoff, self.backoff * (2 ** attempt)) * (0.5 + random.random())
+            attempt += 1
+            self.logger.warning(f"嵌入请求失败（{reason}），{delay:.1f} 秒后第 {attempt} 次重试")
+            await asyncio.sleep(delay)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def normalize_text(text: str) -> str:
+    """缓存键：NFKC 规范化（全角/半角统一）并合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class EmbeddingCache:
+    """
+    问题向量的 LRU 缓存，以规范化后的文本为键
+
+    同一个问题（忽略空白和全角/半角差异）重复出现时不再请求嵌入接口。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, text: str) -> Optional[List[float]]:
+        key = normalize_text(text)
+        vector = self._entries.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return vector
+
+    def put(self, text: str, vector: List[float]):
+        if self.max_entries <= 0:
+            return
+        key = normalize_text(text)
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup(self, texts: List[str]) -> Tuple[Dict[str, List[float]], List[str]]:
+        """
+        批量查询
+
+        Returns:
+            (规范化文本 -> 已缓存的向量, 需要请求的文本（按规范化文本去重）)
+        """
+        found: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        for text in texts:
+            key = normalize_text(text)
+            if key in found or key in missing:
+                continue
+            vector = self.get(text)
+            if vector is None:
+                missing[key] = text
+            else:
+                found[key] = vector
+        return found, list(missing.values())
+
+    def resolve(self, texts: List[str], found: Dict[str, List[float]], missing: List[str],
+                vectors: List[List[float]]) -> List[List[float]]:
+        """把新请求到的向量写入缓存，并按 texts 的顺序返回全部向量"""
+        for text, vector in zip(missing, vectors):
+            self.put(text, vector)
+            found[normalize_text(text)] = vector
+        return [found[normalize_text(text)] for text in texts]
@@ -0,0 +1,224 @@
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+# 向量的存储精度：float16 体积减半，int8 按行缩放量化，体积约为 float32 的 1/4
+STORE_DTYPES = ("float32", "float16", "int8")
+FORMAT_VERSION = 1
+
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行做 L2 归一化（零向量保持为零）"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize(matrix: np.ndarray, dtype: str):
+    """
+    把 float32 矩阵转换为存储精度
+
+    Returns:
+        (存储用的矩阵, int8 的按行缩放系数或 None)
+    """
+    if dtype == "float32":
+        return matrix.astype(np.float32, copy=False), None
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    raise ValueError(f"不支持的存储精度: {dtype}，可选 {', '.join(STORE_DTYPES)}")
+
+
+def _atomic_save_npy(path: Path, array: np.ndarray):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def _atomic_write(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ChunkFile(Sequence):
+    """
+    文本块记录（JSON Lines + 行偏移），按需读取单条记录
+
+    打开时只映射文件，不解析内容，所以打开耗时与文本块数量无关。
+    """
+
+    def __init__(self, chunks_path: Path, offsets_path: Path):
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(chunks_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return json.loads(self._mmap[start:end])
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+
+class ChunkTexts(Sequence):
+    """只返回文本的 ChunkFile 视图，可直接替代文本块列表"""
+
+    def __init__(self, records: Sequence[Dict[str, Any]]):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [record["text"] for record in self.records[index]]
+        return self.records[index]["text"]
+
+
+class EmbeddingStore:
+    """
+    嵌入向量和文本块的二进制存储
+
+    目录结构：
+        vectors.npy   归一化后的向量矩阵（float32 / float16 / int8），加载时以 np.memmap 映射
+        scales.npy    int8 量化的按行缩放系数
+        chunks.jsonl  每行一个文本块记录：{"text": ..., 其他元数据}
+        offsets.npy   chunks.jsonl 中每条记录的起始字节偏移（最后一项为文件长度）
+        meta.json     格式版本、精度、维度、数量及调用方的附加信息（例如嵌入模型）
+
+    向量在保存时做 L2 归一化，余弦相似度即为内积。
+    """
+
+    def __init__(self, vectors: np.ndarray, chunks: Sequence[Dict[str, Any]],
+                 scales: Optional[np.ndarray] = None, meta: Optional[Dict[str, Any]] = None,
+                 path: Optional[Path] = None):
+        self.vectors = vectors
+        self.chunks = chunks
+        self.scales = scales
+        self.meta = meta or {}
+        self.path = path
+        self._matrix: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def dtype(self) -> str:
+        return self.meta.get("dtype", str(self.vectors.dtype))
+
+    @property
+    def texts(self) -> ChunkTexts:
+        return ChunkTexts(self.chunks)
+
+    def matrix(self) -> np.ndarray:
+        """
+        float32 向量矩阵
+
+        float32 存储直接返回映射的数组（不复制）；float16/int8 第一次调用时反量化并缓存。
+        """
+        if self._matrix is None:
+            if self.vectors.dtype == np.float32:
+                self._matrix = self.vectors
+            elif self.scales is not None:
+                self._matrix = self.vectors.astype(np.float32) * np.asarray(self.scales)[:, None]
+            else:
+                self._matrix = self.vectors.astype(np.float32)
+        return self._matrix
+
+    @classmethod
+    def save(cls, directory: Union[str, Path], embeddings: Union[np.ndarray, List[List[float]]],
+             chunks: Iterable[Union[str, Dict[str, Any]]], dtype: str = "float32",
+             extra: Optional[Dict[str, Any]] = None) -> "EmbeddingStore":
+        """
+        保存向量和文本块并返回映射后的存储
+
+        Args:
+            directory: 存储目录（不存在时创建）
+            embeddings: 向量矩阵，行数与 chunks 相同
+            chunks: 文本或 {"text": ..., 其他元数据} 记录
+            dtype: 存储精度，float32 / float16 / int8
+            extra: 写入 meta.json 的附加信息
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        records = [chunk if isinstance(chunk, dict) else {"text": chunk} for chunk in chunks]
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.size == 0:
+            matrix = matrix.reshape(0, matrix.shape[1] if matrix.ndim == 2 else 0)
+        if matrix.ndim != 2 or matrix.shape[0] != len(records):
+            raise ValueError(f"向量数量 {matrix.shape[0] if matrix.ndim else 0} 与文本块数量 {len(records)} 不一致")
+
+        stored, scales = quantize(normalize_rows(matrix), dtype)
+        _atomic_save_npy(directory / VECTORS_FILE, stored)
+        if scales is not None:
+            _atomic_save_npy(directory / SCALES_FILE, scales)
+        elif (directory / SCALES_FILE).exists():
+            (directory / SCALES_FILE).unlink()
+
+        lines = [json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n" for record in records]
+        offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+        np.cumsum([len(line) for line in lines], out=offsets[1:])
+        _atomic_write(directory / CHUNKS_FILE, b"".join(lines))
+        _atomic_save_npy(directory / OFFSETS_FILE, offsets)
+
+        meta = {"version": FORMAT_VERSION, "dtype": dtype, "dim": int(matrix.shape[1]),
+                "count": len(records), "normalized": True, **(extra or {})}
+        _atomic_write(directory / META_FILE, json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8"))
+        return cls.load(directory)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], mmap_mode: Optional[str] = "r") -> "EmbeddingStore":
+        """
+        打开存储目录，向量和文本块均按需从映射的文件中读取
+
+        Args:
+            directory: 存储目录
+            mmap_mode: 传给 np.load 的映射模式，None 时读入内存
+        """
+        directory = Path(directory)
+        with open(directory / META_FILE, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version", 1) > FORMAT_VERSION:
+            raise ValueError(f"不支持的存储格式版本: {meta['version']}")
+        vectors = np.load(directory / VECTORS_FILE, mmap_mode=mmap_mode)
+        scales = np.load(directory / SCALES_FILE) if (directory / SCALES_FILE).exists() else None
+        chunks = ChunkFile(directory / CHUNKS_FILE, directory / OFFSETS_FILE)
+        return cls(vectors, chunks, scales, meta, directory)
+
+    def close(self):
+        if isinstance(self.chunks, ChunkFile):
+            self.chunks.close()
@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from upstream_pool import UpstreamPool, build_upstream_url
+
+
+class ProviderHealth:
+    """单个提供商的健康状态"""
+
+    def __init__(self, provider_id: int, name: str = ""):
+        self.provider_id = provider_id
+        self.name = name
+        self.available = True
+        self.latency_ms: Optional[float] = None  # 指数加权平均延迟
+        self.last_latency_ms: Optional[float] = None
+        self.consecutive_failures = 0
+        self.total_checks = 0
+        self.total_failures = 0
+        self.last_checked: Optional[str] = None
+        self.last_error: Optional[str] = None
+        # 可用性最近一次变化的时间（time.time()，跨进程可比较），用于合并其他进程发布的熔断状态
+        self.changed_at = 0.0
+        # 各模型最近一次巡检结果（model_health 表），model_name -> {success, ttft_ms, tokens_per_second, ...}
+        self.models: Dict[str, Dict[str, Any]] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "provider_id": self.provider_id,
+            "name": self.name,
+            "available": self.available,
+            "latency_ms": round(self.latency_ms, 2) if self.latency_ms is not None else None,
+            "last_latency_ms": round(self.last_latency_ms, 2) if self.last_latency_ms is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "total_checks": self.total_checks,
+            "total_failures": self.total_failures,
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+            "changed_at": self.changed_at,
+            "models": self.models
+        }
+
+    def breaker_state(self) -> Dict[str, Any]:
+        """熔断状态：只含可用性相关字段，不含延迟和巡检结果"""
+        return {
+            "provider_id": self.provider_id,
+            "available": self.available,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "changed_at": self.changed_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ProviderHealth":
+        state = cls(int(data["provider_id"]), data.get("name", ""))
+        state.available = data.get("available", True)
+        state.latency_ms = data.get("latency_ms")
+        state.last_latency_ms = data.get("last_latency_ms")
+        state.consecutive_failures = data.get("consecutive_failures", 0)
+        state.total_checks = data.get("total_checks", 0)
+        state.total_failures = data.get("total_failures", 0)
+        state.last_checked = data.get("last_checked")
+        state.last_error = data.get("last_error")
+        state.changed_at = data.get("changed_at", 0.0)
+        state.models = data.get("models") or {}
+        return state
+
+
+class HealthChecker:
+    """
+    上游提供商主动健康检查
+
+    定期并发探测每个提供商（优先 GET /v1/models，不支持时退化为 1 token 的补全请求），
+    维护可用性和延迟状态供路由使用。探测走共享连接池，顺带保持连接处于预热状态。
+    """
+
+    def __init__(self, pool: UpstreamPool,
+                 provider_loader: Callable[[], List[Dict[str, Any]]],
+                 proxy_selector: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+                 model_health_loader: Optional[Callable[[], List[tuple]]] = None,
+                 interval: float = 30.0, timeout: float = 10.0,
+                 failure_threshold: int = 3, ewma_alpha: float = 0.3):
+        """
+        Args:
+            pool: 上游连接池
+            provider_loader: 返回提供商列表的函数，每项包含 id/name/server_url/server_key/models/description
+            proxy_selector: 根据提供商信息返回需要使用的代理（可选）
+            model_health_loader: 返回模型巡检结果的函数（参见 database.get_model_health，可选）
+            interval: 探测间隔（秒）
+            timeout: 单次探测超时（秒）
+            failure_threshold: 连续失败多少次后标记为不可用
+            ewma_alpha: 延迟指数加权平均的系数
+        """
+        self.pool = pool
+        self.provider_loader = provider_loader
+        self.proxy_selector = proxy_selector
+        self.model_health_loader = model_health_loader
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.ewma_alpha = ewma_alpha
+        self.states: Dict[int, ProviderHealth] = {}
+        # 可用性发生变化时的回调（例如同步给其他工作进程），参数为该提供商的 breaker_state()
+        self.on_change: Optional[Callable[[Dict[str, Any]], Any]] = None
+        self.logger = logging.getLogger('nexusai.health')
+
+    def _get_state(self, provider_id: int, name: str = "") -> ProviderHealth:
+        state = self.states.get(provider_id)
+        if state is None:
+            state = ProviderHealth(provider_id, name)
+            self.states[provider_id] = state
+        elif name:
+            state.name = name
+        return state
+
+    def record_success(self, provider_id: int, latency_ms: Optional[float] = None):
+        """记录一次成功（探测或真实请求）"""
+        state = self._get_state(provider_id)
+        recovered = not state.available
+        state.consecutive_failures = 0
+        state.available = True
+        state.last_error = None
+        if latency_ms is not None:
+            state.last_latency_ms = latency_ms
+            if state.latency_ms is None:
+                state.latency_ms = latency_ms
+            else:
+                state.latency_ms = self.ewma_alpha * latency_ms + (1 - self.ewma_alpha) * state.latency_ms
+        if recovered:
+            state.changed_at = time.time()
+            self.logger.info(f"提供商 {provider_id} 恢复可用")
+            self._notify_change(state)
+
+    def record_failure(self, provider_id: int, error: str = ""):
+        """记录一次失败（探测或真实请求）"""
+        state = self._get_state(provider_id)
+        state.consecutive_failures += 1
+        state.total_failures += 1
+        state.last_error = error
+        if state.consecutive_failures >= self.failure_threshold and state.available:
+            state.available = False
+            state.changed_at = time.time()
+            self.logger.warning(f"提供商 {provider_id} 连续失败 {state.consecutive_failures} 次，标记为不可用: {error}")
+            self._notify_change(state)
+
+    def _notify_change(self, state: ProviderHealth):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(state.breaker_state())
+        except Exception as e:
+            self.logger.error(f"同步健康状态失败: {str(e)}")
+
+    def apply_breaker_states(self, changes: Iterable[Dict[str, Any]]):
+        """
+        合并其他进程发布的熔断状态
+
+        按提供商比较 changed_at，只接受比本地更新的变化；延迟等其余状态保持本进程的数据。
+        """
+        for change in changes:
+            state = self._get_state(int(change["provider_id"]))
+            if change.get("changed_at", 0.0) <= state.changed_at:
+                continue
+            state.available = change["available"]
+            state.consecutive_failures = change.get("consecutive_failures", 0)
+            state.last_error = change.get("last_error")
+            state.changed_at = change["changed_at"]
+
+    def is_available(self, provider_id: int) -> bool:
+        state = self.states.get(provider_id)
+        return state.available if state else True
+
+    def pick_provider(self, candidates: List[int], model_name: Optional[str] = None) -> Optional[int]:
+        """
+        从候选提供商中选择一个：优先可用的，其次该模型最近一次巡检成功的，再按巡检测得的
+        首 token 延迟、探测延迟从低到高
+
+        所有候选都不可用时仍返回排序最靠前的一个，由真实请求决定结果。
+        """
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+
+        def sort_key(provider_id: int):
+            state = self.states.get(provider_id)
+            if state is None:
+                return (0, 0, float('inf'), float('inf'))
+            model = state.models.get(model_name) if model_name else None
+            model_failed = 1 if model is not None and not model.get("success") else 0
+            ttft = model.get("ttft_ms") if model is not None else None
+            latency = state.latency_ms if state.latency_ms is not None else float('inf')
+            return (0 if state.available else 1, model_failed,
+                    ttft if ttft is not None else float('inf'), latency)
+
+        return sorted(candidates, key=sort_key)[0]
+
+    def load_model_health(self, rows: List[tuple]):
+        """
+        加载模型巡检结果
+
+        Args:
+            rows: database.get_model_health() 的结果
+        """
+        models: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        for provider_id, model_name, success, supports_stream, ttft_ms, tokens_per_second, total_time, error, checked_at in rows:
+            models.setdefault(provider_id, {})[model_name] = {
+                "success": bool(success),
+                "supports_stream": bool(supports_stream),
+                "ttft_ms": ttft_ms,
+                "tokens_per_second": tokens_per_second,
+                "total_time": total_time,
+                "error": error,
+                "checked_at": checked_at
+            }
+        for provider_id, state in self.states.items():
+            state.models = models.pop(provider_id, {})
+        for provider_id, provider_models in models.items():
+            self._get_state(provider_id).models = provider_models
+
+    async def probe(self, provider: Dict[str, Any]) -> bool:
+        """探测单个提供商，返回是否健康"""
+        provider_id = provider["id"]
+        state = self._get_state(provider_id, provider.get("name", ""))
+        state.total_checks += 1
+        state.last_checked = datetime.now().isoformat()
+
+        proxy = self.proxy_selector(provider) if self.proxy_selector else None
+        client = self.pool.get_client(proxy)
+        headers = {"Authorization": f"Bearer {provider['server_key']}"}
+
+        start = time.perf_counter()
+        try:
+            response = None
+            models_url = build_upstream_url(provider["server_url"], "models")
+            if models_url:
+                response = await client.get(models_url, headers=headers, timeout=self.timeout)
+
+            # 不支持 /models 的提供商退化为最小的补全请求
+            if (response is None or response.status_code in (404, 405)) and provider.get("models"):
+                response = await client.post(
+                    build_upstream_url(provider["server_url"]),
+                    json={
+                        "model": provider["models"][0],
+                        "messages": [{"role": "user", "content": "ping"}],
+                        "max_tokens": 1,
+                        "stream": False
+                    },
+                    headers=headers,
+                    timeout=self.timeout
+                )
+
+            latency_ms = (time.perf_counter() - start) * 1000
+            if response is not None and response.status_code == 200:
+                self.record_success(provider_id, latency_ms)
+                return True
+
+            status = response.status_code if response is not None else "N/A"
+            self.record_failure(provider_id, f"HTTP {status}")
+            return False
+        except Exception as e:
+            # 除网络错误外还包括地址格式错误（httpx.InvalidURL）等，单个提供商不影响整轮探测
+            self.record_failure(provider_id, f"{type(e).__name__}: {str(e)}")
+            return False
+
+    async def check_all(self) -> Dict[int, Dict[str, Any]]:
+        """并发探测所有提供商"""
+        try:
+            providers = self.provider_loader()
+        except Exception as e:
+            self.logger.error(f"加载提供商列表失败: {str(e)}")
+            return self.snapshot()
+
+        # 清理已删除的提供商
+        current_ids = {provider["id"] for provider in providers}
+        for provider_id in list(self.states):
+            if provider_id not in current_ids:
+                del self.states[provider_id]
+
+        await asyncio.gather(*(self.probe(provider) for provider in providers), return_exceptions=True)
+
+        if self.model_health_loader:
+            try:
+                self.load_model_health(self.model_health_loader())
+            except Exception as e:
+                self.logger.error(f"加载模型巡检结果失败: {str(e)}")
+        return self.snapshot()
+
+    async def warm_up(self) -> int:
+        """
+        预热到所有提供商的连接，返回成功的数量
+
+        探测只在领导进程中运行，其他工作进程启动时调用，使首个真实请求不必再建立连接。
+        """
+        try:
+            providers = self.provider_loader()
+        except Exception as e:
+            self.logger.error(f"加载提供商列表失败: {str(e)}")
+            return 0
+        results = await asyncio.gather(*(
+            self.pool.warm_up(
+                build_upstream_url(provider["server_url"], "models") or build_upstream_url(provider["server_url"]),
+                proxy=self.proxy_selector(provider) if self.proxy_selector else None,
+                headers={"Authorization": f"Bearer {provider['server_key']}"},
+                timeout=self.timeout
+            )
+            for provider in providers
+        ), return_exceptions=True)
+        return sum(1 for result in results if result is True)
+
+    async def run_forever(self, on_checked: Optional[Callable[[Dict[int, Dict[str, Any]]], Any]] = None):
+        """
+        后台循环探测
+
+        Args:
+            on_checked: 每轮探测完成后以 snapshot() 调用（例如发布给其他工作进程）
+        """
+        while True:
+            try:
+                snapshot = await self.check_all()
+                if on_checked:
+                    on_checked(snapshot)
+                unavailable = [s.provider_id for s in self.states.values() if not s.available]
+                if unavailable:
+                    self.logger.warning(f"健康检查完成，不可用的提供商: {unavailable}")
+            except Exception as e:
+                self.logger.error(f"健康检查出错: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def snapshot(self) -> Dict[int, Dict[str, Any]]:
+        return {provider_id: state.to_dict() for provider_id, state in self.states.items()}
+
+    def load_snapshot(self, snapshot: Dict[Any, Dict[str, Any]]):
+        """
+        用领导进程发布的 snapshot() 替换本地状态（JSON 序列化后键为字符串）
+
+        本地比快照更新的熔断状态（快照发布后才发生的可用性变化）予以保留。
+        """
+        previous = self.states
+        self.states = {int(provider_id): ProviderHealth.from_dict(data)
+                       for provider_id, data in snapshot.items()}
+        self.apply_breaker_states(state.breaker_state() for provider_id, state in previous.items()
+                                  if provider_id in self.states)
@@ -0,0 +1,211 @@
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from chunker import CJK_CHARS
+from vector_index import top_k_rows
+
+# BM25 参数
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+# 倒数排名融合（RRF）的平滑常数，以及融合前每路检索取的候选数
+DEFAULT_RRF_K = 60
+DEFAULT_FUSION_DEPTH = 50
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+FORMAT_VERSION = 1
+
+META_FILE = "lexical.json"
+TERMS_FILE = "terms.json"
+OFFSETS_FILE = "offsets.npy"
+DOC_IDS_FILE = "doc_ids.npy"
+TERM_FREQS_FILE = "term_freqs.npy"
+DOC_LENGTHS_FILE = "doc_lengths.npy"
+
+# 中日韩文本连续片段，或由 . - _ : / 连接的字母数字（例如 ERR_CONN-502、v1.2.3、0x8007）
+_TOKEN_PATTERN = re.compile(rf'([{CJK_CHARS}]+)|[0-9a-z_]+(?:[.\-:/][0-9a-z_]+)*')
+_PART_PATTERN = re.compile(r'[0-9a-z]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    检索用的词项：NFKC 规范化并转小写
+
+    中日韩文本没有空格分词，按相邻两字（bigram）切分，单独的一个字作为一个词项；
+    带连接符的标识符同时保留整体和各部分，粘贴完整的错误码或部分名称都能命中。
+    """
+    terms = []
+    for match in _TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        token = match.group()
+        if match.group(1):
+            if len(token) == 1:
+                terms.append(token)
+            else:
+                terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+            continue
+        terms.append(token)
+        parts = _PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+class BM25Index:
+    """
+    BM25 倒排索引，倒排表按 CSR 方式保存在数组中
+
+        terms       词项列表（下标为词项ID）
+        offsets     每个词项的倒排表在 doc_ids / term_freqs 中的起止位置，长度 词项数 + 1
+        doc_ids     按词项排列的文本块下标（同一词项内递增）
+        term_freqs  对应的词频
+        doc_lengths 每个文本块的词项数
+
+    数组以 .npy 保存在存储目录旁，加载时内存映射，不需要重新分词。
+    """
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, doc_ids: np.ndarray, term_freqs: np.ndarray,
+                 doc_lengths: np.ndarray, k1: float = DEFAULT_K1, b: float = DEFAULT_B):
+        self.terms = terms
+        self.vocab = {term: term_id for term_id, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        count = len(doc_lengths)
+        average = float(np.mean(doc_lengths)) if count else 0.0
+        # 每个文本块的长度归一化项 k1 * (1 - b + b * dl / avgdl)，检索时直接使用
+        self._norms = (k1 * (1 - b + b * np.asarray(doc_lengths, dtype=np.float32) / (average or 1.0))).astype(np.float32)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = DEFAULT_K1, b: float = DEFAULT_B) -> "BM25Index":
+        """对文本块分词并构建索引"""
+        vocab = {}
+        term_ids, doc_ids, freqs, lengths = [], [], [], []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc_id)
+                freqs.append(freq)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=offsets[1:])
+        return cls(list(vocab), offsets, np.asarray(doc_ids, dtype=np.int32)[order],
+                   np.asarray(freqs, dtype=np.int32)[order], np.asarray(lengths, dtype=np.int32), k1, b)
+
+    def scores(self, query: str) -> np.ndarray:
+        """query 对每个文本块的 BM25 分数（不含任何词项的文本块为 0）"""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term, weight in Counter(tokenize(query)).items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            ids = self.doc_ids[start:end]
+            freqs = np.asarray(self.term_freqs[start:end], dtype=np.float32)
+            idf = math.log(1 + (len(self) - (end - start) + 0.5) / (end - start + 0.5))
+            # 同一词项的倒排表中文本块不重复，可以直接按下标累加
+            scores[ids] += weight * idf * freqs * (self.k1 + 1) / (freqs + self._norms[ids])
+        return scores
+
+    def search(self, query: str, k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 BM25 分数最高的 k 个文本块的 (下标, 分数)，只包含命中词项的文本块"""
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores)
+        if matched.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        positions, top_scores = top_k_rows(scores[matched], k)
+        return matched[positions[0]], top_scores[0]
+
+    def search_batch(self, queries: Sequence[str], k: int = 3) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return [self.search(query, k) for query in queries]
+
+    def save(self, directory: Union[str, Path]):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / OFFSETS_FILE, self.offsets)
+        np.save(directory / DOC_IDS_FILE, self.doc_ids)
+        np.save(directory / TERM_FREQS_FILE, self.term_freqs)
+        np.save(directory / DOC_LENGTHS_FILE, self.doc_lengths)
+        (directory / TERMS_FILE).write_text(json.dumps(self.terms, ensure_ascii=False), encoding="utf-8")
+        (directory / META_FILE).write_text(
+            json.dumps({"version": FORMAT_VERSION, "k1": self.k1, "b": self.b, "count": len(self)}), encoding="utf-8")
+
+    @classmethod
+    def load(cls, directory: Union[str, Path]) -> "BM25Index":
+        """加载 save() 保存的索引，倒排数组以内存映射方式打开"""
+        directory = Path(directory)
+        meta = json.loads((directory / META_FILE).read_text(encoding="utf-8"))
+        if meta.get("version", 1) > FORMAT_VERSION:
+            raise ValueError(f"不支持的词法索引格式版本: {meta['version']}")
+        terms = json.loads((directory / TERMS_FILE).read_text(encoding="utf-8"))
+        return cls(terms, np.load(directory / OFFSETS_FILE, mmap_mode="r"),
+                   np.load(directory / DOC_IDS_FILE, mmap_mode="r"),
+                   np.load(directory / TERM_FREQS_FILE, mmap_mode="r"),
+                   np.load(directory / DOC_LENGTHS_FILE), meta["k1"], meta["b"])
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 3, rrf_k: int = DEFAULT_RRF_K,
+                           weights: Optional[Sequence[float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    倒数排名融合：每个结果的分数为各路排名的 weight / (rrf_k + rank) 之和（rank 从 1 开始）
+
+    只使用排名，不需要把余弦相似度和 BM25 分数换算到同一尺度。
+
+    Returns:
+        融合后前 k 个结果的 (下标, 分数)
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, start=1):
+            fused[int(item)] = fused.get(int(item), 0.0) + weight / (rrf_k + rank)
+    ordered = sorted(fused.items(), key=lambda entry: entry[1], reverse=True)[:k]
+    return (np.asarray([item for item, _ in ordered], dtype=np.int64),
+            np.asarray([score for _, score in ordered], dtype=np.float32))
+
+
+def fused_search(index, lexical: Optional[BM25Index], query_vectors, query_texts: Optional[Sequence[str]], k: int,
+                 mode: str = "hybrid", rrf_k: int = DEFAULT_RRF_K, weights: Optional[Sequence[float]] = None,
+                 depth: int = DEFAULT_FUSION_DEPTH) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    按 mode 检索：vector 为向量检索（余弦相似度），lexical 为 BM25，hybrid 为两者各取 depth 个
+    候选后做 RRF 融合（分数为 RRF 分数）
+
+    Args:
+        index: 向量索引（ExactIndex / IVFIndex）
+        lexical: BM25 索引
+        query_vectors: 查询向量，lexical 模式可为 None
+        query_texts: 查询文本，vector 模式可为 None
+        k: 每个查询返回的结果数
+        weights: hybrid 模式下 (向量, 词法) 两路的权重
+
+    Returns:
+        每个查询的 (下标, 分数)
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"不支持的检索模式: {mode}，可选 {', '.join(SEARCH_MODES)}")
+    if mode != "vector" and (query_texts is None or lexical is None):
+        raise ValueError(f"{mode} 检索需要查询文本和词法索引")
+    if mode == "vector":
+        return index.search_batch(query_vectors, k)
+    if mode == "lexical":
+        return lexical.search_batch(query_texts, k)
+    depth = max(depth, k)
+    vector_hits = index.search_batch(query_vectors, depth)
+    lexical_hits = lexical.search_batch(query_texts, depth)
+    return [reciprocal_rank_fusion([vector_ids, lexical_ids], k, rrf_k, weights)
+            for (vector_ids, _), (lexical_ids, _) in zip(vector_hits, lexical_hits)]
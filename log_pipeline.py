@@ -0,0 +1,184 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+
+_handlers: List["BackgroundQueueHandler"] = []
+
+# LogRecord 自带的属性，其余属性（通过 extra 传入）作为结构化字段输出
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "fields"}
+
+
+def _record_fields(record: logging.LogRecord) -> Dict:
+    fields = dict(getattr(record, "fields", None) or {})
+    for key, value in vars(record).items():
+        if key not in _RESERVED_ATTRS and not key.startswith("_"):
+            fields[key] = value
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，extra 中的字段原样保留"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "msg": record.getMessage()
+        }
+        data.update(_record_fields(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """控制台可读格式，结构化字段以 key=value 追加在消息后"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s [%(levelname)s] %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = _record_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按日志类别（logger 名称前缀）采样，例如 {"nexusai.stream": 0.01} 只保留 1% 的逐块日志
+
+    WARNING 及以上级别不采样。
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        # 最长前缀优先匹配
+        self.rates = sorted((rates or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+    def rate_for(self, name: str) -> float:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    请求路径上只把日志记录放入队列，格式化和写文件/控制台都在后台线程完成
+
+    消息参数（logger.info("... %s", value)）也推迟到后台线程再格式化。每个进程
+    首次写日志时启动自己的后台线程，因此在 fork 出的工作进程中同样可用。
+    """
+
+    def __init__(self, handlers: List[logging.Handler]):
+        super().__init__(queue.SimpleQueue())
+        self.handlers = handlers
+        self.listener: Optional[QueueListener] = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 不在调用方线程格式化；异常堆栈在这里转为文本，避免持有 traceback 对象
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # fork 后父进程的监听线程不存在，使用新的队列和线程
+            self.queue = queue.SimpleQueue()
+            self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        """刷新队列中剩余的日志并停止后台线程"""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+
+
+def shutdown():
+    """停止本进程所有后台日志线程并写出剩余日志（工作进程退出前调用）"""
+    for handler in _handlers:
+        handler.stop()
+
+
+def parse_levels(value: str) -> Dict[str, int]:
+    """解析 "nexusai.stream=DEBUG,nexusai.health=WARNING" 形式的类别级别配置"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+def parse_rates(value: str) -> Dict[str, float]:
+    """解析 "nexusai.stream=0.01" 形式的采样率配置"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(name: str, log_file, level: int = logging.INFO,
+                  levels: Optional[Dict[str, int]] = None,
+                  sampling: Optional[Dict[str, float]] = None) -> logging.Logger:
+    """
+    为 name 及其子 logger 配置非阻塞日志
+
+    Args:
+        name: 根 logger 名称（例如 nexusai），子类别如 nexusai.stream 会传播到它
+        log_file: JSON 日志文件路径
+        level: 根 logger 级别
+        levels: 各类别的级别，例如 {"nexusai.stream": logging.DEBUG}
+        sampling: 各类别的采样率，例如 {"nexusai.stream": 0.01}
+    """
+    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(ConsoleFormatter())
+
+    queue_handler = BackgroundQueueHandler([file_handler, console_handler])
+    queue_handler.addFilter(SamplingFilter(sampling))
+    if not _handlers:
+        atexit.register(shutdown)
+    _handlers.append(queue_handler)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    # 不再传播到根 logger，避免根 logger 上的同步处理器（例如 run.py 的 basicConfig）重复输出
+    logger.propagate = False
+    for category, category_level in (levels or {}).items():
+        logging.getLogger(category).setLevel(category_level)
+    return logger
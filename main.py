@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, WebSocket, Request, Response
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request, Response
 from pydantic import BaseModel
 from pathlib import Path
 import httpx
@@ -6,23 +6,28 @@ import json
 import asyncio
 from database import (
     init_db, add_service_provider, get_all_providers,
-    get_provider_info, delete_provider, update_provider,
+    delete_provider, update_provider,
     get_provider_by_id, add_provider_model, get_models_by_provider,
-    get_model_by_id, DATABASE_PATH, update_provider_model, delete_provider_model,
-    get_all_models
+    get_model_by_id, update_provider_model, delete_provider_model,
+    get_providers_with_models,
+    get_rate_limits, set_rate_limit, delete_rate_limit,
+    get_provider_admission, set_provider_admission, get_key_priorities, set_key_priority,
+    get_model_health
 )
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, StreamingResponse, Response
 import sqlite3
-import aiosqlite
 from stats_tracker import StatsTracker
 import uuid
 import logging
 from datetime import datetime, timedelta
 import re
 import traceback
-from my_tokenizer import Tokenizer
+from my_tokenizer import Tokenizer, count_tokens_local, load_local_encoder
 from save_messages import save_message_to_file
+from chat_processing import flatten_messages, parse_sse_line, normalize_grok_chunk, SSE_DONE, CompletionAccumulator
+from ws_chat import ChatSocketSession
+from conversations import ConversationStore
 from warnings import filterwarnings
 import time
 import random  # 添加随机模块导入
@@ -30,7 +35,17 @@ from httpx import AsyncClient, AsyncHTTPTransport  # 修改为异步传输类
 import os
 import secrets
 from typing import List, Dict, Any, Optional
+from upstream_pool import UpstreamPool, build_upstream_url
+from health_checker import HealthChecker
+from rate_limiter import RateLimiter, MemoryBucketStore, SQLiteBucketStore
+from admission import AdmissionController, AdmissionRejected
+from routing import CACHE_REQUESTS, RoutingIndex, etag_matches
+from shared_state import SharedState, pid_alive
+from log_pipeline import setup_logging, parse_levels, parse_rates
+from tracing import Trace, TraceRecorder
+from metrics import REGISTRY, RATE_BUCKETS, merge_dumps, render as render_metrics
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 import uvicorn
 
 filterwarnings("ignore", category=DeprecationWarning)
@@ -47,12 +62,22 @@ DATA_DIR.mkdir(exist_ok=True)
 # 初始化数据库
 init_db()
 
+# 跨工作进程共享状态：run.py 主进程导入本模块时创建，fork 出的工作进程共享同一块内存
+shared_state = SharedState(DATA_DIR / "shared_state.db")
+
 # 初始化 StatsTracker
 stats_tracker = StatsTracker()
 
 # 初始化 Tokenizer
 tokenizer = Tokenizer()
 
+# /ws/chat 的多轮对话历史：内存中保留最近的会话，其余按需从 chat_messages 读回
+conversation_store = ConversationStore(
+    stats_tracker.get_conversation_messages,
+    max_conversations=int(os.environ.get("NEXUSAI_WS_MAX_CONVERSATIONS", 256)),
+    max_context_tokens=int(os.environ.get("NEXUSAI_WS_CONTEXT_TOKENS", 4096))
+)
+
 # 挂载静态文件目录到管理后台
 app_admin.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -83,36 +108,43 @@ class ProviderUpdate(BaseModel):
     personalized_key: str
     description: str = ""
 
+class AdmissionConfig(BaseModel):
+    max_concurrency: int
+    max_queue: int
+    queue_timeout: float
+
+class KeyPriority(BaseModel):
+    priority: str  # interactive 或 batch
+
+class RateLimitConfig(BaseModel):
+    rpm: int = 0           # 每分钟请求数，0 表示不限制
+    tpm: int = 0           # 每分钟 token 数，0 表示不限制
+    daily_tokens: int = 0  # 每日 token 配额，0 表示不限制
+
 # 创建日志目录
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
 
-# 配置日志
-def setup_logger(name, log_file, level=logging.INFO):
-    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-    
-    # 文件处理器
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_handler.setFormatter(formatter)
-    
-    # 控制台处理器
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    
-    # 创建logger
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
+# 调试模式配置
+DEBUG_MODE = True  # 可以通过环境变量或配置文件设置
+
+# 配置日志：请求路径上只把记录放入队列，由后台线程序列化为 JSON 写入文件
+# 日志类别：nexusai.request（每个请求的统计，DEBUG 级别为请求/响应体）、nexusai.stream（逐块详情，DEBUG 级别）
+LOG_LEVEL = logging.getLevelName(os.environ.get("NEXUSAI_LOG_LEVEL", "INFO").upper())
+LOG_LEVELS = {
+    "nexusai.request": logging.DEBUG if DEBUG_MODE == "Detail" else logging.INFO,
+    "nexusai.stream": logging.DEBUG if DEBUG_MODE == "Detail" else logging.INFO,
+}
+LOG_LEVELS.update(parse_levels(os.environ.get("NEXUSAI_LOG_LEVELS", "")))
+# 逐块日志默认只采样 1%
+LOG_SAMPLING = {"nexusai.stream": 0.01}
+LOG_SAMPLING.update(parse_rates(os.environ.get("NEXUSAI_LOG_SAMPLING", "")))
 
 # 创建日志文件名（按日期）
 log_file = LOG_DIR / f"debug_{datetime.now().strftime('%Y%m%d')}.log"
-logger = setup_logger('nexusai', log_file)
-
-# 调试模式配置
-DEBUG_MODE = True  # 可以通过环境变量或配置文件设置
+logger = setup_logging('nexusai', log_file, LOG_LEVEL, LOG_LEVELS, LOG_SAMPLING)
+request_logger = logging.getLogger('nexusai.request')
+stream_logger = logging.getLogger('nexusai.stream')
 
 # 修改代理配置为URL字符串格式
 PROXIES = [
@@ -151,9 +183,10 @@ async def test_proxy_availability():
             except Exception as e:
                 logger.error(f"代理不可用: {proxy}, 错误: {str(e)}")
         
-        # 更新可用代理列表
+        # 更新可用代理列表，并同步给其他工作进程
         if available:
             AVAILABLE_PROXIES = available
+            shared_state.publish("proxies", AVAILABLE_PROXIES)
             logger.info(f"可用代理列表已更新: {AVAILABLE_PROXIES}")
         else:
             # 如果没有可用代理，保留原列表
@@ -165,6 +198,185 @@ async def test_proxy_availability():
         # 等待1分钟
         await asyncio.sleep(60)
 
+# 上游连接池，所有到提供商的请求共享连接
+upstream_pool = UpstreamPool()
+
+# 路由索引：请求路径上的密钥校验、提供商查询和模型列表都走内存索引
+routing_index = RoutingIndex(get_providers_with_models)
+
+def refresh_routing():
+    """提供商或模型变更后重建路由索引，并通知其他工作进程重建"""
+    routing_index.rebuild()
+    shared_state.publish("routing")
+
+# /v1/models 是否只返回调用方密钥可用的模型（也可通过 ?filter=key 按请求开启）
+MODELS_FILTER_BY_KEY = False
+
+def select_provider_proxy(provider: Dict[str, Any]) -> Optional[str]:
+    """根据提供商配置选择健康检查使用的代理"""
+    need_proxy = "proxy" in provider.get("description", "").lower()
+    has_grok = any("grok" in model.lower() for model in provider.get("models", []))
+    if not (need_proxy or has_grok):
+        return None
+    return random.choice(AVAILABLE_PROXIES or PROXIES)
+
+# 提供商健康检查
+HEALTH_CHECK_INTERVAL = 30  # 秒
+health_checker = HealthChecker(
+    upstream_pool,
+    provider_loader=lambda: list(routing_index.providers.values()),
+    proxy_selector=select_provider_proxy,
+    model_health_loader=get_model_health,
+    interval=HEALTH_CHECK_INTERVAL
+)
+health_checker.load_model_health(get_model_health())
+_health_check_task = None
+
+# 限流：memory 为进程内计数；sqlite 在多个 worker 之间共享计数
+RATE_LIMIT_BACKEND = os.environ.get("NEXUSAI_RATE_LIMIT_BACKEND", "memory")
+rate_limiter = RateLimiter(
+    store=SQLiteBucketStore(DATA_DIR / "ratelimit.db") if RATE_LIMIT_BACKEND == "sqlite" else MemoryBucketStore(),
+    limits_loader=get_rate_limits
+)
+stats_tracker.add_listener(rate_limiter.record_usage)
+
+def reload_rate_limits():
+    """限流配置变更后重新加载，并通知其他工作进程"""
+    rate_limiter.reload()
+    shared_state.publish("rate_limits")
+
+# 准入控制：每个提供商的并发上限与优先级排队
+admission_controller = AdmissionController(
+    provider_loader=get_provider_admission,
+    priority_loader=get_key_priorities
+)
+
+def reload_admission():
+    """准入配置变更后重新加载，并通知其他工作进程"""
+    admission_controller.reload()
+    shared_state.publish("admission")
+
+def publish_health(snapshot: Dict[int, Dict[str, Any]]):
+    shared_state.publish("health", snapshot)
+
+def publish_breaker(change: Dict[str, Any]):
+    """只发布发生变化的提供商，每个提供商一个键，同时变化的多个提供商互不覆盖"""
+    shared_state.set(f"breaker:{change['provider_id']}", change)
+    shared_state.publish("breaker")
+
+def apply_shared_breakers(_):
+    health_checker.apply_breaker_states(change for _, change in shared_state.items("breaker:"))
+
+def apply_shared_proxies(proxies: Optional[List[str]]):
+    global AVAILABLE_PROXIES
+    if proxies:
+        AVAILABLE_PROXIES = proxies
+
+# 请求路径指标，由 /metrics 汇总所有工作进程后输出
+REQUESTS_TOTAL = REGISTRY.counter("nexusai_requests_total", "聊天请求数", ["mode"])
+ERRORS_TOTAL = REGISTRY.counter("nexusai_errors_total", "按类型统计的错误数", ["type"])
+ROUTING_SECONDS = REGISTRY.histogram("nexusai_routing_seconds", "密钥校验与提供商选择耗时（秒）")
+UPSTREAM_RESPONSES = REGISTRY.counter("nexusai_upstream_responses_total", "上游响应数", ["provider", "status"])
+UPSTREAM_RETRIES = REGISTRY.counter("nexusai_upstream_retries_total", "上游请求重试次数", ["provider"])
+UPSTREAM_SECONDS = REGISTRY.histogram("nexusai_upstream_request_seconds", "非流式上游请求总耗时（秒）", ["provider", "model"])
+UPSTREAM_TTFB_SECONDS = REGISTRY.histogram("nexusai_upstream_ttfb_seconds", "流式上游返回响应头的耗时（秒）", ["provider", "model"])
+TTFT_SECONDS = REGISTRY.histogram("nexusai_time_to_first_token_seconds", "从收到请求到向客户端发出首个数据块的耗时（秒）", ["provider", "model"])
+STREAM_SECONDS = REGISTRY.histogram("nexusai_stream_duration_seconds", "流式响应总时长（秒）", ["provider", "model"])
+TOKENS_PER_SECOND = REGISTRY.histogram("nexusai_completion_tokens_per_second", "生成速度（tokens/秒）", ["provider", "model"], buckets=RATE_BUCKETS)
+TOKENS_TOTAL = REGISTRY.counter("nexusai_tokens_total", "Token 数", ["provider", "model", "kind"])
+
+async def count_token_metrics(personalized_key, provider_id, model_name, tokens_count, is_prompt):
+    TOKENS_TOTAL.inc(tokens_count, provider=provider_id, model=model_name,
+                     kind="prompt" if is_prompt else "completion")
+
+stats_tracker.add_listener(count_token_metrics)
+
+# 请求追踪：每个工作进程保存最慢的 N 个请求，设置 NEXUSAI_TRACE_EXPORT 时以 OTLP/JSON 追加写入该文件
+TRACE_SLOWEST_N = 50
+trace_recorder = TraceRecorder(TRACE_SLOWEST_N, export_path=os.environ.get("NEXUSAI_TRACE_EXPORT"))
+
+# 与请求生命周期无关的后台任务（例如客户端断开后的统计写入），保留引用直到完成
+_background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+METRICS_PUBLISH_INTERVAL = 5  # 秒
+_metrics_task = None
+
+async def publish_metrics_forever():
+    """定期把本进程的指标快照和最慢请求追踪写入共享状态，由管理后台汇总"""
+    while True:
+        try:
+            shared_state.set(f"metrics:{os.getpid()}", REGISTRY.dump())
+            shared_state.set(f"traces:{os.getpid()}", trace_recorder.slowest())
+        except Exception as e:
+            logger.error(f"发布指标失败: {str(e)}")
+        await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
+
+def collect_worker_snapshots(prefix: str, local: Any) -> List[Any]:
+    """收集所有存活工作进程发布的快照（本进程使用实时数据），已退出进程的快照会被清理"""
+    snapshots = [local]
+    for key, snapshot in shared_state.items(prefix):
+        pid = int(key[len(prefix):])
+        if pid == os.getpid():
+            continue
+        if not pid_alive(pid):
+            shared_state.delete(key)
+            continue
+        snapshots.append(snapshot)
+    return snapshots
+
+def collect_metrics() -> str:
+    """汇总所有工作进程的指标"""
+    return render_metrics(merge_dumps(collect_worker_snapshots("metrics:", REGISTRY.dump())))
+
+def collect_slowest_traces(limit: int) -> List[Dict[str, Any]]:
+    """汇总所有工作进程中最慢的请求追踪"""
+    traces = [trace for snapshot in collect_worker_snapshots("traces:", trace_recorder.slowest())
+              for trace in snapshot]
+    traces.sort(key=lambda trace: trace["duration_ms"], reverse=True)
+    return traces[:limit]
+
+# 其他工作进程发布的变更：重新加载本进程的内存状态
+health_checker.on_change = publish_breaker
+shared_state.subscribe("routing", lambda _: routing_index.rebuild())
+shared_state.subscribe("rate_limits", lambda _: rate_limiter.reload())
+shared_state.subscribe("admission", lambda _: admission_controller.reload())
+shared_state.subscribe("proxies", apply_shared_proxies)
+shared_state.subscribe("health", lambda snapshot: health_checker.load_snapshot(snapshot or {}))
+shared_state.subscribe("breaker", apply_shared_breakers)
+_shared_state_task = None
+_proxy_test_task = None
+_local_encoder_task = None
+
+def start_health_checker():
+    """启动健康检查后台任务，同一进程内只启动一次"""
+    global _health_check_task
+    if _health_check_task is None or _health_check_task.done():
+        _health_check_task = asyncio.create_task(health_checker.run_forever(on_checked=publish_health))
+
+def start_probes():
+    """启动代理测试和健康检查，只在领导进程中运行，结果通过共享状态同步"""
+    global _proxy_test_task
+    if _proxy_test_task is None or _proxy_test_task.done():
+        _proxy_test_task = asyncio.create_task(test_proxy_availability())
+    start_health_checker()
+
+def start_background_tasks():
+    """启动共享状态监听和指标发布，同一进程内只启动一次"""
+    global _shared_state_task, _metrics_task, _local_encoder_task
+    if _shared_state_task is None or _shared_state_task.done():
+        _shared_state_task = asyncio.create_task(shared_state.run_watcher(on_leadership=start_probes))
+    if _metrics_task is None or _metrics_task.done():
+        _metrics_task = asyncio.create_task(publish_metrics_forever())
+    if _local_encoder_task is None:
+        # 本地 tokenizer 首次加载可能需要下载编码文件，放到线程中，加载完成前使用估算
+        _local_encoder_task = asyncio.create_task(asyncio.to_thread(load_local_encoder))
+
 # 在应用启动时启动代理测试任务
 @app.on_event("startup")
 async def startup_event():
@@ -173,11 +385,17 @@ async def startup_event():
 # 在其他应用实例上也添加启动事件
 @app_admin.on_event("startup")
 async def admin_startup_event():
-    asyncio.create_task(test_proxy_availability())
+    start_background_tasks()
 
 @app_api.on_event("startup")
 async def api_startup_event():
-    asyncio.create_task(test_proxy_availability())
+    start_background_tasks()
+    # 每个工作进程预热自己的上游连接（健康检查只在领导进程中运行）
+    run_in_background(health_checker.warm_up())
+
+@app_api.on_event("shutdown")
+async def api_shutdown_event():
+    await upstream_pool.aclose()
 
 # API 路由
 @app_admin.post("/providers")
@@ -191,6 +409,7 @@ async def create_provider(provider: ServiceProvider):
             provider.personalized_key,
             provider.description
         )
+        refresh_routing()
         return {"status": "success", "message": "服务提供商添加成功"}
     except sqlite3.IntegrityError as e:
         print(f"数据库完整性错误: {str(e)}")
@@ -210,6 +429,7 @@ async def create_provider_model(model: ProviderModel):
             model.model_name,
             model.description
         )
+        refresh_routing()
         return {"status": "success", "message": "模型添加成功"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -248,165 +468,25 @@ async def list_providers():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# WebSocket 聊天接口
+# WebSocket 聊天接口：增量帧协议、同一连接多路对话与取消、服务端多轮历史，见 ws_chat.ChatSocketSession
 @app_admin.websocket("/ws/chat")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    
-    async def send_message(message: str, provider_id: int, model_name: str):
-        try:
-            conversation_id = str(uuid.uuid4())
-            
-            # 计算并记录发送的prompt tokens
-            prompt_tokens = await tokenizer.count_tokens(message)
-            
-            logger.info(f"""
-WebSocket Token使用统计 [会话ID: {conversation_id}]
-------------------------
-发送统计:
-- 模型: {model_name}
-- Prompt Tokens: {prompt_tokens}
-- 提供商ID: {provider_id}
-------------------------
-""")
-            
-            provider_info = get_provider_info(provider_id)
-            if not provider_info:
-                await websocket.send_text(json.dumps({
-                    "error": "无效的提供商ID"
-                }))
-                return
-
-            if model_name not in provider_info["models"]:
-                await websocket.send_text(json.dumps({
-                    "error": "该提供商未配置此模型"
-                }))
-                return
-
-            server_url = provider_info["server_url"]
-            server_key = provider_info["server_key"]
-            
-            # 生成会话ID
-            conversation_id = str(uuid.uuid4())
-            
-            # 计算并记录发送的prompt tokens
-            prompt_tokens = await tokenizer.count_tokens(message)
-            await stats_tracker.record_chat(
-                conversation_id=conversation_id,
-                provider_id=provider_id,
-                model_name=model_name,
-                tokens_count=prompt_tokens,
-                is_prompt=True
-            )
-            
-            async with httpx.AsyncClient() as client:
-                headers = {
-                    "Authorization": f"Bearer {server_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                payload = {
-                    "model": model_name,
-                    "messages": [
-                        {"role": "user", "content": message}
-                    ],
-                    "temperature": 0.7,
-                    "stream": True
-                }
-                
-                print(f"发送请求: {payload}")  # 调试日志
-                async with client.stream('POST', 
-                    f"{server_url.rstrip('/')}/v1/chat/completions",
-                    json=payload,
-                    headers=headers,
-                    timeout=30.0
-                ) as response:
-                    if response.status_code != 200:
-                        error_text = f"服务器错误: {response.status_code}"
-                        print(f"错误: {error_text}")  # 调试日志
-                        await websocket.send_text(json.dumps({
-                            "error": error_text
-                        }))
-                        return
-                    
-                    current_content = ""
-                    async for line in response.aiter_lines():
-                        if line.startswith("data: "):
-                            try:
-                                data = json.loads(line[6:])
-                                if data.get("choices") and len(data["choices"]) > 0:
-                                    delta = data["choices"][0].get("delta", {})
-                                    if "content" in delta:
-                                        current_content += delta["content"]
-                                        await websocket.send_text(json.dumps({
-                                            "content": current_content,
-                                            "type": "message"
-                                        }))
-                            except json.JSONDecodeError:
-                                continue
-                    
-                    # 计算并记录接收到的completion tokens
-                    if current_content:
-                        completion_tokens = await tokenizer.count_tokens(current_content)
-                        await stats_tracker.record_chat(
-                            conversation_id=conversation_id,
-                            provider_id=provider_id,
-                            model_name=model_name,
-                            tokens_count=completion_tokens,
-                            is_prompt=False,
-                            message=current_content  # 记录完整的响应消息
-                        )
-                
-            # 在接收完整响应后
-            if current_content:
-                completion_tokens = await tokenizer.count_tokens(current_content)
-                
-                logger.info(f"""
-WebSocket Token使用统计 [会话ID: {conversation_id}]
-------------------------
-接收统计:
-- 模型: {model_name}
-- Completion Tokens: {completion_tokens}
-- 总计 Tokens: {prompt_tokens + completion_tokens}
-- 提供商ID: {provider_id}
-------------------------
-""")
-                
-                await stats_tracker.record_chat(
-                    conversation_id=conversation_id,
-                    provider_id=provider_id,
-                    model_name=model_name,
-                    tokens_count=completion_tokens,
-                    is_prompt=False,
-                    message=current_content
-                )
-                
-        except Exception as e:
-            logger.error(f"""
-WebSocket错误 [会话ID: {conversation_id if 'conversation_id' in locals() else 'N/A'}]
-------------------------
-- 模型: {model_name}
-- 错误类型: {type(e).__name__}
-- 错误信息: {str(e)}
-- 提供商ID: {provider_id}
-------------------------
-""")
-            await websocket.send_text(json.dumps({
-                "error": f"错误: {str(e)}"
-            }))
-
+    session = ChatSocketSession(
+        websocket,
+        pool=upstream_pool,
+        provider_lookup=routing_index.provider_info,
+        tokenizer=tokenizer,
+        stats_tracker=stats_tracker,
+        proxy_selector=select_provider_proxy,
+        conversations=conversation_store
+    )
     try:
-        while True:
-            data = await websocket.receive_text()
-            print(f"收到WebSocket消息: {data}")  # 调试日志
-            message_data = json.loads(data)
-            await send_message(
-                message_data["message"],
-                int(message_data["provider_id"]),
-                message_data["model_name"]
-            )
+        await session.run()
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        print(f"WebSocket错误: {str(e)}")
+        logger.error(f"WebSocket错误: {str(e)}")
         await websocket.close()
 
 # 添加删除路由
@@ -414,6 +494,7 @@ WebSocket错误 [会话ID: {conversation_id if 'conversation_id' in locals() els
 async def delete_service_provider(provider_id: int):
     try:
         delete_provider(provider_id)
+        refresh_routing()
         return {"status": "success", "message": "服务提供商删除成功"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -434,6 +515,7 @@ async def update_service_provider(provider_id: int, provider: ProviderUpdate):
             provider.personalized_key,
             provider.description
         )
+        refresh_routing()
         return {"status": "success", "message": "服务提供商更新成功"}
     except Exception as e:
         print(f"更新提供商错误: {str(e)}")
@@ -494,6 +576,7 @@ async def update_model(model_id: int, model: ProviderModel):
             model.model_name,
             model.description
         )
+        refresh_routing()
         return {"status": "success", "message": "模型更新成功"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -503,22 +586,52 @@ async def update_model(model_id: int, model: ProviderModel):
 async def delete_model(model_id: int):
     try:
         delete_provider_model(model_id)
+        refresh_routing()
         return {"status": "success", "message": "模型删除成功"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # 添加验证个性化密钥的函数
 async def verify_personalized_key(personalized_key: str, model_name: str):
-    """验证个性化密钥是否对应指定模型的提供商"""
-    async with aiosqlite.connect(str(DATABASE_PATH)) as db:
-        async with db.execute("""
-            SELECT sp.id 
-            FROM service_providers sp
-            JOIN provider_models pm ON sp.id = pm.provider_id
-            WHERE sp.personalized_key = ? AND pm.model_name = ?
-        """, (personalized_key, model_name)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else None
+    """验证个性化密钥是否对应指定模型的提供商，多个提供商匹配时按健康状态选择"""
+    return health_checker.pick_provider(routing_index.candidates(personalized_key, model_name), model_name)
+
+# 提供商健康状态
+@app_admin.get("/health/providers")
+async def get_providers_health():
+    return {"interval": health_checker.interval, "providers": health_checker.snapshot()}
+
+@app_admin.get("/metrics")
+async def get_metrics():
+    """Prometheus 文本格式的指标，汇总所有工作进程"""
+    return Response(content=collect_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app_admin.get("/traces/slowest")
+async def get_slowest_traces(limit: int = 20):
+    """最慢的请求追踪（所有工作进程汇总），包含各阶段耗时"""
+    return {"traces": collect_slowest_traces(limit)}
+
+@app_admin.get("/shared_state")
+async def get_shared_state():
+    """共享状态版本号与领导进程（用于排查多进程间的同步）"""
+    return shared_state.snapshot()
+
+@app_admin.post("/health/providers/check")
+async def check_providers_health():
+    """立即执行一次健康检查"""
+    snapshot = await health_checker.check_all()
+    publish_health(snapshot)
+    return {"interval": health_checker.interval, "providers": snapshot}
+
+@app_admin.post("/health/models/reload")
+async def reload_model_health():
+    """重新加载模型巡检结果（test_all_url.py 巡检完成后调用），并同步给其他工作进程"""
+    try:
+        health_checker.load_model_health(get_model_health())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    publish_health(health_checker.snapshot())
+    return {"status": "success", "message": "模型巡检结果已重新加载"}
 
 # 添加一个新的统计路由
 @app_admin.get("/stats/conversation/{conversation_id}")
@@ -529,58 +642,139 @@ async def get_conversation_stats(conversation_id: str):
 async def get_total_stats():
     return await stats_tracker.get_total_stats()
 
+# 限流配置
+@app_admin.get("/rate_limits")
+async def list_rate_limits():
+    try:
+        return {
+            "backend": RATE_LIMIT_BACKEND,
+            "rate_limits": [{
+                "scope": scope,
+                "target": target,
+                "rpm": rpm,
+                "tpm": tpm,
+                "daily_tokens": daily_tokens
+            } for scope, target, rpm, tpm, daily_tokens in get_rate_limits()]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app_admin.put("/rate_limits/{scope}/{target}")
+async def update_rate_limit(scope: str, target: str, config: RateLimitConfig):
+    try:
+        set_rate_limit(scope, target, config.rpm, config.tpm, config.daily_tokens)
+        reload_rate_limits()
+        return {"status": "success", "message": "限流配置更新成功"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app_admin.delete("/rate_limits/{scope}/{target}")
+async def remove_rate_limit(scope: str, target: str):
+    try:
+        delete_rate_limit(scope, target)
+        reload_rate_limits()
+        return {"status": "success", "message": "限流配置删除成功"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app_admin.get("/rate_limits/usage/{personalized_key}")
+async def get_rate_limit_usage(personalized_key: str):
+    return await rate_limiter.get_usage(personalized_key)
+
+# 准入控制配置与指标
+@app_admin.get("/admission")
+async def get_admission_stats():
+    return {
+        "providers": admission_controller.snapshot(),
+        "policies": [{
+            "provider_id": provider_id,
+            "max_concurrency": max_concurrency,
+            "max_queue": max_queue,
+            "queue_timeout": queue_timeout
+        } for provider_id, max_concurrency, max_queue, queue_timeout in get_provider_admission()],
+        "priorities": dict(get_key_priorities())
+    }
+
+@app_admin.put("/admission/providers/{provider_id}")
+async def update_provider_admission(provider_id: int, config: AdmissionConfig):
+    try:
+        set_provider_admission(provider_id, config.max_concurrency, config.max_queue, config.queue_timeout)
+        reload_admission()
+        return {"status": "success", "message": "准入配置更新成功"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app_admin.put("/admission/priorities/{personalized_key}")
+async def update_key_priority(personalized_key: str, config: KeyPriority):
+    try:
+        set_key_priority(personalized_key, config.priority)
+        reload_admission()
+        return {"status": "success", "message": "优先级更新成功"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def trace_headers(trace: Trace) -> Dict[str, str]:
+    """追踪相关的响应头：各阶段耗时（Server-Timing）与追踪ID"""
+    return {"Server-Timing": trace.server_timing(), "X-Trace-Id": trace.trace_id}
+
+def rate_limited_response(rate_result, trace: Trace) -> Response:
+    """限流拒绝时的 429 响应"""
+    ERRORS_TOTAL.inc(type="rate_limited")
+    return Response(
+        content=json.dumps(rate_result.error_body(), ensure_ascii=False),
+        status_code=429,
+        headers={**rate_result.headers(), **trace_headers(trace)},
+        media_type="application/json"
+    )
+
+def overloaded_response(e: AdmissionRejected, trace: Trace) -> Response:
+    """准入控制拒绝时的 503 响应"""
+    ERRORS_TOTAL.inc(type="overloaded")
+    return Response(
+        content=json.dumps({
+            "error": {
+                "message": e.reason,
+                "type": "overloaded_error",
+                "code": 503
+            }
+        }, ensure_ascii=False),
+        status_code=503,
+        headers={"Retry-After": str(max(1, int(e.retry_after))), **trace_headers(trace)},
+        media_type="application/json"
+    )
+
 # 添加一个通用的流式处理函数
 async def handle_chat_completions(request: Request):
     """统一处理聊天请求，根据baseurl选择最终路径"""
+    request_start = time.perf_counter()
+    trace = Trace("chat.completions", request.headers.get("traceparent"))
+    stream_started = False  # 流式响应在生成器结束时才记录追踪
     try:
+        parse_span = trace.start_span("parse")
         body = await request.json()
         messages = body.get("messages", [])
-        count_text = ""
-        
-        # 确保 messages 是字符串而不是列表
-        if isinstance(messages, list):
-            # 提取内容，确保每个元素都是字符串
-            # messages = []
-            for msg in messages:
-                if isinstance(msg, dict):
-                    # 如果是字典，提取内容
-                    content = msg.get("content", "")
-                    if isinstance(content, list):
-                        for item in content:
-                            if isinstance(item, dict):
-                                if item.get("type") == "text":
-                                    count_text += item.get("text", "")
-                    elif isinstance(content, str):
-                        count_text += content
-                elif isinstance(msg, str):
-                    count_text += msg
-                # 处理文件数据（如图片）
-                elif isinstance(msg, list):
-                    # 这里可以根据需要处理文件数据
-                    # 例如，记录文件信息或将其转换为字符串
-                    count_text += "包含文件数据"  # 你可以自定义处理逻辑
-
-        else:
-            count_text = str(messages)  # 如果不是列表，转换为列表
-
-        prompt_text = count_text  # 确保 prompt_text 是字符串
+        prompt_text = flatten_messages(messages)
+        trace.end_span(parse_span)
         
         # 尝试从最后一条用户消息中找到相关会话
         conversation_id = None
-        if messages:
-            last_message = messages[-1]
-            last_conversation = await stats_tracker.get_last_conversation(last_message)
-            if last_conversation:
-                conversation_id = last_conversation["conversation_id"]
+        with trace.span("conversation"):
+            if messages:
+                last_message = messages[-1]
+                last_conversation = await stats_tracker.get_last_conversation(last_message)
+                if last_conversation:
+                    conversation_id = last_conversation["conversation_id"]
         
         # 如果没找到相关会话，创建新的会话ID
         if not conversation_id:
             conversation_id = str(uuid.uuid4())
+        trace.attributes["conversation_id"] = conversation_id
         
         if DEBUG_MODE:
             logger.info(f"开始处理新的请求 [会话ID: {conversation_id}]")
         
         # 获取Authorization header
+        auth_span = trace.start_span("auth")
         auth_header = request.headers.get("Authorization")
         if not auth_header or not auth_header.startswith("Bearer "):
             if DEBUG_MODE:
@@ -594,9 +788,8 @@ async def handle_chat_completions(request: Request):
         is_stream = body.get("stream", False)
         
         if DEBUG_MODE:
-            if DEBUG_MODE == "Detail":
-                logger.info(f"请求体: {json.dumps(body, ensure_ascii=False, indent=2)}")
-                logger.info(f"请求头: {dict(request.headers)}")
+            request_logger.debug("请求体: %s", body)
+            request_logger.debug("请求头: %s", request.headers)
             logger.info(f"是否使用流式传输: {is_stream}")
         
         model_name = body.get("model")
@@ -610,15 +803,21 @@ async def handle_chat_completions(request: Request):
         if DEBUG_MODE and is_grok_model:
             logger.info(f"检测到Grok模型: {model_name}")
         
+        REQUESTS_TOTAL.inc(mode="stream" if is_stream else "non_stream")
+        trace.end_span(auth_span)
+        trace.attributes.update({"model": model_name, "stream": bool(is_stream)})
+        
         # 验证个性化密钥
+        routing_span = trace.start_span("routing")
         provider_id = await verify_personalized_key(personalized_key, model_name)
+        ROUTING_SECONDS.observe((time.perf_counter() - routing_span.start))
         if not provider_id:
             if DEBUG_MODE:
                 logger.error(f"无效的API密钥或该密钥无权访问模型: {model_name}")
             raise HTTPException(status_code=401, detail="无效的API密钥或该密钥无权访问指定模型")
         
         # 获取提供商信息
-        provider_info = get_provider_info(provider_id)
+        provider_info = routing_index.provider_info(provider_id)
         if not provider_info:
             if DEBUG_MODE:
                 logger.error("提供商配置不存在")
@@ -629,33 +828,52 @@ async def handle_chat_completions(request: Request):
                 logger.error(f"不支持的模型: {model_name}")
             raise HTTPException(status_code=400, detail="不支持的模型")
         
+        trace.end_span(routing_span)
+        trace.attributes["provider_id"] = provider_id
+        
         # 检查提供商描述是否包含proxy关键字
         need_proxy = "proxy" in provider_info.get("description", "").lower()
         if need_proxy and DEBUG_MODE:
             logger.info(f"提供商描述包含proxy关键字，将使用代理: {provider_info.get('description')}")
         
         # 计算并记录发送的prompt tokens
-        prompt_tokens = await tokenizer.count_tokens(prompt_text)
+        with trace.span("tokenize"):
+            prompt_tokens = await tokenizer.count_tokens(prompt_text)
         
-        logger.info(f"""
-Token使用统计 [会话ID: {conversation_id}]
-------------------------
-发送统计:
-- 模型: {model_name}
-- Prompt Tokens: {prompt_tokens}
-- 提供商ID: {provider_id}
-------------------------
-""")
+        request_logger.info("发送统计", extra={
+            "conversation_id": conversation_id,
+            "model": model_name,
+            "provider_id": provider_id,
+            "prompt_tokens": prompt_tokens
+        })
         
-        await stats_tracker.record_chat(
-            conversation_id=conversation_id,
-            provider_id=provider_id,
-            model_name=model_name,
-            tokens_count=prompt_tokens,
-            is_prompt=True
-        )
+        # 限流检查（放行时同时扣减额度）
+        with trace.span("rate_limit"):
+            rate_result = await rate_limiter.check(personalized_key, provider_id, prompt_tokens)
+        if not rate_result.allowed:
+            return rate_limited_response(rate_result, trace)
+        
+        # 准入控制：获取提供商并发名额，排队已满或超时时快速返回 503
+        try:
+            with trace.span("admission"):
+                admission_ticket = await admission_controller.acquire(provider_id, personalized_key)
+        except AdmissionRejected as e:
+            # 没有发出请求，退还限流检查时扣减的额度
+            await rate_limiter.refund(personalized_key, provider_id, prompt_tokens)
+            return overloaded_response(e, trace)
+        
+        with trace.span("stats_write"):
+            await stats_tracker.record_chat(
+                conversation_id=conversation_id,
+                provider_id=provider_id,
+                model_name=model_name,
+                tokens_count=prompt_tokens,
+                is_prompt=True,
+                personalized_key=personalized_key
+            )
 
         # 保存请求信息
+        save_span = trace.start_span("save_message")
         save_message_to_file({
             "timestamp": datetime.now().isoformat(),
             "headers": dict(request.headers),
@@ -667,8 +885,10 @@ Token使用统计 [会话ID: {conversation_id}]
                 "completion": ""  # 稍后补充
             }
         })
+        trace.end_span(save_span)
 
         # 根据条件选择代理
+        proxy_span = trace.start_span("proxy")
         proxy = None
         if need_proxy or is_grok_model:
             if AVAILABLE_PROXIES:
@@ -680,21 +900,10 @@ Token使用统计 [会话ID: {conversation_id}]
                 proxy = random.choice(PROXIES)
                 logger.warning(f"使用可能不可用的代理: {proxy}")
         
-        # 创建带代理的客户端（根据需要）
-        client = AsyncClient(transport=AsyncHTTPTransport(proxy=proxy)) if proxy else AsyncClient()
-        
-        # 简化URL构建逻辑
-        base_url = provider_info['server_url'].rstrip('/')
+        trace.end_span(proxy_span)
         
-        # 如果URL以'/'结尾，直接使用chat/completions
-        if provider_info['server_url'].endswith(('/')):
-            upstream_url = f"{base_url}/chat/completions"
-        # 如果URL以'#'结尾，后面不加任何内容
-        elif provider_info['server_url'].endswith(('#')):
-            upstream_url = f"{base_url}"
-        else:
-            # 默认行为：添加 /v1/chat/completions
-            upstream_url = f"{base_url}/v1/chat/completions"
+        # 构建上游URL（'/' 结尾直接拼接 chat/completions，'#' 结尾原样使用，否则拼接 /v1/chat/completions）
+        upstream_url = build_upstream_url(provider_info['server_url'])
 
         if DEBUG_MODE:
             logger.info(f"上游请求URL: {upstream_url}")
@@ -710,68 +919,87 @@ Token使用统计 [会话ID: {conversation_id}]
         if not is_stream:
             if DEBUG_MODE:
                 logger.info("使用非流式响应")
-            for attempt in range(retry_count):
-                try:
-                    # 创建带代理的异步transport（根据需要）
-                    if need_proxy or is_grok_model:
-                        if AVAILABLE_PROXIES:
-                            proxy_url = random.choice(AVAILABLE_PROXIES)
-                            logger.info(f"使用代理: {proxy_url}")
+            upstream_span = trace.start_span("upstream")
+            try:
+                for attempt in range(retry_count):
+                    try:
+                        # 创建带代理的异步transport（根据需要）
+                        if need_proxy or is_grok_model:
+                            if AVAILABLE_PROXIES:
+                                proxy_url = random.choice(AVAILABLE_PROXIES)
+                                logger.info(f"使用代理: {proxy_url}")
+                            else:
+                                proxy_url = random.choice(PROXIES)
+                                logger.warning(f"使用可能不可用的代理: {proxy_url}")
+                            client = upstream_pool.get_client(proxy_url)
                         else:
-                            proxy_url = random.choice(PROXIES)
-                            logger.warning(f"使用可能不可用的代理: {proxy_url}")
-                        transport = AsyncHTTPTransport(proxy=proxy_url)
-                        client = AsyncClient(transport=transport)
-                    else:
-                        client = AsyncClient()
+                            client = upstream_pool.get_client()
 
-                    if attempt > 0 and DEBUG_MODE:
-                        logger.info(f"第 {attempt + 1} 次重试请求")
+                        if attempt > 0 and DEBUG_MODE:
+                            logger.info(f"第 {attempt + 1} 次重试请求")
                     
-                    # 增加超时时间，特别是对于Grok模型
-                    timeout = 300.0 if is_grok_model else 120.0
-                    
-                    if DEBUG_MODE:
-                        logger.info(f"设置请求超时时间: {timeout}秒")
+                        # 增加超时时间，特别是对于Grok模型
+                        timeout = 300.0 if is_grok_model else 120.0
                     
-                    response = await client.post(
-                        upstream_url,
-                        json=body,
-                        headers=headers,
-                        timeout=timeout
-                    )
-                    break  # 如果请求成功，跳出重试循环
+                        if DEBUG_MODE:
+                            logger.info(f"设置请求超时时间: {timeout}秒")
                     
-                except (httpx.ReadTimeout, httpx.ConnectTimeout) as e:
-                    if attempt == retry_count - 1:  # 最后一次尝试
-                        raise HTTPException(
-                            status_code=504,
-                            detail={
-                                "error": "请求超时",
-                                "type": "timeout_error",
-                                "message": f"上游服务器响应时间过长或连接超时 ({type(e).__name__})",
-                                "attempts": retry_count
-                            }
+                        upstream_start = time.perf_counter()
+                        response = await client.post(
+                            upstream_url,
+                            json=body,
+                            headers=headers,
+                            timeout=timeout
                         )
-                    await asyncio.sleep(retry_delay)  # 等待一段时间后重试
+                        upstream_seconds = time.perf_counter() - upstream_start
+                        UPSTREAM_SECONDS.observe(upstream_seconds, provider=provider_id, model=model_name)
+                        break  # 如果请求成功，跳出重试循环
                     
-                except httpx.RequestError as e:
-                    logger.error(f"请求错误 [尝试次数: {attempt + 1}/{retry_count}] - 错误信息: {str(e)}")
-                    if attempt == retry_count - 1:  # 最后一次尝试
-                        raise HTTPException(
-                            status_code=502,
-                            detail={
-                                "error": str(e),
-                                "type": "request_error",
-                                "message": "与上游服务器通信时发生错误"
-                            }
-                        )
-                    await asyncio.sleep(retry_delay)  # 等待一段时间后重试
-                finally:
-                    if attempt == retry_count - 1:  # 最后一次尝试后关闭客户端
-                        await client.aclose()
+                    except (httpx.ReadTimeout, httpx.ConnectTimeout) as e:
+                        health_checker.record_failure(provider_id, f"{type(e).__name__}: {str(e)}")
+                        ERRORS_TOTAL.inc(type="timeout_error")
+                        if attempt == retry_count - 1:  # 最后一次尝试
+                            raise HTTPException(
+                                status_code=504,
+                                detail={
+                                    "error": "请求超时",
+                                    "type": "timeout_error",
+                                    "message": f"上游服务器响应时间过长或连接超时 ({type(e).__name__})",
+                                    "attempts": retry_count
+                                }
+                            )
+                        UPSTREAM_RETRIES.inc(provider=provider_id)
+                        await asyncio.sleep(retry_delay)  # 等待一段时间后重试
+                    
+                    except httpx.RequestError as e:
+                        health_checker.record_failure(provider_id, f"{type(e).__name__}: {str(e)}")
+                        logger.error(f"请求错误 [尝试次数: {attempt + 1}/{retry_count}] - 错误信息: {str(e)}")
+                        ERRORS_TOTAL.inc(type="request_error")
+                        if attempt == retry_count - 1:  # 最后一次尝试
+                            raise HTTPException(
+                                status_code=502,
+                                detail={
+                                    "error": str(e),
+                                    "type": "request_error",
+                                    "message": "与上游服务器通信时发生错误"
+                                }
+                            )
+                        UPSTREAM_RETRIES.inc(provider=provider_id)
+                        await asyncio.sleep(retry_delay)  # 等待一段时间后重试
+            finally:
+                # 上游请求结束后归还并发名额
+                admission_ticket.release()
+                trace.end_span(upstream_span)
+                upstream_span.attributes["attempts"] = attempt + 1
+            
+            UPSTREAM_RESPONSES.inc(provider=provider_id, status=response.status_code)
+            if response.status_code >= 500:
+                health_checker.record_failure(provider_id, f"HTTP {response.status_code}")
+            else:
+                health_checker.record_success(provider_id)
             
             if response.status_code != 200:
+                ERRORS_TOTAL.inc(type="upstream_error")
                 if DEBUG_MODE:
                     logger.error(f"上游服务器错误: {response.status_code}")
                 # 获取响应头
@@ -791,27 +1019,27 @@ Token使用统计 [会话ID: {conversation_id}]
                         "X-RateLimit-Limit": headers.get("X-RateLimit-Limit", ""),
                         "X-RateLimit-Remaining": headers.get("X-RateLimit-Remaining", ""),
                         "X-RateLimit-Reset": headers.get("X-RateLimit-Reset", ""),
-                        "Content-Type": "application/json"
+                        "Content-Type": "application/json",
+                        **trace_headers(trace)
                     }
                 )
             
-            if DEBUG_MODE:
-                logger.info(f"非流式响应内容: {response.text}")
+            if request_logger.isEnabledFor(logging.DEBUG):
+                request_logger.debug("非流式响应内容: %s", response.text)
             
             # 在成功接收响应后
+            post_span = trace.start_span("post_processing")
             completion_text = ""  # 初始化变量
             if response.status_code == 200:
                 try:
                     response_data = response.json()
                     
                     # 记录原始响应数据，用于调试
-                    if DEBUG_MODE == "Detail":
-                        logger.info(f"原始响应数据结构: {json.dumps(response_data, ensure_ascii=False)}")
+                    request_logger.debug("原始响应数据结构: %s", response_data)
                     
                     # 处理Grok模型的特殊返回格式
                     if is_grok_model:
-                        if DEBUG_MODE == "Detail":
-                            logger.info("处理Grok模型的响应格式")
+                        request_logger.debug("处理Grok模型的响应格式")
                         
                         # 转换Grok格式为OpenAI标准格式
                         if "choices" in response_data and len(response_data["choices"]) > 0:
@@ -897,17 +1125,16 @@ Token使用统计 [会话ID: {conversation_id}]
                 
                 if completion_text:
                     completion_tokens = await tokenizer.count_tokens(completion_text)
+                    if upstream_seconds > 0:
+                        TOKENS_PER_SECOND.observe(completion_tokens / upstream_seconds,
+                                                  provider=provider_id, model=model_name)
                     
-                    logger.info(f"""
-Token使用统计 [会话ID: {conversation_id}]
-------------------------
-接收统计:
-- 模型: {model_name}
-- Completion Tokens: {completion_tokens}
-- 总计 Tokens: {prompt_tokens + completion_tokens}
-- 提供商ID: {provider_id}
-------------------------
-""")
+                    request_logger.info("接收统计", extra={
+                        "conversation_id": conversation_id,
+                        "model": model_name,
+                        "provider_id": provider_id,
+                        "completion_tokens": completion_tokens
+                    })
                     
                     await stats_tracker.record_chat(
                         conversation_id=conversation_id,
@@ -915,7 +1142,8 @@ Token使用统计 [会话ID: {conversation_id}]
                         model_name=model_name,
                         tokens_count=completion_tokens,
                         is_prompt=False,
-                        message=completion_text
+                        message=completion_text,
+                        personalized_key=personalized_key
                     )
 
             # 更新保存的完成内容
@@ -927,16 +1155,64 @@ Token使用统计 [会话ID: {conversation_id}]
                     }
                 })
             
+            trace.end_span(post_span)
             return Response(
                 content=response_text if 'response_text' in locals() else response.text,
-                media_type="application/json"
+                media_type="application/json",
+                headers={**rate_result.headers(), **trace_headers(trace)}
             )
         
         if DEBUG_MODE:
             logger.info("使用流式响应")
         
         async def stream_generator():
-            current_content = ""
+            # 逐块累计完成内容和 token 数，适用于所有提供商（上游返回 usage 时以其为准）
+            completion = CompletionAccumulator(count_tokens_local)
+            completion_recorded = False
+            finish_reason = "client_disconnected"
+            stream_start = time.perf_counter()
+            first_chunk_at = None
+            ttfb_span = trace.start_span("upstream_ttfb")
+            relay_span = None
+
+            async def record_completion():
+                """记录完成统计（每个请求只记录一次，客户端中途断开时记录已收到的部分）"""
+                nonlocal completion_recorded
+                completion_recorded = True
+                if not completion.parts and completion.usage is None:
+                    return
+                completion_tokens = completion.completion_tokens
+                if finish_reason == "stop" and first_chunk_at is not None:
+                    generation_seconds = time.perf_counter() - first_chunk_at
+                    if generation_seconds > 0:
+                        TOKENS_PER_SECOND.observe(completion_tokens / generation_seconds,
+                                                  provider=provider_id, model=model_name)
+
+                request_logger.info("流式响应统计", extra={
+                    "conversation_id": conversation_id,
+                    "model": model_name,
+                    "provider_id": provider_id,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "usage_source": "upstream" if completion.usage is not None else "local",
+                    "finish_reason": finish_reason
+                })
+                await stats_tracker.record_chat(
+                    conversation_id=conversation_id,
+                    provider_id=provider_id,
+                    model_name=model_name,
+                    tokens_count=completion_tokens,
+                    is_prompt=False,
+                    message=completion.text,
+                    personalized_key=personalized_key
+                )
+                save_message_to_file({
+                    "timestamp": datetime.now().isoformat(),
+                    "conversation_content": {
+                        "completion": completion.text
+                    }
+                })
+
             try:
                 # 创建带代理的异步transport（根据需要）
                 if need_proxy or is_grok_model:
@@ -946,16 +1222,14 @@ Token使用统计 [会话ID: {conversation_id}]
                     else:
                         proxy_url = random.choice(PROXIES)
                         logger.warning(f"流式响应使用可能不可用的代理: {proxy_url}")
-                    transport = AsyncHTTPTransport(proxy=proxy_url)
-                    client = AsyncClient(transport=transport)
+                    client = upstream_pool.get_client(proxy_url)
                 else:
-                    client = AsyncClient()
+                    client = upstream_pool.get_client()
 
                 # 增加超时时间，特别是对于Grok模型
                 timeout = 300.0 if is_grok_model else 60.0
                 
-                if DEBUG_MODE == "Detail":
-                    logger.info(f"设置流式请求超时时间: {timeout}秒")
+                stream_logger.debug("设置流式请求超时时间: %s秒", timeout)
                 
                 async with client.stream(
                     'POST',
@@ -964,7 +1238,16 @@ Token使用统计 [会话ID: {conversation_id}]
                     headers=headers,
                     timeout=timeout
                 ) as response:
+                    trace.end_span(ttfb_span)
+                    relay_span = trace.start_span("stream_relay")
+                    UPSTREAM_TTFB_SECONDS.observe(ttfb_span.duration_ms / 1000, provider=provider_id, model=model_name)
+                    UPSTREAM_RESPONSES.inc(provider=provider_id, status=response.status_code)
+                    if response.status_code >= 500:
+                        health_checker.record_failure(provider_id, f"HTTP {response.status_code}")
+                    else:
+                        health_checker.record_success(provider_id)
                     if response.status_code != 200:
+                        ERRORS_TOTAL.inc(type="upstream_error")
                         error_response = await response.aread()
                         if DEBUG_MODE:
                             logger.error(f"上游服务器错误: {response.status_code}, 响应内容: {error_response}")
@@ -980,125 +1263,39 @@ Token使用统计 [会话ID: {conversation_id}]
                         return
 
                     async for line in response.aiter_lines():
-                        line = line.strip()
-                        if not line:
+                        # 过滤空行、注释行和心跳信号
+                        data_str = parse_sse_line(line)
+                        if data_str is None:
                             continue
                         
-                        # 过滤非数据行和心跳信号
-                        if line.startswith(':'):  # 过滤以冒号开头的SSE注释行
-                            if DEBUG_MODE == "Detail":
-                                logger.info(f"跳过心跳/注释行: {line}")
-                            continue
-                        
-                        # 处理特殊结束标记
-                        if "[DONE]" in line:
-                            if DEBUG_MODE == "Detail":
-                                logger.info("接收到流式结束标记 [DONE]")
-                            yield "data: [DONE]\n\n".encode('utf-8')
-                            continue
+                        # 处理特殊结束标记（结束标记在循环结束后统一发送一次）
+                        if data_str == SSE_DONE:
+                            stream_logger.debug("接收到流式结束标记 [DONE]")
+                            break
                         
                         try:
-                            # 改进数据提取逻辑
-                            if line.startswith('data: '):
-                                data_str = line[6:].strip()
-                            else:
-                                data_str = line  # 尝试解析整行作为数据
-                            
-                            if not data_str or data_str == "[DONE]":
-                                continue
-                            
-                            if DEBUG_MODE == "Detail":
-                                logger.info(f"尝试解析的数据内容: {data_str}")
+                            stream_logger.debug("尝试解析的数据内容: %s", data_str)
                             
                             data = json.loads(data_str)
                             
+                            if not isinstance(data, dict):
+                                continue
+
                             # 处理Grok模型的流式响应
                             if is_grok_model:
-                                if DEBUG_MODE == "Detail":
-                                    logger.info(f"处理Grok流式响应: {json.dumps(data, ensure_ascii=False)}")
-                                
-                                # 确保数据有正确的结构
-                                if "choices" not in data:
-                                    data["choices"] = [{"index": 0}]
-                                elif not data["choices"]:
-                                    data["choices"] = [{"index": 0}]
-                                
-                                choice = data["choices"][0]
-                                content = ""
+                                stream_logger.debug("处理Grok流式响应: %s", data_str)
+                                completion.add(normalize_grok_chunk(data, model_name))
+                                completion.observe_usage(data)
                                 
-                                # 检查各种可能的字段格式
-                                if "delta" in choice:
-                                    # 已经是delta格式，检查内容
-                                    if isinstance(choice["delta"], dict):
-                                        if "content" in choice["delta"]:
-                                            content = choice["delta"]["content"]
-                                        # 确保有role字段
-                                        if "role" not in choice["delta"]:
-                                            choice["delta"]["role"] = "assistant"
-                                    elif isinstance(choice["delta"], str):
-                                        content = choice["delta"]
-                                        choice["delta"] = {
-                                            "role": "assistant",
-                                            "content": content
-                                        }
-                                elif "message" in choice:
-                                    # 需要转换message为delta
-                                    if isinstance(choice["message"], dict):
-                                        content = choice["message"].get("content", "")
-                                        role = choice["message"].get("role", "assistant")
-                                    else:
-                                        content = str(choice["message"])
-                                        role = "assistant"
-                                    
-                                    # 创建标准delta格式
-                                    choice["delta"] = {
-                                        "role": role,
-                                        "content": content
-                                    }
-                                    # 删除原始message字段
-                                    del choice["message"]
-                                elif "text" in choice:
-                                    content = choice["text"]
-                                    choice["delta"] = {
-                                        "role": "assistant",
-                                        "content": content
-                                    }
-                                    del choice["text"]
-                                elif "content" in choice:
-                                    content = choice["content"]
-                                    choice["delta"] = {
-                                        "role": "assistant",
-                                        "content": content
-                                    }
-                                    del choice["content"]
-                                else:
-                                    # 找不到任何内容字段，创建空delta
-                                    choice["delta"] = {
-                                        "role": "assistant",
-                                        "content": ""
-                                    }
-                                
-                                # 确保其他必要字段存在
-                                if "index" not in choice:
-                                    choice["index"] = 0
-                                
-                                # 确保基本字段存在
-                                if "id" not in data:
-                                    data["id"] = f"chatcmpl-{uuid.uuid4()}"
-                                if "object" not in data:
-                                    data["object"] = "chat.completion.chunk"
-                                if "created" not in data:
-                                    data["created"] = int(time.time())
-                                if "model" not in data:
-                                    data["model"] = model_name
-                                
-                                if content:
-                                    current_content += content
-                                
-                                if DEBUG_MODE == "Detail":
-                                    logger.info(f"转换后的Grok流式响应: {json.dumps(data, ensure_ascii=False)}")
+                                if stream_logger.isEnabledFor(logging.DEBUG):
+                                    stream_logger.debug("转换后的Grok流式响应: %s", json.dumps(data, ensure_ascii=False))
+                            else:
+                                completion.feed(data)
                             
                             # 发送处理后的数据
+                            if first_chunk_at is None:
+                                first_chunk_at = time.perf_counter()
+                                TTFT_SECONDS.observe(first_chunk_at - request_start, provider=provider_id, model=model_name)
                             yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
                             
                         except json.JSONDecodeError as e:
@@ -1112,30 +1309,17 @@ Token使用统计 [会话ID: {conversation_id}]
                     
                     # 确保发送结束标记
                     yield "data: [DONE]\n\n".encode('utf-8')
+                    trace.end_span(relay_span)
                     
                     # 在流式响应结束后保存完整内容
-                    if current_content:
-                        completion_tokens = await tokenizer.count_tokens(current_content)
-                        
-                        logger.info(f"""
-Token使用统计 [会话ID: {conversation_id}]
-------------------------
-流式响应统计:
-- 模型: {model_name}
-- Prompt Tokens: {prompt_tokens}
-- Completion Tokens: {completion_tokens}
-- 总计 Tokens: {prompt_tokens + completion_tokens}
-- 提供商ID: {provider_id}
-------------------------
-""")
-                        save_message_to_file({
-                            "timestamp": datetime.now().isoformat(),
-                            "conversation_content": {
-                                "completion": current_content
-                            }
-                        })
+                    post_span = trace.start_span("post_processing")
+                    finish_reason = "stop"
+                    await record_completion()
+                    trace.end_span(post_span)
 
             except httpx.ConnectError as e:
+                health_checker.record_failure(provider_id, f"{type(e).__name__}: {str(e)}")
+                ERRORS_TOTAL.inc(type="connection_error")
                 logger.error(f"""
 连接错误 [会话ID: {conversation_id}]
 ------------------------
@@ -1145,6 +1329,7 @@ Token使用统计 [会话ID: {conversation_id}]
 - 提供商ID: {provider_id}
 ------------------------
 """)
+                finish_reason = "error"
                 error_msg = {
                     "error": {
                         "message": f"连接错误: {str(e)}",
@@ -1164,6 +1349,8 @@ Token使用统计 [会话ID: {conversation_id}]
 - 提供商ID: {provider_id}
 ------------------------
 """)
+                ERRORS_TOTAL.inc(type="stream_error")
+                finish_reason = "error"
                 error_msg = {
                     "error": {
                         "message": f"处理流式响应时发生错误: {str(e)}",
@@ -1175,22 +1362,36 @@ Token使用统计 [会话ID: {conversation_id}]
                 yield "data: [DONE]\n\n".encode('utf-8')
             
             finally:
-                await client.aclose()
+                # 流结束（包括客户端断开）时归还并发名额
+                admission_ticket.release()
+                if not completion_recorded:
+                    # 客户端断开时生成器已被取消，在独立任务中记录已收到的部分
+                    run_in_background(record_completion())
+                STREAM_SECONDS.observe(time.perf_counter() - stream_start, provider=provider_id, model=model_name)
+                trace_recorder.record(trace)
 
+        stream_started = True
         return StreamingResponse(
             stream_generator(),
             media_type="text/event-stream",
+            background=BackgroundTask(admission_ticket.release),  # 兜底：生成器未启动时也能归还
             headers={
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
                 "Transfer-Encoding": "chunked",
                 "X-Accel-Buffering": "no",
                 "Content-Type": "text/event-stream",
-                "X-Conversation-Id": conversation_id
+                "X-Conversation-Id": conversation_id,
+                **rate_result.headers(),
+                **trace_headers(trace)
             }
         )
 
     except Exception as e:
+        if 'admission_ticket' in locals():
+            admission_ticket.release()
+        ERRORS_TOTAL.inc(type=f"http_{e.status_code}" if isinstance(e, HTTPException) else "server_error")
+        trace.attributes["error"] = type(e).__name__
         logger.error(f"""
 系统错误 [会话ID: {conversation_id if 'conversation_id' in locals() else 'N/A'}]
 ------------------------
@@ -1208,6 +1409,9 @@ Token使用统计 [会话ID: {conversation_id}]
                 "message": "处理请求时发生内部错误"
             }
         )
+    finally:
+        if not stream_started:
+            trace_recorder.record(trace)
 
 # API接口路由
 @app_api.post("/v1/chat/completions")
@@ -1220,56 +1424,264 @@ async def chat_completions(request: Request):
     """将非版本号请求重定向到 v1 接口"""
     return await handle_chat_completions(request)
 
+# embeddings 上游请求的重试次数、重试间隔（秒）和超时（秒）
+EMBEDDING_RETRY_COUNT = 3
+EMBEDDING_RETRY_DELAY = 1
+EMBEDDING_TIMEOUT = 60.0
+
+def bearer_key(request: Request) -> str:
+    """从 Authorization header 中取出个性化密钥"""
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="缺少有效的Authorization header")
+    return auth_header.split(" ")[1]
+
+def count_input_tokens(inputs: Any) -> int:
+    """本地计算 embeddings 请求 input 的 token 数（字符串、字符串列表或 token ID 列表）"""
+    if isinstance(inputs, str):
+        return count_tokens_local(inputs)
+    if isinstance(inputs, list):
+        if inputs and all(isinstance(item, int) for item in inputs):
+            return len(inputs)
+        return sum(count_input_tokens(item) for item in inputs)
+    return 0
+
+async def forward_embeddings(body: Dict[str, Any], personalized_key: str, trace: Trace) -> Response:
+    """
+    把 embeddings 请求转发给上游
+
+    与聊天接口相同：密钥校验和路由走内存索引，经过限流和准入控制，复用上游连接池，
+    并把输入 token 数（上游返回 usage 时以其为准）记入统计。上游响应原样返回。
+    """
+    model_name = body.get("model")
+    if not model_name:
+        raise HTTPException(status_code=400, detail="缺少model参数")
+    if not body.get("input"):
+        raise HTTPException(status_code=400, detail="缺少input参数")
+    trace.attributes["model"] = model_name
+    REQUESTS_TOTAL.inc(mode="embeddings")
+
+    routing_span = trace.start_span("routing")
+    provider_id = await verify_personalized_key(personalized_key, model_name)
+    ROUTING_SECONDS.observe((time.perf_counter() - routing_span.start))
+    provider_info = routing_index.provider_info(provider_id) if provider_id else None
+    if not provider_info or model_name not in provider_info["models"]:
+        raise HTTPException(status_code=401, detail="无效的API密钥或该密钥无权访问指定模型")
+    upstream_url = build_upstream_url(provider_info["server_url"], "embeddings")
+    if not upstream_url:
+        raise HTTPException(status_code=400, detail="该提供商的地址只支持 chat/completions")
+    trace.end_span(routing_span)
+    trace.attributes["provider_id"] = provider_id
+
+    with trace.span("tokenize"):
+        input_tokens = count_input_tokens(body["input"])
+    with trace.span("rate_limit"):
+        rate_result = await rate_limiter.check(personalized_key, provider_id, input_tokens)
+    if not rate_result.allowed:
+        return rate_limited_response(rate_result, trace)
+    try:
+        with trace.span("admission"):
+            admission_ticket = await admission_controller.acquire(provider_id, personalized_key)
+    except AdmissionRejected as e:
+        await rate_limiter.refund(personalized_key, provider_id, input_tokens)
+        return overloaded_response(e, trace)
+
+    need_proxy = "proxy" in provider_info.get("description", "").lower()
+    client = upstream_pool.get_client(random.choice(AVAILABLE_PROXIES or PROXIES) if need_proxy else None)
+    headers = {
+        "Authorization": f"Bearer {provider_info['server_key']}",
+        "Content-Type": "application/json"
+    }
+    upstream_span = trace.start_span("upstream")
+    try:
+        for attempt in range(EMBEDDING_RETRY_COUNT):
+            try:
+                upstream_start = time.perf_counter()
+                response = await client.post(upstream_url, json=body, headers=headers, timeout=EMBEDDING_TIMEOUT)
+                UPSTREAM_SECONDS.observe(time.perf_counter() - upstream_start, provider=provider_id, model=model_name)
+                break
+            except httpx.RequestError as e:
+                health_checker.record_failure(provider_id, f"{type(e).__name__}: {str(e)}")
+                is_timeout = isinstance(e, httpx.TimeoutException)
+                ERRORS_TOTAL.inc(type="timeout_error" if is_timeout else "request_error")
+                if attempt == EMBEDDING_RETRY_COUNT - 1:
+                    raise HTTPException(
+                        status_code=504 if is_timeout else 502,
+                        detail={
+                            "error": str(e),
+                            "type": "timeout_error" if is_timeout else "request_error",
+                            "message": "与上游服务器通信时发生错误",
+                            "attempts": EMBEDDING_RETRY_COUNT
+                        }
+                    )
+                UPSTREAM_RETRIES.inc(provider=provider_id)
+                await asyncio.sleep(EMBEDDING_RETRY_DELAY)
+    finally:
+        admission_ticket.release()
+        trace.end_span(upstream_span)
+
+    UPSTREAM_RESPONSES.inc(provider=provider_id, status=response.status_code)
+    if response.status_code >= 500:
+        health_checker.record_failure(provider_id, f"HTTP {response.status_code}")
+    else:
+        health_checker.record_success(provider_id)
+
+    if response.status_code == 200:
+        try:
+            usage = response.json().get("usage") or {}
+        except ValueError:
+            usage = {}
+        with trace.span("stats_write"):
+            await stats_tracker.record_chat(
+                conversation_id=f"embeddings-{trace.trace_id}",
+                provider_id=provider_id,
+                model_name=model_name,
+                tokens_count=usage.get("prompt_tokens") or usage.get("total_tokens") or input_tokens,
+                is_prompt=True,
+                personalized_key=personalized_key
+            )
+    else:
+        ERRORS_TOTAL.inc(type="upstream_error")
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type="application/json",
+        headers={**rate_result.headers(), **trace_headers(trace)}
+    )
+
+@app_api.post("/v1/embeddings")
+async def embeddings(request: Request):
+    """OpenAI 兼容的 embeddings 接口"""
+    trace = Trace("embeddings", request.headers.get("traceparent"))
+    try:
+        body = await request.json()
+        return await forward_embeddings(body, bearer_key(request), trace)
+    except HTTPException as e:
+        ERRORS_TOTAL.inc(type=f"http_{e.status_code}")
+        raise
+    finally:
+        trace_recorder.record(trace)
+
+@app_api.post("/embeddings")
+async def embeddings_alias(request: Request):
+    return await embeddings(request)
+
+# 检索接口使用的语料库目录（PDFEmbedding.open_corpus / add_pdf 生成），每个工作进程首次检索时加载一次
+RAG_CORPUS_PATH = os.environ.get("NEXUSAI_RAG_CORPUS", "")
+RAG_MAX_TOP_K = 50
+_rag_corpus = None
+_rag_corpus_lock = asyncio.Lock()
+
+async def get_rag_corpus():
+    """加载（只加载一次）检索语料库，向量以内存映射方式打开"""
+    global _rag_corpus
+    if _rag_corpus is None:
+        if not RAG_CORPUS_PATH or not (Path(RAG_CORPUS_PATH) / "documents.json").exists():
+            raise HTTPException(status_code=503, detail="未配置检索语料库（NEXUSAI_RAG_CORPUS）")
+        async with _rag_corpus_lock:
+            if _rag_corpus is None:
+                # numpy 等依赖只在启用检索时需要
+                from corpus import DocumentCorpus
+                _rag_corpus = await asyncio.to_thread(DocumentCorpus, RAG_CORPUS_PATH)
+                logger.info(f"已加载检索语料库: {RAG_CORPUS_PATH}，{len(_rag_corpus)} 个文本块")
+    return _rag_corpus
+
+@app_api.post("/v1/retrieval")
+async def retrieval(request: Request):
+    """
+    从检索语料库中返回与 query 最相关的 top_k 个文本块
+
+    mode 为 vector / lexical / hybrid（默认，向量与 BM25 按 RRF 融合，rrf_k 为平滑常数）。
+    query 的向量通过 forward_embeddings 获取（调用方的密钥、语料库的嵌入模型），
+    所以同样经过限流、准入控制和统计；lexical 模式不请求上游，只校验密钥并计入请求数限流。
+    """
+    trace = Trace("retrieval", request.headers.get("traceparent"))
+    try:
+        body = await request.json()
+        query = body.get("query")
+        top_k = body.get("top_k", 3)
+        if not isinstance(query, str) or not query.strip():
+            raise HTTPException(status_code=400, detail="缺少query参数")
+        if not isinstance(top_k, int) or not 1 <= top_k <= RAG_MAX_TOP_K:
+            raise HTTPException(status_code=400, detail=f"top_k 必须是 1 到 {RAG_MAX_TOP_K} 之间的整数")
+        personalized_key = bearer_key(request)
+        corpus = await get_rag_corpus()
+
+        # 与 get_rag_corpus 相同，numpy 等依赖只在启用检索时导入
+        from lexical_index import DEFAULT_RRF_K, SEARCH_MODES
+        mode = body.get("mode", "hybrid")
+        rrf_k = body.get("rrf_k", DEFAULT_RRF_K)
+        if mode not in SEARCH_MODES:
+            raise HTTPException(status_code=400, detail=f"mode 必须是 {', '.join(SEARCH_MODES)} 之一")
+        if isinstance(rrf_k, bool) or not isinstance(rrf_k, int) or rrf_k < 1:
+            raise HTTPException(status_code=400, detail="rrf_k 必须是正整数")
+
+        if mode == "lexical":
+            provider_id = await verify_personalized_key(personalized_key, corpus.embedding_model)
+            if not provider_id:
+                raise HTTPException(status_code=401, detail="无效的API密钥或该密钥无权访问指定模型")
+            # 不请求上游，但仍计入密钥的请求数限流（不消耗 token 额度）
+            with trace.span("rate_limit"):
+                rate_result = await rate_limiter.check(personalized_key, provider_id, 0)
+            if not rate_result.allowed:
+                return rate_limited_response(rate_result, trace)
+            rate_headers, embedding = rate_result.headers(), None
+        else:
+            response = await forward_embeddings({"model": corpus.embedding_model, "input": [query]},
+                                                personalized_key, trace)
+            if response.status_code != 200:
+                return response
+            rate_headers = {key: value for key, value in response.headers.items()
+                            if key.lower().startswith("x-ratelimit-")}
+            embedding = json.loads(response.body)["data"][0]["embedding"]
+        trace.attributes["retrieval_mode"] = mode
+        # 大规模语料的矩阵运算放到线程中，不阻塞事件循环
+        with trace.span("search"):
+            hits = await asyncio.to_thread(corpus.search, embedding, top_k, query, mode, rrf_k)
+        content = {
+            "object": "list",
+            "model": corpus.embedding_model,
+            "data": [{"object": "retrieval_result", "index": index, **hit} for index, hit in enumerate(hits)]
+        }
+        return Response(
+            content=json.dumps(content, ensure_ascii=False),
+            media_type="application/json",
+            headers=rate_headers | trace_headers(trace)
+        )
+    except HTTPException as e:
+        ERRORS_TOTAL.inc(type=f"http_{e.status_code}")
+        raise
+    finally:
+        trace_recorder.record(trace)
+
 @app_api.get("/v1/models")
-async def list_models():
+async def list_models(request: Request):
     """
     获取所有可用模型列表，返回格式符合OpenAI API规范
+    
+    响应体在路由索引重建时预计算并缓存，支持 ETag / If-None-Match 返回 304。
     """
     try:
-        # 从数据库获取所有模型
-        models_data = get_all_models()
+        personalized_key = None
+        if MODELS_FILTER_BY_KEY or request.query_params.get("filter") == "key":
+            auth_header = request.headers.get("Authorization", "")
+            personalized_key = auth_header[7:] if auth_header.startswith("Bearer ") else ""
         
-        # 按照OpenAI格式构建响应
-        formatted_models = []
-        for model in models_data:
-            model_id, provider_id, model_name, description, provider_name = model
-            formatted_models.append({
-                "id": model_name,
-                "object": "model",
-                "created": int(time.time()),
-                "owned_by": provider_name,
-                "permission": [
-                    {
-                        "id": f"modelperm-{model_id}",
-                        "object": "model_permission",
-                        "created": int(time.time()),
-                        "allow_create_engine": False,
-                        "allow_sampling": True,
-                        "allow_logprobs": True,
-                        "allow_search_indices": False,
-                        "allow_view": True,
-                        "allow_fine_tuning": False,
-                        "organization": "*",
-                        "group": None,
-                        "is_blocking": False
-                    }
-                ],
-                "root": model_name,
-                "parent": None
-            })
-        
-        return {
-            "object": "list",
-            "data": formatted_models
-        }
+        body, etag = routing_index.models_payload(personalized_key)
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            CACHE_REQUESTS.inc(cache="models_etag", result="hit")
+            return Response(status_code=304, headers=headers)
+        CACHE_REQUESTS.inc(cache="models_etag", result="miss")
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         logger.error(f"获取模型列表时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取模型列表失败: {str(e)}")
 
 # 添加一个别名路由，不带v1前缀
 @app_api.get("/models")
-async def list_models_alias():
-    return await list_models()
+async def list_models_alias(request: Request):
+    return await list_models(request)
 
 # 添加测试路由
 @app_admin.post("/test")
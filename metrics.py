@@ -0,0 +1,233 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 默认直方图分桶（秒），覆盖从毫秒级的路由到分钟级的长流式响应
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 生成速度分桶（tokens/秒）
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def dump(self) -> Dict[str, Any]:
+        return {
+            "type": self.type,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "samples": self._samples()
+        }
+
+    def _samples(self) -> List[List[Any]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+
+class Gauge(_Metric):
+    """可增可减的当前值，例如排队深度；多进程合并时求和"""
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+
+class Histogram(_Metric):
+    """分桶直方图，每个标签组合记录各桶计数、总和与次数"""
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 值为 [各桶计数（最后一个为 +Inf）, 总和, 次数]，桶计数不累计，输出时再累加
+        self.values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.values[key] = state
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """统计代码块耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels) -> Tuple[float, int]:
+        """返回 (总和, 次数)"""
+        state = self.values.get(self._key(labels))
+        return (state[1], state[2]) if state else (0.0, 0)
+
+    def dump(self):
+        data = super().dump()
+        data["buckets"] = list(self.buckets)
+        return data
+
+    def _samples(self):
+        return [[list(key), [list(state[0]), state[1], state[2]]] for key, state in self.values.items()]
+
+
+class MetricsRegistry:
+    """指标注册表，同名指标只创建一次"""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.type}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def dump(self) -> Dict[str, Dict[str, Any]]:
+        """导出可 JSON 序列化的快照，用于跨进程汇总"""
+        return {name: metric.dump() for name, metric in self.metrics.items()}
+
+
+def merge_dumps(dumps: Iterable[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """合并多个进程的快照：计数器、直方图和 gauge 都按标签求和"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for dump in dumps:
+        for name, data in dump.items():
+            target = merged.get(name)
+            if target is None:
+                target = {key: value for key, value in data.items() if key != "samples"}
+                target["_samples"] = {}
+                merged[name] = target
+            samples = target["_samples"]
+            for labels, value in data["samples"]:
+                key = tuple(labels)
+                current = samples.get(key)
+                if data["type"] == "histogram":
+                    if current is None or len(current[0]) != len(value[0]):
+                        samples[key] = [list(value[0]), value[1], value[2]]
+                    else:
+                        current[0] = [a + b for a, b in zip(current[0], value[0])]
+                        current[1] += value[1]
+                        current[2] += value[2]
+                else:
+                    samples[key] = (current or 0) + value
+
+    for target in merged.values():
+        target["samples"] = [[list(key), value] for key, value in target.pop("_samples").items()]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: List[str], labels: List[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(dump: Dict[str, Dict[str, Any]]) -> str:
+    """按 Prometheus 文本格式（0.0.4）输出"""
+    lines = []
+    for name in sorted(dump):
+        data = dump[name]
+        labelnames = data["labelnames"]
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['type']}")
+        for labels, value in sorted(data["samples"], key=lambda sample: sample[0]):
+            if data["type"] == "histogram":
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(data["buckets"]) + [float('inf')], counts):
+                    cumulative += bucket_count
+                    le = _format_labels(labelnames, labels, ("le", _format_value(bound)))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                label_str = _format_labels(labelnames, labels)
+                lines.append(f"{name}_sum{label_str} {_format_value(total)}")
+                lines.append(f"{name}_count{label_str} {count}")
+            else:
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# 进程内的全局注册表
+REGISTRY = MetricsRegistry()
@@ -2,11 +2,67 @@ import httpx
 import json
 from typing import List, Dict, Any, Tuple, Optional
 import logging
+import os
+import re
+import time
+from metrics import REGISTRY
 from config.tokenizer_config import TOKENIZER_API_KEY, TOKENIZER_API_URL, TOKENIZER_MODEL_ID
 
+TOKENIZER_SECONDS = REGISTRY.histogram(
+    "nexusai_tokenizer_seconds", "Token 计数耗时（秒），result 为 api 或 fallback", ["result"]
+)
+
+# 本地 token 计数：流式响应逐块计数时使用，避免每个数据块都请求 Tokenizer API
+LOCAL_ENCODING = os.environ.get("NEXUSAI_LOCAL_ENCODING", "cl100k_base")
+_local_encoder = None
+
+# 估算规则：中日韩字符各算 1 个 token，英文单词约 4 个字符 1 个，数字约 3 位 1 个，其余符号各 1 个
+_ESTIMATE_PATTERN = re.compile(
+    r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af])|([A-Za-z]+)|(\d+)|[^\sA-Za-z\d]'
+)
+
+def load_local_encoder() -> bool:
+    """
+    加载 tiktoken 编码（首次使用可能需要下载编码文件，应在后台线程中调用）
+
+    Returns:
+        bool: 是否加载成功；失败时 count_tokens_local 继续使用估算
+    """
+    global _local_encoder
+    if _local_encoder is not None:
+        return True
+    try:
+        import tiktoken
+        _local_encoder = tiktoken.get_encoding(LOCAL_ENCODING)
+        return True
+    except Exception as e:
+        logging.getLogger('nexusai.tokenizer').warning(f"本地 tokenizer 不可用，使用估算: {str(e)}")
+        return False
+
+def estimate_tokens(text: str) -> int:
+    """按字符类别估算 token 数"""
+    total = 0
+    for match in _ESTIMATE_PATTERN.finditer(text):
+        if match.group(2):
+            total += (len(match.group(2)) + 3) // 4
+        elif match.group(3):
+            total += (len(match.group(3)) + 2) // 3
+        else:
+            total += 1
+    return total
+
+def count_tokens_local(text: str) -> int:
+    """本地计算 token 数：已加载 tiktoken 时精确计数，否则估算"""
+    if not text:
+        return 0
+    if _local_encoder is not None:
+        return len(_local_encoder.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
 class Tokenizer:
-    def __init__(self, api_url: str = TOKENIZER_API_URL, api_key: str = TOKENIZER_API_KEY):
-        self.api_url = api_url
+    def __init__(self, api_url: str = None, api_key: str = TOKENIZER_API_KEY):
+        # NEXUSAI_TOKENIZER_URL 可覆盖配置文件中的地址（例如压测时指向本地模拟上游）
+        self.api_url = api_url or os.environ.get("NEXUSAI_TOKENIZER_URL", TOKENIZER_API_URL)
         self.api_key = api_key
         self.model_id = TOKENIZER_MODEL_ID
         self.logger = logging.getLogger('nexusai.tokenizer')
@@ -22,6 +78,8 @@ class Tokenizer:
         Returns:
             int: token数量
         """
+        start = time.perf_counter()
+        result_label = "fallback"
         try:
             async with httpx.AsyncClient() as client:
                 headers = {
@@ -45,6 +103,7 @@ class Tokenizer:
                     if result.get("data") and len(result["data"]) > 0:
                         # self.logger.info(f"请求的文本: {text}")
                         # self.logger.info(f"API 响应: {response.text}")
+                        result_label = "api"
                         return result["data"][0]["total_tokens"]
                     
                 self.logger.error(f"Token计算API返回错误: {response.text}")
@@ -53,6 +112,8 @@ class Tokenizer:
         except Exception as e:
             self.logger.error(f"计算token时发生错误: {str(e)}")
             return len(text.encode('utf-8')) // 4  # 降级方案
+        finally:
+            TOKENIZER_SECONDS.observe(time.perf_counter() - start, result=result_label)
     
     async def count_messages_tokens(self, messages: List[Dict[str, str]], provider_key: str = None) -> int:
         """
@@ -0,0 +1,112 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Tuple
+
+# 多进程提取时每个任务处理的页数
+PAGES_PER_TASK = 8
+
+
+def _open_reader(pdf_path: str):
+    # PyPDF2 只在提取 PDF 时需要
+    from PyPDF2 import PdfReader
+    return PdfReader(pdf_path)
+
+
+def _extract_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """提取 [start, stop) 页的文本（在工作进程中运行）"""
+    reader = _open_reader(pdf_path)
+    return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def iter_pages(pdf_path: str, workers: int = 0) -> Iterator[Tuple[int, str]]:
+    """
+    逐页提取 PDF 文本
+
+    Args:
+        pdf_path: PDF 文件路径
+        workers: 大于 1 时使用多进程提取（每个任务 PAGES_PER_TASK 页，最多 2 * workers 个任务在途）
+
+    Yields:
+        (页码（从 1 开始）, 文本)
+    """
+    reader = _open_reader(pdf_path)
+    page_count = len(reader.pages)
+    if workers <= 1:
+        for index in range(page_count):
+            yield index + 1, reader.pages[index].extract_text() or ""
+        return
+
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            # 限制在途任务数，避免提取远快于消费时积压全部页面
+            while next_range < len(ranges) and len(pending) < 2 * workers:
+                start, stop = ranges[next_range]
+                pending.append((start, executor.submit(_extract_range, pdf_path, start, stop)))
+                next_range += 1
+            start, future = pending.popleft()
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+
+
+def iter_chunks(pages: Iterable[Tuple[int, str]], chunker: Callable[[str], List[str]]) -> Iterator[Dict[str, Any]]:
+    """
+    把逐页文本分块，文本块不跨页
+
+    Yields:
+        {"text": 文本块, "page": 页码}
+    """
+    for page, text in pages:
+        if not text.strip():
+            continue
+        for chunk in chunker(text):
+            yield {"text": chunk, "page": page}
+
+
+async def abatches(items: Iterable, batch_size: int, prefetch: int = 2) -> AsyncIterator[List]:
+    """
+    在后台线程中消费同步迭代器并按批产出
+
+    提取和分块在线程中进行，最多预取 prefetch 批，调用方处理（例如等待嵌入接口）时下一批已在准备。
+    """
+    iterator = iter(items)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, prefetch))
+
+    def next_batch() -> List:
+        batch = []
+        for item in iterator:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                break
+        return batch
+
+    async def produce():
+        try:
+            while True:
+                batch = await asyncio.to_thread(next_batch)
+                if not batch:
+                    break
+                await queue.put(batch)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        producer.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,396 @@
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 默认限额（0 表示不限制），可通过 rate_limits 表按密钥/提供商覆盖
+DEFAULT_KEY_RPM = 0
+DEFAULT_KEY_TPM = 0
+DEFAULT_KEY_DAILY_TOKENS = 0
+DEFAULT_PROVIDER_RPM = 0
+DEFAULT_PROVIDER_TPM = 0
+
+# 一次令牌桶申请: (桶名, 容量, 每秒补充速率, 消耗量)
+BucketRequest = Tuple[str, float, float, float]
+# 申请结果: (是否允许, 剩余令牌, 需要等待的秒数)
+BucketResult = Tuple[bool, float, float]
+
+
+def _refill(tokens: float, updated: float, capacity: float, rate: float, now: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _seconds_until_tomorrow(now: Optional[datetime] = None) -> int:
+    now = now or datetime.now()
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, int((tomorrow - now).total_seconds()))
+
+
+class MemoryBucketStore:
+    """进程内令牌桶存储，每个 worker 独立计数"""
+
+    blocking = False
+
+    def __init__(self):
+        self._buckets: Dict[str, List[float]] = {}  # name -> [tokens, updated]
+        self._counters: Dict[str, int] = {}
+        self._counter_day = datetime.now().strftime('%Y%m%d')
+
+    def acquire(self, requests: List[BucketRequest], now: Optional[float] = None) -> List[BucketResult]:
+        """
+        原子地申请多个桶：全部满足才扣减，否则都不扣减
+
+        消耗量大于容量时，只要桶是满的就放行（允许透支），避免大请求永远无法通过。
+        """
+        now = now if now is not None else time.time()
+        states = []
+        allowed = True
+        for name, capacity, rate, cost in requests:
+            tokens, updated = self._buckets.get(name, (capacity, now))
+            tokens = _refill(tokens, updated, capacity, rate, now)
+            states.append(tokens)
+            if tokens < min(cost, capacity):
+                allowed = False
+
+        results = []
+        for (name, capacity, rate, cost), tokens in zip(requests, states):
+            if allowed:
+                tokens -= cost
+            self._buckets[name] = [tokens, now]
+            wait = 0.0 if allowed or tokens >= min(cost, capacity) else (min(cost, capacity) - tokens) / rate
+            results.append((allowed, tokens, wait))
+        return results
+
+    def charge(self, requests: List[BucketRequest], now: Optional[float] = None):
+        """事后扣减（例如补全 token），允许余额为负"""
+        now = now if now is not None else time.time()
+        for name, capacity, rate, cost in requests:
+            tokens, updated = self._buckets.get(name, (capacity, now))
+            self._buckets[name] = [_refill(tokens, updated, capacity, rate, now) - cost, now]
+
+    def refund(self, requests: List[BucketRequest], now: Optional[float] = None):
+        """退还已扣减的额度（不超过容量）"""
+        now = now if now is not None else time.time()
+        for name, capacity, rate, cost in requests:
+            tokens, updated = self._buckets.get(name, (capacity, now))
+            self._buckets[name] = [min(capacity, _refill(tokens, updated, capacity, rate, now) + cost), now]
+
+    def _rotate_counters(self):
+        today = datetime.now().strftime('%Y%m%d')
+        if today != self._counter_day:
+            self._counters.clear()
+            self._counter_day = today
+
+    def incr_daily(self, name: str, amount: int) -> int:
+        self._rotate_counters()
+        self._counters[name] = self._counters.get(name, 0) + amount
+        return self._counters[name]
+
+    def get_daily(self, name: str) -> int:
+        self._rotate_counters()
+        return self._counters.get(name, 0)
+
+
+class SQLiteBucketStore:
+    """
+    基于 SQLite 的令牌桶存储，多个 uvicorn worker 共享同一个数据库文件时限额保持一致
+
+    每次申请在一个 BEGIN IMMEDIATE 事务中完成读取-补充-扣减，保证跨进程原子性。
+    连接按进程惰性创建，主进程 fork 出的工作进程不会共用同一个 SQLite 连接。
+    """
+
+    blocking = True
+
+    def __init__(self, db_path="data/ratelimit.db"):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn_pid = None
+        self._connection = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None or self._conn_pid != os.getpid():
+            self._connection = self._connect()
+            self._conn_pid = os.getpid()
+        return self._connection
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=5.0,
+                               isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_counters (
+                name TEXT NOT NULL,
+                day TEXT NOT NULL,
+                value INTEGER NOT NULL,
+                PRIMARY KEY (name, day)
+            )
+        """)
+        return conn
+
+    def _load(self, name: str, capacity: float, now: float) -> Tuple[float, float]:
+        row = self._conn.execute(
+            "SELECT tokens, updated FROM rate_buckets WHERE name = ?", (name,)
+        ).fetchone()
+        return (row[0], row[1]) if row else (capacity, now)
+
+    def _save(self, name: str, tokens: float, now: float):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO rate_buckets (name, tokens, updated) VALUES (?, ?, ?)",
+            (name, tokens, now)
+        )
+
+    def acquire(self, requests: List[BucketRequest], now: Optional[float] = None) -> List[BucketResult]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = now if now is not None else time.time()
+                states = []
+                allowed = True
+                for name, capacity, rate, cost in requests:
+                    tokens, updated = self._load(name, capacity, now)
+                    tokens = _refill(tokens, updated, capacity, rate, now)
+                    states.append(tokens)
+                    if tokens < min(cost, capacity):
+                        allowed = False
+
+                results = []
+                for (name, capacity, rate, cost), tokens in zip(requests, states):
+                    if allowed:
+                        tokens -= cost
+                    self._save(name, tokens, now)
+                    wait = 0.0 if allowed or tokens >= min(cost, capacity) else (min(cost, capacity) - tokens) / rate
+                    results.append((allowed, tokens, wait))
+                self._conn.execute("COMMIT")
+                return results
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def charge(self, requests: List[BucketRequest], now: Optional[float] = None):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = now if now is not None else time.time()
+                for name, capacity, rate, cost in requests:
+                    tokens, updated = self._load(name, capacity, now)
+                    self._save(name, _refill(tokens, updated, capacity, rate, now) - cost, now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def refund(self, requests: List[BucketRequest], now: Optional[float] = None):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = now if now is not None else time.time()
+                for name, capacity, rate, cost in requests:
+                    tokens, updated = self._load(name, capacity, now)
+                    self._save(name, min(capacity, _refill(tokens, updated, capacity, rate, now) + cost), now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def incr_daily(self, name: str, amount: int) -> int:
+        day = datetime.now().strftime('%Y%m%d')
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM rate_counters WHERE day < ?", (day,))
+                self._conn.execute("""
+                    INSERT INTO rate_counters (name, day, value) VALUES (?, ?, ?)
+                    ON CONFLICT(name, day) DO UPDATE SET value = value + excluded.value
+                """, (name, day, amount))
+                value = self._conn.execute(
+                    "SELECT value FROM rate_counters WHERE name = ? AND day = ?", (name, day)
+                ).fetchone()[0]
+                self._conn.execute("COMMIT")
+                return value
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_daily(self, name: str) -> int:
+        day = datetime.now().strftime('%Y%m%d')
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM rate_counters WHERE name = ? AND day = ?", (name, day)
+            ).fetchone()
+        return row[0] if row else 0
+
+
+class RateLimitResult:
+    """一次限流检查的结果，负责生成 429 及 X-RateLimit-* 响应头"""
+
+    def __init__(self, allowed: bool, limits: Dict[str, Dict[str, float]], retry_after: float = 0.0,
+                 reason: str = ""):
+        self.allowed = allowed
+        self.limits = limits  # {"requests": {...}, "tokens": {...}}
+        self.retry_after = retry_after
+        self.reason = reason
+
+    def headers(self) -> Dict[str, str]:
+        headers = {}
+        for kind, info in self.limits.items():
+            suffix = kind.capitalize()
+            headers[f"X-RateLimit-Limit-{suffix}"] = str(int(info["limit"]))
+            headers[f"X-RateLimit-Remaining-{suffix}"] = str(max(0, int(info["remaining"])))
+            headers[f"X-RateLimit-Reset-{suffix}"] = f"{info['reset']:.3f}s"
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+    def error_body(self) -> Dict[str, Any]:
+        return {
+            "error": {
+                "message": f"请求过于频繁: {self.reason}，请在 {max(1, math.ceil(self.retry_after))} 秒后重试",
+                "type": "rate_limit_error",
+                "code": 429
+            }
+        }
+
+
+class RateLimiter:
+    """
+    按个性化密钥和提供商的令牌桶限流
+
+    - 请求数/分钟 (rpm)：每个请求消耗 1
+    - token 数/分钟 (tpm)：准入时按 prompt tokens 预扣，补全 tokens 由统计管道事后扣减
+    - 每日 token 配额 (daily_tokens)：由统计管道累计，超出后拒绝到次日零点
+    """
+
+    def __init__(self, store=None, limits_loader: Optional[Callable[[], List[Tuple]]] = None):
+        """
+        Args:
+            store: MemoryBucketStore 或 SQLiteBucketStore，默认进程内存储
+            limits_loader: 返回 (scope, target, rpm, tpm, daily_tokens) 列表的函数
+        """
+        self.store = store or MemoryBucketStore()
+        self.limits_loader = limits_loader
+        self.overrides: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self.logger = logging.getLogger('nexusai.ratelimit')
+        self.reload()
+
+    def reload(self):
+        """重新加载限额配置"""
+        if not self.limits_loader:
+            return
+        try:
+            self.overrides = {
+                (scope, str(target)): {"rpm": rpm or 0, "tpm": tpm or 0, "daily_tokens": daily_tokens or 0}
+                for scope, target, rpm, tpm, daily_tokens in self.limits_loader()
+            }
+        except Exception as e:
+            self.logger.error(f"加载限流配置失败: {str(e)}")
+
+    def get_limits(self, scope: str, target) -> Dict[str, int]:
+        override = self.overrides.get((scope, str(target)))
+        if override:
+            return override
+        if scope == "key":
+            return {"rpm": DEFAULT_KEY_RPM, "tpm": DEFAULT_KEY_TPM, "daily_tokens": DEFAULT_KEY_DAILY_TOKENS}
+        return {"rpm": DEFAULT_PROVIDER_RPM, "tpm": DEFAULT_PROVIDER_TPM, "daily_tokens": 0}
+
+    async def _run(self, func, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def _bucket_requests(self, personalized_key: str, provider_id: int, tokens: int):
+        """生成需要检查的桶列表，附带 (类别, 描述) 用于生成响应头和错误信息"""
+        requests: List[BucketRequest] = []
+        labels: List[Tuple[str, str]] = []
+        for scope, target in (("key", personalized_key), ("provider", provider_id)):
+            limits = self.get_limits(scope, target)
+            if limits["rpm"] > 0:
+                requests.append((f"{scope}:{target}:rpm", limits["rpm"], limits["rpm"] / 60.0, 1))
+                labels.append(("requests", f"{scope} rpm"))
+            if limits["tpm"] > 0:
+                requests.append((f"{scope}:{target}:tpm", limits["tpm"], limits["tpm"] / 60.0, tokens))
+                labels.append(("tokens", f"{scope} tpm"))
+        return requests, labels
+
+    async def check(self, personalized_key: str, provider_id: int, prompt_tokens: int = 0) -> RateLimitResult:
+        """准入检查，放行时同时扣减额度"""
+        key_limits = self.get_limits("key", personalized_key)
+        if key_limits["daily_tokens"] > 0:
+            used = await self._run(self.store.get_daily, f"key:{personalized_key}:daily_tokens")
+            if used >= key_limits["daily_tokens"]:
+                return RateLimitResult(
+                    False,
+                    {"tokens": {"limit": key_limits["daily_tokens"], "remaining": 0,
+                                "reset": _seconds_until_tomorrow()}},
+                    retry_after=_seconds_until_tomorrow(),
+                    reason="已超出每日 token 配额"
+                )
+
+        requests, labels = self._bucket_requests(personalized_key, provider_id, prompt_tokens)
+        if not requests:
+            return RateLimitResult(True, {})
+
+        results = await self._run(self.store.acquire, requests)
+        allowed = results[0][0]
+
+        # 每个类别报告最紧张（剩余比例最小）的那个桶
+        limits: Dict[str, Dict[str, float]] = {}
+        retry_after = 0.0
+        reason = ""
+        for (name, capacity, rate, cost), (kind, label), (_, remaining, wait) in zip(requests, labels, results):
+            info = {"limit": capacity, "remaining": remaining,
+                    "reset": max(0.0, (capacity - remaining) / rate)}
+            current = limits.get(kind)
+            if current is None or remaining / capacity < current["remaining"] / current["limit"]:
+                limits[kind] = info
+            if wait > retry_after:
+                retry_after = wait
+                reason = f"超出 {label} 限制"
+
+        if not allowed:
+            self.logger.warning(f"限流拒绝: 密钥 {personalized_key[:6]}***, 提供商 {provider_id}, 原因: {reason}")
+        return RateLimitResult(allowed, limits, retry_after=retry_after, reason=reason)
+
+    async def refund(self, personalized_key: str, provider_id: int, prompt_tokens: int = 0):
+        """退还 check() 放行时扣减的 rpm/tpm 额度（例如随后被准入控制拒绝）"""
+        requests, _ = self._bucket_requests(personalized_key, provider_id, prompt_tokens)
+        if requests:
+            await self._run(self.store.refund, requests)
+
+    async def record_usage(self, personalized_key: str, provider_id: int, model_name: str,
+                           tokens: int, is_prompt: bool):
+        """
+        统计管道回调：累计每日配额，并对补全 tokens 事后扣减 tpm 桶
+
+        prompt tokens 已在准入时扣减过，这里只计入每日配额。
+        """
+        if not personalized_key or tokens <= 0:
+            return
+        if self.get_limits("key", personalized_key)["daily_tokens"] > 0:
+            await self._run(self.store.incr_daily, f"key:{personalized_key}:daily_tokens", tokens)
+        if not is_prompt:
+            requests = [r for r in self._bucket_requests(personalized_key, provider_id, tokens)[0]
+                        if r[0].endswith(":tpm")]
+            if requests:
+                await self._run(self.store.charge, requests)
+
+    async def get_usage(self, personalized_key: str) -> Dict[str, Any]:
+        return {
+            "limits": self.get_limits("key", personalized_key),
+            "daily_tokens_used": await self._run(self.store.get_daily, f"key:{personalized_key}:daily_tokens")
+        }
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+CACHE_REQUESTS = REGISTRY.counter("nexusai_cache_requests_total", "缓存访问次数", ["cache", "result"])
+# 未知密钥共用的模型列表缓存键（空列表），避免任意密钥都占用一个缓存项
+_UNKNOWN_KEY = object()
+
+
+def _model_entry(model_id: int, model_name: str, provider_name: str, created: int) -> Dict[str, Any]:
+    """构建符合 OpenAI 格式的单个模型条目"""
+    return {
+        "id": model_name,
+        "object": "model",
+        "created": created,
+        "owned_by": provider_name,
+        "permission": [
+            {
+                "id": f"modelperm-{model_id}",
+                "object": "model_permission",
+                "created": created,
+                "allow_create_engine": False,
+                "allow_sampling": True,
+                "allow_logprobs": True,
+                "allow_search_indices": False,
+                "allow_view": True,
+                "allow_fine_tuning": False,
+                "organization": "*",
+                "group": None,
+                "is_blocking": False
+            }
+        ],
+        "root": model_name,
+        "parent": None
+    }
+
+
+class RoutingIndex:
+    """
+    内存路由索引：个性化密钥 -> 模型 -> 候选提供商
+
+    由数据库一次性构建，管理后台修改提供商或模型后调用 rebuild()。请求路径上的
+    密钥校验、提供商信息查询以及 /v1/models 都直接查索引，不再访问 SQLite。
+    """
+
+    def __init__(self, provider_loader: Callable[[], List[Dict[str, Any]]]):
+        """
+        Args:
+            provider_loader: 返回提供商列表的函数（参见 database.get_providers_with_models）
+        """
+        self.provider_loader = provider_loader
+        self.providers: Dict[int, Dict[str, Any]] = {}
+        self.routes: Dict[str, Dict[str, List[int]]] = {}
+        self.version = 0
+        self._models_cache: Dict[Any, Tuple[bytes, str]] = {}
+        self.logger = logging.getLogger('nexusai.routing')
+        self.rebuild()
+
+    def rebuild(self):
+        """从数据库重建索引，并清空预计算的模型列表"""
+        try:
+            providers = self.provider_loader()
+        except Exception as e:
+            self.logger.error(f"重建路由索引失败: {str(e)}")
+            return
+
+        routes: Dict[str, Dict[str, List[int]]] = {}
+        for provider in providers:
+            key_routes = routes.setdefault(provider["personalized_key"], {})
+            for model_name in provider["models"]:
+                key_routes.setdefault(model_name, []).append(provider["id"])
+
+        self.providers = {provider["id"]: provider for provider in providers}
+        self.routes = routes
+        self._models_cache = {}
+        self.version += 1
+
+    def candidates(self, personalized_key: str, model_name: str) -> List[int]:
+        """返回该密钥可用于指定模型的提供商ID列表（按ID排序）"""
+        return self.routes.get(personalized_key, {}).get(model_name, [])
+
+    def provider_info(self, provider_id: int) -> Optional[Dict[str, Any]]:
+        """返回提供商信息，字段与 database.get_provider_info 兼容，另含 name 和 description"""
+        return self.providers.get(provider_id)
+
+    def has_key(self, personalized_key: str) -> bool:
+        return personalized_key in self.routes
+
+    def models_payload(self, personalized_key: Optional[str] = None) -> Tuple[bytes, str]:
+        """
+        返回预序列化的 /v1/models 响应体及其 ETag
+
+        personalized_key 为 None 时返回全部模型，否则只返回该密钥可用的模型。
+        结果按密钥缓存，直到下一次 rebuild()；未知密钥共用一个空列表。
+        """
+        if personalized_key is not None and personalized_key not in self.routes:
+            personalized_key = _UNKNOWN_KEY
+        cached = self._models_cache.get(personalized_key)
+        if cached is not None:
+            CACHE_REQUESTS.inc(cache="models", result="hit")
+            return cached
+        CACHE_REQUESTS.inc(cache="models", result="miss")
+
+        allowed = None if personalized_key is None else self.routes.get(personalized_key, {})
+        entries = []
+        for provider in self.providers.values():
+            for model_id, model_name, created in provider["model_records"]:
+                if allowed is not None and provider["id"] not in allowed.get(model_name, ()):
+                    continue
+                entries.append((model_id, _model_entry(model_id, model_name, provider["name"], created)))
+        entries.sort(key=lambda item: item[0])
+
+        body = json.dumps(
+            {"object": "list", "data": [entry for _, entry in entries]},
+            ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self._models_cache[personalized_key] = (body, etag)
+        return body, etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断 If-None-Match 请求头是否命中 ETag（支持多个值、弱校验和 *）"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
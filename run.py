@@ -1,16 +1,33 @@
 import uvicorn
 import asyncio
 import signal
+import socket
 import sys
+import time
 from main import app_admin, app_api
+import log_pipeline
 import logging
 import multiprocessing
 import os
 
 # 获取CPU核心数
 CPU_CORES = multiprocessing.cpu_count()
-# 设置工作进程数，通常为CPU核心数的2-4倍
-WORKERS_PER_APP = CPU_CORES * 2
+# 工作进程数：API 服务默认每个CPU核心一个进程（异步服务无需更多），管理后台默认单进程
+API_WORKERS = int(os.environ.get("NEXUSAI_API_WORKERS", CPU_CORES))
+ADMIN_WORKERS = int(os.environ.get("NEXUSAI_ADMIN_WORKERS", 1))
+# 是否使用 uvloop：auto 表示已安装时使用
+USE_UVLOOP = os.environ.get("NEXUSAI_UVLOOP", "auto")
+# 优雅关闭时等待进行中请求（包括流式响应）完成的最长时间
+GRACEFUL_TIMEOUT = int(os.environ.get("NEXUSAI_GRACEFUL_TIMEOUT", 60))
+# 工作进程心跳超时，超时视为事件循环卡死并重启
+HEARTBEAT_TIMEOUT = 30
+# 工作进程频繁崩溃时的最大重启间隔
+MAX_RESTART_BACKOFF = 30
+
+APPS = {
+    "admin": {"app": app_admin, "host": "0.0.0.0", "port": 8000, "workers": ADMIN_WORKERS},
+    "api": {"app": app_api, "host": "0.0.0.0", "port": 5231, "workers": API_WORKERS},
+}
 
 # 配置日志
 logging.basicConfig(
@@ -19,162 +36,259 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class GracefulExit:
-    def __init__(self):
-        self.shutdown = False
-        self.servers = []
-        # 根据不同平台注册信号处理器
-        if sys.platform == 'win32':
-            # Windows 平台只支持 SIGINT 和 SIGTERM
-            signals = (signal.SIGINT, signal.SIGTERM)
-        else:
-            # Unix-like 平台支持更多信号
-            signals = (
-                signal.SIGTERM,  # 终止信号
-                signal.SIGINT,   # 键盘中断（Ctrl+C）
-                signal.SIGHUP,   # 终端断开
-                signal.SIGQUIT   # 键盘退出
-            )
-        
-        for sig in signals:
-            try:
-                if sys.platform == 'win32' and sig == signal.SIGTERM:
-                    # Windows下跳过SIGTERM的注册
-                    continue
-                signal.signal(sig, self._signal_handler)
-            except (ValueError, AttributeError) as e:
-                logger.warning(f"无法注册信号 {sig}: {str(e)}")
-
-    def _signal_handler(self, signum, frame):
-        """信号处理函数"""
-        sig_name = signal.Signals(signum).name
-        logger.info(f"收到 {sig_name} 信号，开始优雅关闭...")
-        self.shutdown = True
-        # 关闭所有服务器
-        for server in self.servers:
-            if not server.should_exit:
-                server.should_exit = True
-
-    def add_server(self, server):
-        """添加服务器实例到管理列表"""
-        self.servers.append(server)
-
-async def run_admin(exit_handler):
-    """运行管理后台服务"""
-    config = uvicorn.Config(
-        app_admin,
-        host="0.0.0.0",
-        port=8000,
-        workers=WORKERS_PER_APP,  # 使用多进程
-        loop="uvicorn.loops.auto",  # 自动选择最佳事件循环
-        http="httptools",  # 使用更快的HTTP解析器
-        log_level="info",
-        limit_concurrency=1000,  # 限制并发连接数
-        limit_max_requests=50000,  # 限制最大请求数
-        timeout_keep_alive=30,  # 保持连接超时时间
-        access_log=True,
-        proxy_headers=True,  # 支持代理头
-        forwarded_allow_ips="*",  # 允许所有转发IP
-    )
-    server = uvicorn.Server(config)
-    exit_handler.add_server(server)
+
+def _set_proc_title(title: str):
     try:
-        await server.serve()
-    except Exception as e:
-        logger.error(f"管理后台服务发生错误: {str(e)}")
-        raise
-
-async def run_api(exit_handler):
-    """运行 API 服务"""
-    config = uvicorn.Config(
-        app_api,
-        host="0.0.0.0",
-        port=5231,
-        workers=WORKERS_PER_APP,  # 使用多进程
-        loop="uvicorn.loops.auto",  # 自动选择最佳事件循环
-        http="httptools",  # 使用更快的HTTP解析器
+        import setproctitle
+        setproctitle.setproctitle(title)
+    except ImportError:
+        pass
+
+
+def _loop_setting() -> str:
+    """选择事件循环实现"""
+    if USE_UVLOOP == "off":
+        return "asyncio"
+    try:
+        import uvloop  # noqa: F401
+        return "uvloop"
+    except ImportError:
+        if USE_UVLOOP == "on":
+            logger.warning("未安装 uvloop，使用默认事件循环")
+        return "asyncio"
+
+
+def build_config(app, host: str, port: int, **kwargs) -> uvicorn.Config:
+    """构建 uvicorn 配置"""
+    return uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        loop=_loop_setting(),
+        http="auto",  # 已安装 httptools 时自动使用
         log_level="info",
         limit_concurrency=1000,  # 限制并发连接数
-        limit_max_requests=50000,  # 限制最大请求数
+        limit_max_requests=50000,  # 处理一定请求数后退出，由主进程重启，防止内存缓慢增长
         timeout_keep_alive=30,  # 保持连接超时时间
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,  # 收到 SIGTERM 后等待进行中的请求完成
         access_log=True,
         proxy_headers=True,  # 支持代理头
         forwarded_allow_ips="*",  # 允许所有转发IP
+        **kwargs
+    )
+
+
+def create_listen_socket(host: str, port: int) -> socket.socket:
+    """在主进程中预先绑定监听端口，由所有工作进程共享（内核在进程间分发连接）"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def worker_main(name: str, sock: socket.socket, heartbeat):
+    """工作进程入口：在共享的监听 socket 上运行 uvicorn"""
+    _set_proc_title(f"llm_key_server: {name} worker")
+    # 恢复默认信号处理（fork 继承了主进程的处理函数），运行后由 uvicorn 接管 SIGINT/SIGTERM
+    for sig in (signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT):
+        signal.signal(sig, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    async def beat():
+        heartbeat.value = time.time()
+
+    spec = APPS[name]
+    config = build_config(
+        spec["app"], spec["host"], spec["port"],
+        callback_notify=beat,  # uvicorn 主循环每秒回调，事件循环卡死时心跳停止
+        timeout_notify=1
     )
     server = uvicorn.Server(config)
-    exit_handler.add_server(server)
     try:
-        await server.serve()
+        server.run(sockets=[sock])
     except Exception as e:
-        logger.error(f"API 服务发生错误: {str(e)}")
-        raise
-
-async def cleanup():
-    """清理资源"""
-    logger.info("执行清理操作...")
-    # 这里可以添加其他需要清理的资源
-    # 例如关闭数据库连接、清理临时文件等
-    await asyncio.sleep(0.1)  # 给一些时间让日志输出
-    logger.info("清理完成")
-
-async def main():
+        logger.error(f"{name} 工作进程发生错误: {str(e)}")
+        sys.exit(1)
+    finally:
+        # 工作进程退出时不会执行 atexit，手动写出后台队列中剩余的日志
+        log_pipeline.shutdown()
+
+
+class WorkerSlot:
+    """一个工作进程位置，进程退出后在同一位置重启"""
+
+    def __init__(self, name: str, index: int):
+        self.name = name
+        self.index = index
+        self.process = None
+        self.heartbeat = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.next_start = 0.0
+
+
+class Supervisor:
+    """
+    多进程管理器
+
+    - 主进程预先绑定每个应用的监听端口，fork 出 N 个工作进程共享该 socket
+    - 监控工作进程存活和心跳，退出或卡死时按退避间隔重启
+    - SIGTERM/SIGINT/SIGQUIT：转发 SIGTERM 给所有工作进程，等待进行中的请求完成后退出
+    - SIGHUP：逐个优雅重启工作进程
+    """
+
+    def __init__(self, apps: dict):
+        self.apps = apps
+        self.ctx = multiprocessing.get_context("fork")
+        self.sockets = {}
+        self.slots = []
+        self.shutdown = False
+        self.reload_requested = False
+
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT):
+            signal.signal(sig, self._handle_exit)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+    def _handle_exit(self, signum, frame):
+        sig_name = signal.Signals(signum).name
+        logger.info(f"收到 {sig_name} 信号，开始优雅关闭...")
+        self.shutdown = True
+
+    def _handle_reload(self, signum, frame):
+        logger.info("收到 SIGHUP 信号，逐个重启工作进程...")
+        self.reload_requested = True
+
+    def spawn(self, slot: WorkerSlot):
+        slot.heartbeat = self.ctx.Value('d', time.time(), lock=False)
+        slot.process = self.ctx.Process(
+            target=worker_main,
+            args=(slot.name, self.sockets[slot.name], slot.heartbeat),
+            name=f"{slot.name}-worker-{slot.index}",
+            daemon=False
+        )
+        slot.process.start()
+        slot.started_at = time.time()
+        logger.info(f"启动 {slot.name} 工作进程 #{slot.index}, PID: {slot.process.pid}")
+
+    def start(self):
+        for name, spec in self.apps.items():
+            self.sockets[name] = create_listen_socket(spec["host"], spec["port"])
+            logger.info(f"{name} 服务监听 {spec['host']}:{spec['port']}，工作进程数: {spec['workers']}")
+            for index in range(spec["workers"]):
+                slot = WorkerSlot(name, index)
+                self.slots.append(slot)
+                self.spawn(slot)
+
+    def _check_slot(self, slot: WorkerSlot, now: float):
+        process = slot.process
+        if process.is_alive():
+            # 启动阶段不检查心跳
+            if now - slot.started_at > HEARTBEAT_TIMEOUT and now - slot.heartbeat.value > HEARTBEAT_TIMEOUT:
+                logger.error(f"{slot.name} 工作进程 #{slot.index} (PID {process.pid}) 心跳超时，强制结束")
+                process.kill()
+                process.join()
+            else:
+                return
+
+        if slot.next_start == 0.0:
+            exitcode = process.exitcode
+            # 正常退出（例如达到 limit_max_requests 或被单独 SIGTERM）立即重启，异常退出按指数退避
+            if exitcode in (0, -signal.SIGTERM):
+                backoff = 0
+            else:
+                if now - slot.started_at > MAX_RESTART_BACKOFF * 2:
+                    slot.restarts = 0  # 运行足够久后重置退避
+                slot.restarts += 1
+                backoff = min(MAX_RESTART_BACKOFF, 2 ** (slot.restarts - 1))
+            logger.warning(f"{slot.name} 工作进程 #{slot.index} (PID {process.pid}) 已退出，"
+                           f"退出码: {exitcode}，{backoff} 秒后重启")
+            slot.next_start = now + backoff
+
+        if now >= slot.next_start:
+            slot.next_start = 0.0
+            self.spawn(slot)
+
+    def rolling_restart(self):
+        """逐个优雅重启工作进程，保证任意时刻都有进程在服务"""
+        for slot in self.slots:
+            if self.shutdown:
+                return
+            old = slot.process
+            self.spawn(slot)
+            old.terminate()
+            old.join(GRACEFUL_TIMEOUT + 5)
+            if old.is_alive():
+                old.kill()
+
+    def monitor(self):
+        while not self.shutdown:
+            time.sleep(1)
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rolling_restart()
+                continue
+            now = time.time()
+            for slot in self.slots:
+                if self.shutdown:
+                    break
+                self._check_slot(slot, now)
+
+    def stop(self):
+        """转发 SIGTERM 并等待工作进程完成进行中的请求"""
+        alive = [slot.process for slot in self.slots if slot.process and slot.process.is_alive()]
+        for process in alive:
+            process.terminate()
+        deadline = time.time() + GRACEFUL_TIMEOUT + 5
+        for process in alive:
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                logger.warning(f"工作进程 PID {process.pid} 未在 {GRACEFUL_TIMEOUT} 秒内退出，强制结束")
+                process.kill()
+                process.join()
+        for sock in self.sockets.values():
+            sock.close()
+        logger.info("所有工作进程已退出")
+
+    def run(self):
+        self.start()
+        try:
+            self.monitor()
+        finally:
+            self.stop()
+
+
+async def run_single_process():
+    """单进程模式（Windows 不支持 fork 共享 socket）：在同一事件循环中运行两个应用"""
+    servers = [uvicorn.Server(build_config(spec["app"], spec["host"], spec["port"]))
+               for spec in APPS.values()]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
     """主函数"""
     # 设置进程标题
-    try:
-        import setproctitle
-        setproctitle.setproctitle('llm_key_server')
-    except ImportError:
-        pass
+    _set_proc_title('llm_key_server: master')
 
-    # 设置ulimit（仅在Unix系统上）
-    if sys.platform != 'win32':
-        import resource
-        # 设置最大文件描述符数量
-        resource.setrlimit(resource.RLIMIT_NOFILE, (65535, 65535))
+    if sys.platform == 'win32':
+        logger.info("Windows 平台使用单进程模式")
+        asyncio.run(run_single_process())
+        return
+
+    # 设置最大文件描述符数量
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = 65535 if hard == resource.RLIM_INFINITY else min(65535, hard)
+    if soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+    Supervisor(APPS).run()
 
-    exit_handler = GracefulExit()
-    
-    try:
-        # 并发运行管理后台和API服务
-        await asyncio.gather(
-            run_admin(exit_handler),
-            run_api(exit_handler)
-        )
-    except Exception as e:
-        logger.error(f"服务运行出错: {str(e)}")
-    finally:
-        if exit_handler.shutdown:
-            logger.info("正在关闭服务...")
-            await cleanup()
-        else:
-            logger.error("服务异常终止")
-            await cleanup()
 
 if __name__ == "__main__":
     try:
-        # 设置多进程启动方法
-        if sys.platform == 'win32':
-            # Windows 平台使用 spawn
-            multiprocessing.set_start_method('spawn')
-        else:
-            # Unix-like 平台使用 fork
-            multiprocessing.set_start_method('fork')
-
-        # 平台特定的事件循环设置
-        if sys.platform == 'win32':
-            # Windows 平台使用 ProactorEventLoop
-            loop = asyncio.ProactorEventLoop()
-            asyncio.set_event_loop(loop)
-        else:
-            # Unix-like 平台使用默认的事件循环
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            # 在 Unix-like 平台上设置子进程信号处理
-            loop.add_signal_handler(signal.SIGCHLD, lambda: None)
-        
-        # 运行主程序
-        asyncio.run(main())
+        main()
     except KeyboardInterrupt:
         logger.info("程序被用户中断")
     except Exception as e:
@@ -182,4 +296,3 @@ if __name__ == "__main__":
         sys.exit(1)
     finally:
         logger.info("程序退出")
-        sys.exit(0) 
\ No newline at end of file
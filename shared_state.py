@@ -0,0 +1,200 @@
+import asyncio
+import inspect
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import struct
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 需要跨进程通知的主题，每个主题在共享内存中占一个 int64 版本号
+TOPICS = ("routing", "rate_limits", "admission", "proxies", "health", "breaker")
+
+_SLOT = struct.Struct("q")
+_MISSING = object()
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedState:
+    """
+    跨工作进程的共享状态
+
+    - 版本号：位于匿名共享内存（mmap，fork 后父子进程共享），发布方递增版本号，
+      各进程的 watcher 每隔几十毫秒比较一次内存中的版本号，变化时才回调，不轮询数据库
+    - 键值：位于 SQLite（WAL 模式），用于携带主题的最新值（代理列表、健康状态等）
+    - 领导进程：共享内存中记录一个 PID，只有领导进程执行代理测试、健康检查等后台探测，
+      领导进程退出后由其他进程接管
+
+    必须在 fork 工作进程之前创建（run.py 的主进程导入 main 时创建），单进程运行时同样可用。
+    """
+
+    def __init__(self, db_path="data/shared_state.db", topics=TOPICS):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(exist_ok=True)
+        self.topics = {topic: index for index, topic in enumerate(topics)}
+        self._leader_slot = len(topics)
+        self._buffer = mmap.mmap(-1, _SLOT.size * (len(topics) + 1))
+        self._lock = multiprocessing.Lock()
+        self._seen: Dict[str, int] = {topic: 0 for topic in topics}
+        self._subscribers: Dict[str, List[Callable]] = {topic: [] for topic in topics}
+        self._db_lock = threading.Lock()
+        self._conn_pid = None
+        self._connection = None
+        self.logger = logging.getLogger('nexusai.shared')
+
+    # ---- 共享内存版本号 ----
+
+    def _read_slot(self, index: int) -> int:
+        return _SLOT.unpack_from(self._buffer, index * _SLOT.size)[0]
+
+    def _write_slot(self, index: int, value: int):
+        _SLOT.pack_into(self._buffer, index * _SLOT.size, value)
+
+    def generation(self, topic: str) -> int:
+        return self._read_slot(self.topics[topic])
+
+    def publish(self, topic: str, value: Any = _MISSING):
+        """发布主题变更：先写入值（如有），再递增版本号通知其他进程"""
+        if value is not _MISSING:
+            self.set(topic, value)
+        with self._lock:
+            generation = self._read_slot(self.topics[topic]) + 1
+            self._write_slot(self.topics[topic], generation)
+        # 本进程已经是最新状态，不需要再回调自己
+        self._seen[topic] = generation
+
+    def subscribe(self, topic: str, callback: Callable[[Any], Any]):
+        """订阅主题变更，callback 接收主题的最新值（未发布值时为 None），可以是异步函数"""
+        self._subscribers[topic].append(callback)
+
+    async def poll(self) -> List[str]:
+        """检查所有主题的版本号，对发生变化的主题调用订阅者，返回变化的主题列表"""
+        changed = []
+        for topic, index in self.topics.items():
+            generation = self._read_slot(index)
+            if generation == self._seen[topic]:
+                continue
+            self._seen[topic] = generation
+            changed.append(topic)
+            if not self._subscribers[topic]:
+                continue
+            value = self.get(topic)
+            for callback in self._subscribers[topic]:
+                try:
+                    result = callback(value)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    self.logger.error(f"处理共享状态 {topic} 变更时出错: {str(e)}")
+        return changed
+
+    # ---- 领导进程 ----
+
+    def try_lead(self) -> bool:
+        """尝试成为（或确认仍是）领导进程"""
+        pid = os.getpid()
+        with self._lock:
+            leader = self._read_slot(self._leader_slot)
+            if leader == pid:
+                return True
+            if leader == 0 or not pid_alive(leader):
+                self._write_slot(self._leader_slot, pid)
+                return True
+        return False
+
+    def is_leader(self) -> bool:
+        return self._read_slot(self._leader_slot) == os.getpid()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "leader_pid": self._read_slot(self._leader_slot),
+            "generations": {topic: self._read_slot(index) for topic, index in self.topics.items()}
+        }
+
+    async def run_watcher(self, interval: float = 0.05,
+                          on_leadership: Optional[Callable[[], Any]] = None,
+                          leadership_interval: float = 1.0):
+        """
+        后台监听共享状态变更
+
+        Args:
+            interval: 检查版本号的间隔（秒）
+            on_leadership: 本进程成为领导进程时调用（例如启动后台探测任务）
+            leadership_interval: 检查领导进程是否存活的间隔（秒）
+        """
+        was_leader = False
+        ticks_per_check = max(1, int(leadership_interval / interval))
+        tick = 0
+        while True:
+            try:
+                if tick % ticks_per_check == 0 and on_leadership:
+                    leader = self.try_lead()
+                    if leader and not was_leader:
+                        self.logger.info(f"进程 {os.getpid()} 成为领导进程，负责后台探测")
+                        result = on_leadership()
+                        if inspect.isawaitable(result):
+                            await result
+                    was_leader = leader
+                await self.poll()
+            except Exception as e:
+                self.logger.error(f"共享状态监听出错: {str(e)}")
+            tick += 1
+            await asyncio.sleep(interval)
+
+    # ---- SQLite 键值 ----
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=5.0,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS shared_kv (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+            self._connection = conn
+            self._conn_pid = os.getpid()
+        return self._connection
+
+    def set(self, key: str, value: Any):
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO shared_kv (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._db_lock:
+            row = self._conn.execute("SELECT value FROM shared_kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def delete(self, key: str):
+        with self._db_lock:
+            self._conn.execute("DELETE FROM shared_kv WHERE key = ?", (key,))
+
+    def items(self, prefix: str) -> List[Tuple[str, Any]]:
+        """返回键以 prefix 开头的所有键值"""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM shared_kv WHERE key >= ? AND key < ?",
+                (prefix, prefix + "\uffff")
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
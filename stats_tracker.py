@@ -1,8 +1,13 @@
 import json
+import time
 from datetime import datetime
 import aiosqlite
 from pathlib import Path
 from my_tokenizer import Tokenizer
+from metrics import REGISTRY
+
+STATS_PENDING = REGISTRY.gauge("nexusai_stats_pending_writes", "正在进行中的统计写入数")
+STATS_WRITE_SECONDS = REGISTRY.histogram("nexusai_stats_write_seconds", "单次统计写入（含 token 计数）耗时（秒）")
 
 class StatsTracker:
     def __init__(self, db_path="data/stats.db"):
@@ -10,6 +15,14 @@ class StatsTracker:
         self.db_path.parent.mkdir(exist_ok=True)
         self.setup_db()
         self.tokenizer = Tokenizer()  # 初始化tokenizer
+        self.listeners = []  # 每次记录后调用的回调，例如限流配额统计
+
+    def add_listener(self, callback):
+        """
+        注册统计回调，callback 为异步函数，参数为
+        (personalized_key, provider_id, model_name, tokens_count, is_prompt)
+        """
+        self.listeners.append(callback)
 
     def setup_db(self):
         # 同步方式初始化数据库
@@ -54,10 +67,18 @@ class StatsTracker:
 
     async def record_chat(self, conversation_id: str, provider_id: int, 
                          model_name: str, tokens_count: int, is_prompt: bool, 
-                         message: str = ""):
+                         message: str = "", personalized_key: str = "", message_tokens: int = 0):
+        """
+        记录一次 token 统计，并在提供 message 时保存聊天记录
+
+        message_tokens 为消息本身的 token 数（多轮对话中 tokens_count 还包含历史），
+        不提供时与 tokens_count 相同。
+        """
+        STATS_PENDING.inc()
+        start = time.perf_counter()
         try:
-            # 使用tokenizer计算token数量
-            if message:
+            # 调用方未提供 token 数时使用tokenizer计算
+            if message and not tokens_count:
                 tokens_count = await self.tokenizer.count_tokens(message)
                 
             async with aiosqlite.connect(self.db_path) as db:
@@ -82,12 +103,21 @@ class StatsTracker:
                         model_name,
                         "user" if is_prompt else "assistant",
                         message,
-                        tokens_count
+                        message_tokens or tokens_count
                     ))
                 
                 await db.commit()
         except Exception as e:
             print(f"Error recording chat: {e}")
+        finally:
+            STATS_PENDING.dec()
+            STATS_WRITE_SECONDS.observe(time.perf_counter() - start)
+        
+        for listener in self.listeners:
+            try:
+                await listener(personalized_key, provider_id, model_name, tokens_count, is_prompt)
+            except Exception as e:
+                print(f"Error in stats listener: {e}")
 
     async def get_conversation_messages(self, conversation_id: str):
         """获取指定会话的完整聊天记录"""
@@ -96,7 +126,7 @@ class StatsTracker:
                 SELECT timestamp, role, content, tokens_count
                 FROM chat_messages 
                 WHERE conversation_id = ?
-                ORDER BY timestamp ASC
+                ORDER BY timestamp ASC, id ASC
             """, (conversation_id,)) as cursor:
                 messages = await cursor.fetchall()
                 return [{
@@ -6,6 +6,11 @@ from datetime import datetime
 import httpx  # Use httpx for async HTTP requests
 import argparse
 import sqlite3
+import time
+
+from database import init_db, save_model_health
+from my_tokenizer import Tokenizer
+from upstream_pool import build_upstream_url
 
 # Set up logging
 LOG_DIR = Path("logs")
@@ -26,8 +31,84 @@ logger = logging.getLogger(__name__)
 # Database path
 DATABASE_PATH = Path("data/config.db")
 
-async def test_model(provider_id: int, model_name: str, personalized_key: str, port: int):
-    """Test a single model"""
+def extract_content(data: dict) -> str:
+    """从流式数据块中提取文本内容"""
+    if "choices" in data and data["choices"]:
+        delta = data["choices"][0].get("delta", {})
+        if isinstance(delta, dict):
+            return delta.get("content") or ""
+    return ""
+
+
+async def test_stream(client: httpx.AsyncClient, base_url: str, headers: dict, model_name: str, tokenizer: Tokenizer):
+    """
+    流式请求测试，按 SSE 事件的到达时间计算首 token 延迟和生成速度
+
+    Returns:
+        dict: ttft（秒）、total_time（秒）、completion_tokens、tokens_per_second
+    """
+    request_body = {
+        "model": model_name,
+        "messages": [{"role": "user", "content": "你是谁"}],
+        "stream": True
+    }
+
+    start = time.perf_counter()
+    first_content = last_content = None
+    parts = []
+    async with client.stream("POST", base_url, json=request_body, headers=headers) as response:
+        if response.status_code != 200 or 'text/event-stream' not in response.headers.get('Content-Type', ''):
+            await response.aread()
+            raise Exception(f"Stream request failed with status: {response.status_code}, Error: {response.text}")
+        logger.info(f"[{model_name}] Stream response supported, starting to receive data...")
+
+        async for line in response.aiter_lines():
+            if not line.startswith('data: '):
+                continue
+            payload = line[6:].strip()
+            if payload == '[DONE]':
+                break
+            try:
+                data = json.loads(payload)
+            except json.JSONDecodeError as e:
+                logger.error(f"[{model_name}] JSON parsing error: {str(e)}, raw content: {payload}")
+                continue
+            if isinstance(data, dict) and data.get("error"):
+                raise Exception(f"Stream error: {json.dumps(data['error'], ensure_ascii=False)}")
+            content = extract_content(data)
+            if content:
+                now = time.perf_counter()
+                if first_content is None:
+                    first_content = now
+                last_content = now
+                parts.append(content)
+                logger.debug(f"[{model_name}] Stream response content: {content}")
+
+    total_time = time.perf_counter() - start
+    text = "".join(parts)
+    completion_tokens = await tokenizer.count_tokens(text) if text else 0
+    # 生成速度只计算首个到最后一个内容块之间的时间，不包含排队和首 token 延迟
+    generation_time = (last_content - first_content) if first_content is not None else 0
+    if generation_time > 0 and completion_tokens > 1:
+        tokens_per_second = (completion_tokens - 1) / generation_time
+    else:
+        tokens_per_second = completion_tokens / total_time if total_time > 0 else 0
+    return {
+        "ttft": (first_content - start) if first_content is not None else None,
+        "total_time": total_time,
+        "completion_tokens": completion_tokens,
+        "tokens_per_second": tokens_per_second
+    }
+
+
+async def test_model(provider_id: int, model_name: str, server_url: str, server_key: str,
+                     client: httpx.AsyncClient = None, tokenizer: Tokenizer = None):
+    """
+    直接请求提供商的上游测试单个模型
+
+    不经过网关：同一密钥可能对应多个提供商，经网关时由路由决定实际的提供商，结果会记到
+    错误的提供商上；巡检请求也会占用密钥的限流额度和准入名额。
+    """
     logger.info(f"\n开始测试模型: {model_name}")
     logger.info("=" * 50)
 
@@ -35,53 +116,35 @@ async def test_model(provider_id: int, model_name: str, personalized_key: str, p
         "first_response_time": None,
         "total_tokens": 0,
         "total_time": 0,
-        "supports_stream": False
+        "supports_stream": False,
+        "ttft": None,
+        "tokens_per_second": None
     }
+    errors = []
 
-    base_url = f"http://localhost:{port}/v1/chat/completions"
+    base_url = build_upstream_url(server_url)
     headers = {
-        "Authorization": f"Bearer {personalized_key}",
+        "Authorization": f"Bearer {server_key}",
         "Content-Type": "application/json"
     }
+    tokenizer = tokenizer or Tokenizer()
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(timeout=30.0)  # 添加超时设置
 
-    async with httpx.AsyncClient(timeout=30.0) as client:  # 添加超时设置
+    try:
         # Test stream response
         try:
-            stream_request_body = {
-                "model": model_name,
-                "messages": [{"role": "user", "content": "你是谁"}],
-                "stream": True
-            }
-            
-            start_time = datetime.now()
-            stream_response = await client.post(base_url, json=stream_request_body, headers=headers)
-            
-            if stream_response.status_code == 200 and 'text/event-stream' in stream_response.headers.get('Content-Type', ''):
-                metrics["supports_stream"] = True
-                logger.info("Stream response supported, starting to receive data...")
-
-                async for line in stream_response.aiter_lines():
-                    if line.strip():
-                        try:
-                            if line.startswith('data: '):
-                                line = line[6:].strip()
-                                if line != '[DONE]':
-                                    data = json.loads(line)
-                                    if "choices" in data and data["choices"]:
-                                        delta = data["choices"][0].get("delta", {})
-                                        if "content" in delta:
-                                            content = delta["content"]
-                                            tokens = len(content.encode('utf-8')) // 4
-                                            metrics["total_tokens"] += tokens
-                                            logger.info(f"Stream response content: {content}")
-                        except json.JSONDecodeError as e:
-                            logger.error(f"JSON parsing error: {str(e)}, raw content: {line}")
-                        except Exception as e:
-                            logger.error(f"Error processing stream response: {str(e)}")
-
+            stream_metrics = await test_stream(client, base_url, headers, model_name, tokenizer)
+            metrics["supports_stream"] = True
+            metrics["ttft"] = stream_metrics["ttft"]
+            metrics["first_response_time"] = stream_metrics["ttft"]
+            metrics["tokens_per_second"] = stream_metrics["tokens_per_second"]
+            metrics["total_tokens"] += stream_metrics["completion_tokens"]
         except Exception as e:
             metrics["supports_stream"] = False
-            logger.error(f"Stream response test failed: {str(e)}")
+            errors.append(f"stream: {str(e) or type(e).__name__}")
+            logger.error(f"[{model_name}] Stream response test failed: {str(e)}")
 
         # Test regular response
         try:
@@ -93,10 +156,10 @@ async def test_model(provider_id: int, model_name: str, personalized_key: str, p
 
             logger.info(f"Request body: {json.dumps(request_body, ensure_ascii=False, indent=2)}")
             
-            start_time = datetime.now()
+            start = time.perf_counter()
             response = await client.post(base_url, json=request_body, headers=headers)
-            first_response_time = (datetime.now() - start_time).total_seconds()
-            metrics["first_response_time"] = first_response_time
+            if metrics["first_response_time"] is None:
+                metrics["first_response_time"] = time.perf_counter() - start
 
             if response.status_code != 200:
                 error_text = response.text
@@ -104,15 +167,17 @@ async def test_model(provider_id: int, model_name: str, personalized_key: str, p
             
             content = response.json()
             
-            total_time = (datetime.now() - start_time).total_seconds()
+            total_time = time.perf_counter() - start
             response_text = content.get('choices', [{}])[0].get('message', {}).get('content', '')
-            total_tokens = len(response_text.encode('utf-8')) // 4  # 更准确的token估算
+            total_tokens = await tokenizer.count_tokens(response_text) if response_text else 0
             
             metrics["total_time"] = total_time
             metrics["total_tokens"] += total_tokens
+            if metrics["tokens_per_second"] is None and total_time > 0:
+                metrics["tokens_per_second"] = total_tokens / total_time
 
-            logger.info("Request succeeded!")
-            logger.info(f"Response content: {json.dumps(content, ensure_ascii=False, indent=2)}")
+            logger.info(f"[{model_name}] Request succeeded!")
+            logger.debug(f"Response content: {json.dumps(content, ensure_ascii=False, indent=2)}")
 
             return {
                 "provider_id": provider_id,
@@ -126,21 +191,49 @@ async def test_model(provider_id: int, model_name: str, personalized_key: str, p
             error_msg = str(e)
             if not error_msg:
                 error_msg = "Unknown error occurred"
-            logger.error(f"Error during testing: {error_msg}")
+            errors.append(error_msg)
+            logger.error(f"[{model_name}] Error during testing: {error_msg}")
             return {
                 "provider_id": provider_id,
                 "model_name": model_name,
-                "success": False,
-                "error": error_msg,
+                # 只支持流式的模型同样视为可用
+                "success": metrics["supports_stream"],
+                "error": "; ".join(errors),
                 "metrics": metrics
             }
+    finally:
+        if own_client:
+            await client.aclose()
+
 
+def is_ip_server(server_url: str) -> bool:
+    """服务器地址是否为IP地址形式"""
+    return bool(server_url) and all(part.replace('.', '').isdigit() for part in server_url.split('://')[-1].split(':')[0].split('.'))
 
-async def test_all_models(skip_ip_test=True, port=5231):
+
+def save_health(result: dict):
+    """把测试结果写入 model_health 表，供网关路由按首 token 延迟选择提供商"""
+    metrics = result["metrics"]
+    try:
+        save_model_health(
+            result["provider_id"], result["model_name"], result["success"], metrics["supports_stream"],
+            ttft_ms=metrics["ttft"] * 1000 if metrics["ttft"] is not None else None,
+            tokens_per_second=metrics["tokens_per_second"],
+            total_time=metrics["total_time"] or None,
+            error=result.get("error")
+        )
+    except Exception as e:
+        logger.error(f"保存模型健康状态失败: {str(e)}")
+
+
+async def test_all_models(skip_ip_test=True, proxy=None, concurrency=1, per_provider=2, save_to_db=True):
     """测试所有模型
     Args:
         skip_ip_test (bool): 是否跳过IP地址形式的服务器测试
-        port (int): 本地转发服务器的端口号，默认5231
+        proxy (str): 描述中包含 proxy 的提供商使用的代理（与网关的规则相同），为空时直连
+        concurrency (int): 同时测试的模型数，1 为逐个测试
+        per_provider (int): 同一提供商同时测试的模型数上限
+        save_to_db (bool): 是否把结果写入 model_health 表
     """
     try:
         conn = sqlite3.connect(DATABASE_PATH)
@@ -150,43 +243,62 @@ async def test_all_models(skip_ip_test=True, port=5231):
             SELECT 
                 sp.id,
                 sp.name,
-                sp.personalized_key,
+                sp.server_key,
                 pm.model_name,
-                sp.server_url
+                sp.server_url,
+                sp.description
             FROM service_providers sp
             JOIN provider_models pm ON sp.id = pm.provider_id
         """)
         
         models = cursor.fetchall()
-        
-        if not models:
-            logger.warning("数据库中没有找到任何模型配置")
-            return []
+    except sqlite3.Error as e:
+        logger.error(f"数据库错误: {str(e)}")
+        return []
+    finally:
+        conn.close()
 
-        results = []
-        base_url = f"http://localhost:{port}"
-        logger.info(f"使用本地转发服务器: {base_url}")
+    if not models:
+        logger.warning("数据库中没有找到任何模型配置")
+        return []
 
-        for provider_id, provider_name, personalized_key, model_name, server_url in models:
-            # 检查是否需要跳过IP地址形式的服务器
-            if skip_ip_test and server_url and all(part.replace('.', '').isdigit() for part in server_url.split('://')[-1].split(':')[0].split('.')):
-                logger.info(f"\n跳过IP地址服务器的测试: {provider_name} - {model_name} ({server_url})")
-                continue
+    logger.info(f"直接请求各提供商的上游，并发数: {concurrency}，单个提供商并发上限: {per_provider}")
+
+    if save_to_db:
+        init_db()
 
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    provider_semaphores = {}
+    tokenizer = Tokenizer()
+
+    async def run(client, provider_id, provider_name, server_key, model_name, server_url):
+        # 先占用提供商的名额再占用全局名额，避免全局名额被同一提供商的排队任务占满
+        provider_semaphore = provider_semaphores.setdefault(provider_id, asyncio.Semaphore(max(1, per_provider)))
+        async with provider_semaphore, semaphore:
             logger.info(f"\n测试提供商 {provider_name} 的模型 {model_name}")
             logger.info(f"目标服务器: {server_url}")
-            result = await test_model(provider_id, model_name, personalized_key, port)
-            result['provider_name'] = provider_name
-            result['server_url'] = server_url
-            results.append(result)
+            result = await test_model(provider_id, model_name, server_url, server_key,
+                                      client=client, tokenizer=tokenizer)
+        result['provider_name'] = provider_name
+        result['server_url'] = server_url
+        if save_to_db:
+            save_health(result)
+        return result
 
-        return results
+    tasks = []
+    limits = httpx.Limits(max_connections=max(10, concurrency * 2))
+    async with httpx.AsyncClient(timeout=30.0, limits=limits) as client, \
+            httpx.AsyncClient(timeout=30.0, limits=limits, proxy=proxy) as proxy_client:
+        for provider_id, provider_name, server_key, model_name, server_url, description in models:
+            # 检查是否需要跳过IP地址形式的服务器
+            if skip_ip_test and is_ip_server(server_url):
+                logger.info(f"\n跳过IP地址服务器的测试: {provider_name} - {model_name} ({server_url})")
+                continue
+            need_proxy = proxy and "proxy" in (description or "").lower()
+            tasks.append(run(proxy_client if need_proxy else client, provider_id, provider_name,
+                             server_key, model_name, server_url))
 
-    except sqlite3.Error as e:
-        logger.error(f"数据库错误: {str(e)}")
-        return []
-    finally:
-        conn.close()
+        return list(await asyncio.gather(*tasks))
 
 def save_results(results):
     """保存测试结果到文件"""
@@ -214,11 +326,13 @@ def print_summary(results):
     for result in results:
         if result['success']:
             metrics = result['metrics']
-            tokens_per_second = metrics['total_tokens'] / metrics['total_time'] if metrics['total_time'] > 0 else 0
+            tokens_per_second = metrics.get('tokens_per_second') or 0
             
             logger.info(f"\n供应商: {result['provider_name']}")
             logger.info(f"模型名称: {result['model_name']}")
             logger.info(f"原始服务器: {result['server_url']}")
+            if metrics.get('ttft') is not None:
+                logger.info(f"首 token 延迟: {metrics['ttft'] * 1000:.0f} 毫秒")
             logger.info(f"平均处理速度: {tokens_per_second:.2f} tokens/秒")
             logger.info(f"总生成tokens: {metrics['total_tokens']:.0f}")
             logger.info(f"总响应时间: {metrics['total_time']:.2f} 秒")
@@ -233,19 +347,40 @@ def print_summary(results):
                 logger.info(f"错误信息: {result.get('error', '未知错误')}")
                 logger.info("-" * 30)
 
+async def notify_gateway(admin_port: int):
+    """通知网关重新加载模型巡检结果；网关未运行时忽略（健康检查会定期加载）"""
+    try:
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            response = await client.post(f"http://localhost:{admin_port}/health/models/reload")
+            logger.info(f"已通知网关重新加载模型巡检结果: HTTP {response.status_code}")
+    except httpx.HTTPError as e:
+        logger.warning(f"通知网关失败（网关会在下次健康检查时加载）: {str(e)}")
+
 async def main():
     parser = argparse.ArgumentParser(description='模型测试工具')
-    parser.add_argument('--port', type=int, default=5231, help='本地转发服务器端口号')
+    parser.add_argument('--proxy', default=None, help='描述中包含 proxy 的提供商使用的代理地址')
     parser.add_argument('--test-all', action='store_false', dest='skip_ip_test',
                        help='测试所有服务器（包括IP地址形式的服务器）')
+    parser.add_argument('--concurrency', type=int, default=1, help='同时测试的模型数，默认逐个测试')
+    parser.add_argument('--per-provider', type=int, default=2, help='同一提供商同时测试的模型数上限')
+    parser.add_argument('--no-save', action='store_false', dest='save_to_db',
+                       help='不把结果写入 model_health 表')
+    parser.add_argument('--admin-port', type=int, default=8000,
+                       help='管理后台端口，巡检完成后通知网关重新加载结果（0 表示不通知）')
     args = parser.parse_args()
 
-    logger.info(f"开始模型测试... 使用本地转发端口: {args.port}")
+    logger.info("开始模型测试...")
     logger.info(f"{'跳过' if args.skip_ip_test else '包含'} IP地址服务器测试")
     
-    results = await test_all_models(skip_ip_test=args.skip_ip_test, port=args.port)
+    start = time.perf_counter()
+    results = await test_all_models(skip_ip_test=args.skip_ip_test, proxy=args.proxy,
+                                    concurrency=args.concurrency, per_provider=args.per_provider,
+                                    save_to_db=args.save_to_db)
+    logger.info(f"巡检耗时: {time.perf_counter() - start:.1f} 秒")
     save_results(results)
     print_summary(results)
+    if args.save_to_db and args.admin_port:
+        await notify_gateway(args.admin_port)
 
 if __name__ == "__main__":
     asyncio.run(main())
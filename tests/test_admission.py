@@ -0,0 +1,91 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import pytest
+from admission import (
+    AdmissionController, AdmissionRejected, ProviderGate,
+    PRIORITY_INTERACTIVE, PRIORITY_BATCH
+)
+
+@pytest.mark.asyncio
+async def test_acquire_within_limit_is_immediate():
+    gate = ProviderGate(max_concurrency=2, max_queue=1, queue_timeout=1)
+    first = await gate.acquire()
+    second = await gate.acquire()
+    assert gate.active == 2
+    assert first.wait_time == 0.0
+    second.release()
+    second.release()  # 重复释放不应重复归还
+    assert gate.active == 1
+    first.release()
+    assert gate.active == 0
+
+@pytest.mark.asyncio
+async def test_queue_full_rejects_fast():
+    gate = ProviderGate(max_concurrency=1, max_queue=1, queue_timeout=5)
+    ticket = await gate.acquire()
+    waiter = asyncio.create_task(gate.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected):
+        await gate.acquire()
+    assert gate.rejected_full == 1
+    ticket.release()
+    (await waiter).release()
+    assert gate.active == 0
+
+@pytest.mark.asyncio
+async def test_queue_timeout_sheds_request():
+    gate = ProviderGate(max_concurrency=1, max_queue=4, queue_timeout=0.05)
+    ticket = await gate.acquire()
+    with pytest.raises(AdmissionRejected):
+        await gate.acquire()
+    assert gate.rejected_timeout == 1
+    assert gate.queue_depth() == 0
+    ticket.release()
+    assert gate.active == 0
+
+@pytest.mark.asyncio
+async def test_interactive_served_before_batch():
+    gate = ProviderGate(max_concurrency=1, max_queue=4, queue_timeout=1)
+    ticket = await gate.acquire()
+    order = []
+
+    async def worker(name, priority):
+        t = await gate.acquire(priority)
+        order.append(name)
+        t.release()
+
+    batch = asyncio.create_task(worker("batch", PRIORITY_BATCH))
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(worker("interactive", PRIORITY_INTERACTIVE))
+    await asyncio.sleep(0)
+    assert gate.snapshot()["queue_depth"] == {"interactive": 1, "batch": 1}
+    ticket.release()
+    await asyncio.gather(batch, interactive)
+    assert order == ["interactive", "batch"]
+
+@pytest.mark.asyncio
+async def test_batch_cannot_use_reserved_slots():
+    gate = ProviderGate(max_concurrency=5, max_queue=4, queue_timeout=0.05)
+    tickets = [await gate.acquire(PRIORITY_BATCH) for _ in range(gate.batch_limit)]
+    with pytest.raises(AdmissionRejected):
+        await gate.acquire(PRIORITY_BATCH)
+    interactive = await gate.acquire(PRIORITY_INTERACTIVE)
+    assert gate.active == gate.batch_limit + 1
+    for ticket in tickets + [interactive]:
+        ticket.release()
+
+@pytest.mark.asyncio
+async def test_controller_uses_policies_and_priorities():
+    controller = AdmissionController(
+        provider_loader=lambda: [(3, 1, 0, 1.0)],
+        priority_loader=lambda: [("batch-key", "batch")]
+    )
+    assert controller.priority_for("batch-key") == PRIORITY_BATCH
+    assert controller.priority_for("other") == PRIORITY_INTERACTIVE
+    ticket = await controller.acquire(3, "other")
+    with pytest.raises(AdmissionRejected):
+        await controller.acquire(3, "other")
+    ticket.release()
+    assert controller.snapshot()[3]["max_concurrency"] == 1
@@ -0,0 +1,90 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import pytest
+
+from bench.loadgen import LoadConfig, RequestResult, percentile, run_load, summarize
+from bench.mock_upstream import MockConfig, create_mock_upstream
+from bench.run_bench import compare, overhead
+
+
+def mock_client(config: MockConfig) -> httpx.AsyncClient:
+    app = create_mock_upstream(config)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://mock")
+
+
+def test_percentile():
+    values = [0.1 * i for i in range(1, 11)]
+    assert percentile(values, 50) == pytest.approx(0.55)
+    assert percentile(values, 100) == pytest.approx(1.0)
+    assert percentile([], 50) is None
+
+
+def test_summarize_counts_errors():
+    results = [
+        RequestResult(200, 0.01, 0.1, chunks=5),
+        RequestResult(200, 0.02, 0.2, chunks=5),
+        RequestResult(500, None, 0.05),
+        RequestResult(0, None, 1.0, error="ReadTimeout"),
+    ]
+    summary = summarize(results, elapsed=1.0)
+    assert summary["requests"] == 4
+    assert summary["ok"] == 2
+    assert summary["error_rate"] == 0.5
+    assert summary["statuses"] == {"200": 2, "500": 1, "0:ReadTimeout": 1}
+    assert summary["chunks_per_s"] == 10
+    assert summary["ttft"]["p50_ms"] == pytest.approx(15.0)
+
+
+@pytest.mark.asyncio
+async def test_run_load_stream_against_mock():
+    async with mock_client(MockConfig(latency=0, completion_tokens=8, chunk_tokens=2)) as client:
+        config = LoadConfig(url="http://mock/v1/chat/completions", api_key="k", model="m",
+                            concurrency=3, duration=5, max_requests=9)
+        summary = await run_load(config, client=client)
+    assert summary["requests"] == 9
+    assert summary["ok"] == 9
+    assert summary["chunks_per_s"] > 0
+    assert summary["ttft"]["p50_ms"] is not None
+    assert "api_key" not in summary["config"]
+
+
+@pytest.mark.asyncio
+async def test_run_load_open_loop_with_errors():
+    async with mock_client(MockConfig(latency=0, error_rate=1.0, error_status=503)) as client:
+        config = LoadConfig(url="http://mock/v1/chat/completions", api_key="k", model="m",
+                            stream=False, rate=200, duration=5, max_requests=5)
+        summary = await run_load(config, client=client)
+    assert summary["requests"] == 5
+    assert summary["ok"] == 0
+    assert summary["statuses"] == {"503": 5}
+
+
+@pytest.mark.asyncio
+async def test_mock_upstream_grok_style_and_tokenizer():
+    async with mock_client(MockConfig(latency=0, completion_tokens=3, grok_style=True)) as client:
+        response = await client.post("/v1/chat/completions", json={"model": "m", "messages": []})
+        data = response.json()
+        assert "id" not in data
+        assert isinstance(data["choices"][0]["message"], str)
+
+        response = await client.post("/v1/tokenize", json={"model": "t", "text": ["a b c"]})
+        assert response.json()["data"][0]["total_tokens"] == 3
+
+
+def test_overhead_and_compare():
+    direct = {"ttft": {"p50_ms": 10.0, "p90_ms": 20.0, "p99_ms": None},
+              "ttlt": {"p50_ms": 50.0, "p90_ms": 60.0, "p99_ms": 70.0}}
+    gateway = {"ttft": {"p50_ms": 12.5, "p90_ms": 25.0, "p99_ms": 30.0},
+               "ttlt": {"p50_ms": 55.0, "p90_ms": 66.0, "p99_ms": 80.0},
+               "throughput_rps": 100.0}
+    result = overhead(direct, gateway)
+    assert result["ttft_p50_ms"] == 2.5
+    assert result["ttft_p99_ms"] is None
+
+    previous = {"git": "a", "gateway": {"throughput_rps": 80.0}}
+    current = {"git": "b", "gateway": gateway}
+    lines = compare(previous, current)
+    assert any("+25.0%" in line for line in lines)
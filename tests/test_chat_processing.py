@@ -0,0 +1,80 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chat_processing import (SSE_DONE, CompletionAccumulator, delta_content, flatten_messages,
+                             normalize_grok_chunk, parse_sse_line)
+
+def test_flatten_messages():
+    messages = [
+        {"role": "system", "content": "你好"},
+        {"role": "user", "content": [
+            {"type": "text", "text": "看图"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+            {"type": "text", "text": "说明"},
+        ]},
+        "raw",
+        [{"file": "x"}],
+        {"role": "assistant"},
+    ]
+    assert flatten_messages(messages) == "你好看图说明raw包含文件数据"
+    assert flatten_messages("plain") == "plain"
+
+def test_parse_sse_line():
+    assert parse_sse_line("") is None
+    assert parse_sse_line("   ") is None
+    assert parse_sse_line(": keep-alive") is None
+    assert parse_sse_line("data: [DONE]") == SSE_DONE
+    assert parse_sse_line("data:[DONE]") == SSE_DONE
+    assert parse_sse_line('data: {"a": 1}') == '{"a": 1}'
+    assert parse_sse_line('{"a": 1}') == '{"a": 1}'
+    # 内容中包含 [DONE] 不应被当作结束标记
+    assert parse_sse_line('data: {"content": "[DONE]"}') == '{"content": "[DONE]"}'
+
+def test_normalize_grok_chunk_variants():
+    for choice in ({"delta": "hi"}, {"message": {"content": "hi"}}, {"message": "hi"},
+                   {"text": "hi"}, {"content": "hi"}, {"delta": {"content": "hi"}}):
+        data = {"choices": [choice]}
+        assert normalize_grok_chunk(data, "grok-3") == "hi"
+        assert data["choices"][0]["delta"] == {"role": "assistant", "content": "hi"}
+        assert data["choices"][0]["index"] == 0
+        assert data["object"] == "chat.completion.chunk"
+        assert data["model"] == "grok-3"
+        assert data["id"].startswith("chatcmpl-")
+
+def test_normalize_grok_chunk_keeps_existing_fields():
+    data = {"id": "x", "model": "m", "choices": [{"index": 1, "delta": {"role": "assistant", "content": None}}]}
+    assert normalize_grok_chunk(data, "grok-3") == ""
+    assert data["id"] == "x" and data["model"] == "m"
+    assert data["choices"][0]["index"] == 1
+
+    empty = {}
+    assert normalize_grok_chunk(empty, "grok-3") == ""
+    assert empty["choices"][0]["delta"] == {"role": "assistant", "content": ""}
+
+def test_delta_content():
+    assert delta_content({"choices": [{"delta": {"content": "hi"}}]}) == "hi"
+    assert delta_content({"choices": [{"delta": {"role": "assistant"}}]}) == ""
+    assert delta_content({"choices": [], "usage": {"completion_tokens": 3}}) == ""
+    assert delta_content({"choices": [{"delta": "raw"}]}) == ""
+
+def test_completion_accumulator_counts_per_chunk():
+    completion = CompletionAccumulator(len)
+    for word in ["Hello", " ", "world"]:
+        completion.feed({"choices": [{"delta": {"content": word}}]})
+    completion.feed({"choices": [{"delta": {}, "finish_reason": "stop"}]})
+    assert completion.parts == ["Hello", " ", "world"]
+    assert completion.text == "Hello world"
+    assert completion.completion_tokens == 11
+    assert completion.prompt_tokens is None
+
+def test_completion_accumulator_prefers_upstream_usage():
+    completion = CompletionAccumulator(len)
+    completion.feed({"choices": [{"delta": {"content": "Hello"}}]})
+    completion.feed({"choices": [], "usage": {"prompt_tokens": 7, "completion_tokens": 2}})
+    assert completion.completion_tokens == 2
+    assert completion.prompt_tokens == 7
+    # 缺少 completion_tokens 的 usage 不采用
+    other = CompletionAccumulator(len)
+    other.add("abc")
+    other.observe_usage({"usage": {"total_tokens": 9}})
+    assert other.completion_tokens == 3
@@ -0,0 +1,39 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from chunker import chunk_text, split_sentences
+from my_tokenizer import estimate_tokens
+
+def test_split_sentences_cjk_and_latin():
+    text = "第一句。第二句！“引号。”\n\n Dr. Smith arrived. Is it 3.14? Yes"
+    sentences = split_sentences(text)
+    assert "".join(sentences) == text
+    assert sentences[:3] == ["第一句。", "第二句！", "“引号。”\n\n "]
+    assert "Is it 3.14? " in sentences and sentences[-1] == "Yes"
+
+def test_chunks_respect_token_budget_and_overlap():
+    sentences = [f"这是第{i:02d}个句子。" for i in range(40)]
+    chunks = chunk_text("".join(sentences), chunk_tokens=40, overlap_tokens=10, counter=estimate_tokens)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 40 for chunk in chunks)
+    # 相邻文本块以完整句子重叠，且覆盖全部句子
+    for previous, current in zip(chunks, chunks[1:]):
+        first = current[:current.index("。") + 1]
+        assert previous.endswith(first)
+    assert all(any(sentence in chunk for chunk in chunks) for sentence in sentences)
+
+def test_prefers_paragraph_boundary_and_splits_long_sentences():
+    text = "甲" * 20 + "。\n\n" + "乙" * 10 + "。" + "丙" * 15 + "。"
+    chunks = chunk_text(text, chunk_tokens=40, overlap_tokens=5, counter=estimate_tokens)
+    assert chunks[0] == "甲" * 20 + "。"
+
+    long_text = "字" * 100 + " " + "word " * 30
+    chunks = chunk_text(long_text, chunk_tokens=16, overlap_tokens=0, counter=estimate_tokens)
+    assert all(estimate_tokens(chunk) <= 16 for chunk in chunks)
+    assert "".join(chunks).replace(" ", "") == long_text.replace(" ", "")
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        chunk_text("x", chunk_tokens=10, overlap_tokens=10)
+    assert chunk_text("   \n ") == []
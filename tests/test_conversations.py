@@ -0,0 +1,56 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from conversations import Conversation, ConversationStore
+
+def make_conversation(*tokens):
+    conversation = Conversation("c")
+    for index, count in enumerate(tokens):
+        conversation.append("user" if index % 2 == 0 else "assistant", f"m{index}", count)
+    return conversation
+
+def test_context_keeps_recent_messages_within_budget():
+    conversation = make_conversation(10, 10, 10, 10, 10)
+    assert [m.content for m in conversation.context(100)] == ["m0", "m1", "m2", "m3", "m4"]
+    # 预算 30 能放下最后三条，且以用户消息开头
+    assert [m.content for m in conversation.context(30)] == ["m2", "m3", "m4"]
+    # 截断后以 assistant 开头时去掉它
+    assert [m.content for m in conversation.context(20)] == ["m4"]
+
+def test_context_always_keeps_latest_message():
+    conversation = make_conversation(10, 10, 500)
+    assert [m.content for m in conversation.context(100)] == ["m2"]
+
+@pytest.mark.asyncio
+async def test_store_loads_history_and_evicts_least_recent():
+    loaded = []
+
+    async def loader(conversation_id):
+        loaded.append(conversation_id)
+        if conversation_id == "old":
+            return [{"role": "user", "content": "你好", "tokens_count": 2},
+                    {"role": "assistant", "content": "你好！", "tokens_count": 3}]
+        return []
+
+    store = ConversationStore(loader, max_conversations=2)
+    old = await store.get("old")
+    assert [(m.role, m.tokens) for m in old.messages] == [("user", 2), ("assistant", 3)]
+
+    await store.get("a")
+    assert await store.get("old") is old  # 命中缓存，不再加载
+    await store.get("b")                  # 淘汰最久未使用的 a
+    assert "a" not in store and "old" in store and len(store) == 2
+    assert loaded == ["old", "a", "b"]
+
+    await store.get("a")
+    assert loaded[-1] == "a"
+
+@pytest.mark.asyncio
+async def test_store_survives_loader_errors():
+    async def loader(conversation_id):
+        raise RuntimeError("db locked")
+
+    store = ConversationStore(loader)
+    conversation = await store.get("x")
+    assert conversation.messages == []
@@ -0,0 +1,71 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hashlib
+import pytest
+from corpus import DocumentCorpus, content_hash
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [self.vector(text) for text in texts]
+
+    @staticmethod
+    def vector(text):
+        digest = hashlib.sha256(text.encode()).digest()
+        return [b - 128.0 for b in digest[:16]]
+
+def test_content_hash_ignores_whitespace():
+    assert content_hash("a  b\nc") == content_hash(" a b c ")
+    assert content_hash("a b") != content_hash("ab")
+
+@pytest.mark.asyncio
+async def test_incremental_ingest_and_dedup(tmp_path):
+    embed = FakeEmbedder()
+    corpus = DocumentCorpus(tmp_path / "c", "bge-m3")
+    stats = await corpus.add_document("a.pdf", [{"text": "一", "page": 1}, {"text": "二", "page": 1}, "三"], embed)
+    assert stats["embedded"] == 3
+    # 另一个文档中的相同文本块不再嵌入
+    stats = await corpus.add_document("b.pdf", ["三", "四"], embed)
+    assert stats["embedded"] == 1 and stats["reused"] == 1
+    corpus.save()
+    assert len(corpus) == 4
+
+    # 重新打开后修改文档：只嵌入变化的文本块
+    corpus = DocumentCorpus(tmp_path / "c", "bge-m3")
+    assert "a.pdf" in corpus and len(corpus) == 4
+    stats = await corpus.add_document("a.pdf", ["一", "二（修订）", "三"], embed)
+    assert embed.calls[-1] == ["二（修订）"]
+    assert stats["orphaned"] == 1
+    corpus.save()
+    assert len(corpus) == 4  # "二" 被清理
+
+    hits = corpus.search(FakeEmbedder.vector("三"), k=2)
+    assert hits[0]["text"] == "三"
+    assert hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert sorted(hits[0]["documents"]) == ["a.pdf", "b.pdf"]
+    assert corpus.documents["a.pdf"]["chunks"][0] == {"hash": content_hash("一")}
+
+@pytest.mark.asyncio
+async def test_remove_document_and_model_mismatch(tmp_path):
+    embed = FakeEmbedder()
+    corpus = DocumentCorpus(tmp_path / "c", "bge-m3")
+    await corpus.add_document("a", ["x", "shared"], embed)
+    await corpus.add_document("b", ["shared"], embed)
+    corpus.save()
+
+    assert corpus.remove_document("a")
+    assert not corpus.remove_document("missing")
+    corpus.save()
+    assert len(corpus) == 1
+    assert [hit["text"] for hit in corpus.search(FakeEmbedder.vector("x"), k=5)] == ["shared"]
+
+    corpus.remove_document("b")
+    corpus.save()
+    assert len(corpus) == 0 and corpus.search(FakeEmbedder.vector("x")) == []
+
+    with pytest.raises(ValueError):
+        DocumentCorpus(tmp_path / "c", "text-embedding-3-small")
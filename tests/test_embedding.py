@@ -0,0 +1,135 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import hashlib
+import json
+import time
+import httpx
+import pytest
+import pdf_pipeline
+from embedding import AsyncPDFEmbedding
+
+def vector(text):
+    digest = hashlib.sha256(text.encode()).digest()
+    return [b - 128.0 for b in digest[:16]]
+
+class FakeUpstream:
+    """嵌入接口返回哈希向量；聊天接口延迟 delay 秒后把上下文原样返回"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.embedded = []
+
+    async def __call__(self, request):
+        body = json.loads(request.content)
+        if request.url.path.endswith("/embeddings"):
+            self.embedded.append(list(body["input"]))
+            return httpx.Response(200, json={"data": [{"index": i, "embedding": vector(text)}
+                                                      for i, text in enumerate(body["input"])]})
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+        return httpx.Response(200, json={"choices": [{"message": {"content": body["messages"][-1]["content"]}}]})
+
+class FakePage:
+    def __init__(self, text):
+        self.text = text
+
+    def extract_text(self):
+        return self.text
+
+def make_processor(upstream):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    return AsyncPDFEmbedding("http://up/v1/embeddings", "k", "http://up/v1/chat/completions", "k",
+                             "bge-m3", "chat", client=client, chunk_tokens=8, overlap_tokens=0)
+
+@pytest.mark.asyncio
+async def test_async_ingest_and_concurrent_answers(tmp_path, monkeypatch):
+    pages = ["苹果是一种水果。", "香蕉是黄色的。", "汽车有四个轮子。"]
+    monkeypatch.setattr(pdf_pipeline, "_open_reader", lambda path: type("R", (), {"pages": [FakePage(t) for t in pages]})())
+    upstream = FakeUpstream(delay=0.05)
+    processor = make_processor(upstream)
+    await processor.open_corpus(str(tmp_path / "corpus"))
+    stats = await processor.add_pdf("docs/fruit.pdf")
+    assert stats["document"] == "fruit.pdf" and stats["embedded"] == 3
+
+    # 问题与某个文本块相同时该文本块排第一
+    answers = await asyncio.gather(*(processor.answer_question(text) for text in pages * 3))
+    for text, answer in zip(pages * 3, answers):
+        assert answer.startswith(f"上下文信息：\n{text}")
+    assert upstream.max_active > 1
+
+    assert await processor.remove_document("fruit.pdf")
+    assert await processor.find_relevant_chunks(vector("苹果是一种水果。")) == []
+    await processor.client.aclose()
+
+@pytest.mark.asyncio
+async def test_search_waits_for_store_replacement(tmp_path):
+    processor = make_processor(FakeUpstream())
+    await processor.open_corpus(str(tmp_path / "corpus"))
+    order = []
+    original = processor._commit_corpus
+
+    def slow_commit():
+        order.append("commit-start")
+        time.sleep(0.1)
+        original()
+        order.append("commit-end")
+
+    processor._commit_corpus = slow_commit
+    processor.corpus.documents["x"] = {"source": None, "updated_at": "", "chunks": []}
+    removal = asyncio.create_task(processor.remove_document("x"))
+    await asyncio.sleep(0.02)
+
+    async def search():
+        result = await processor.find_relevant_chunks(vector("a"))
+        order.append("search")
+        return result
+
+    assert await search() == []
+    await removal
+    assert order == ["commit-start", "commit-end", "search"]
+    await processor.client.aclose()
+
+@pytest.mark.asyncio
+async def test_cached_and_batched_retrieval(tmp_path):
+    upstream = FakeUpstream()
+    processor = make_processor(upstream)
+    await processor.open_corpus(str(tmp_path / "corpus"))
+    texts = [f"第{i}条" for i in range(50)]
+    await processor.corpus.add_document("doc", texts, processor.embedding_client().embed)
+    await processor._replace(processor._commit_corpus)
+    upstream.embedded.clear()
+
+    await processor.get_question_embedding("第3条")
+    assert await processor.get_question_embedding(" 第3条 ") == vector("第3条")
+    assert upstream.embedded == [["第3条"]]
+
+    # 批量检索：缓存中已有的问题和重复的问题不再请求，其余一次批量请求
+    questions = texts[:20] + ["第3条", "第7条"]
+    results = await processor.retrieve(questions, top_k=2)
+    assert upstream.embedded[1:] == [[text for text in texts[:20] if text != "第3条"]]
+    assert [hits[0][0] for hits in results] == questions
+    assert all(len(hits) == 2 for hits in results)
+    await processor.client.aclose()
+
+@pytest.mark.asyncio
+async def test_lexical_retrieval_skips_embeddings(tmp_path):
+    upstream = FakeUpstream()
+    processor = make_processor(upstream)
+    await processor.open_corpus(str(tmp_path / "corpus"))
+    texts = ["超时返回 ERR_CONN-502", "密钥无效返回 ERR_AUTH-401", "重试使用指数退避"]
+    await processor.corpus.add_document("doc", texts, processor.embedding_client().embed)
+    await processor._replace(processor._commit_corpus)
+    upstream.embedded.clear()
+
+    results = await processor.retrieve(["ERR_AUTH-401 是什么", "指数退避"], top_k=1, mode="lexical")
+    assert [hits[0][0] for hits in results] == [texts[1], texts[2]]
+    assert upstream.embedded == []
+    hits = await processor.find_relevant_chunks(vector("x"), top_k=3, question="ERR_CONN-502")
+    assert texts[0] in [text for text, _ in hits]
+    await processor.client.aclose()
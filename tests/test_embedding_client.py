@@ -0,0 +1,89 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import json
+import httpx
+import pytest
+from embedding_client import EmbeddingAPIError, EmbeddingCache, EmbeddingClient, make_batches
+
+def vector_for(text):
+    return [float(len(text)), float(sum(map(ord, text)) % 97)]
+
+def make_client(handler, **kwargs):
+    transport = httpx.MockTransport(handler)
+    client = httpx.AsyncClient(transport=transport)
+    return EmbeddingClient("https://up.example.com/v1/embeddings", "k", "bge-m3",
+                           backoff=0, client=client, **kwargs)
+
+def test_make_batches_by_count_and_tokens():
+    texts = ["a" * 4] * 5
+    assert make_batches(texts, batch_size=2, max_batch_tokens=100, counter=len) == [[0, 1], [2, 3], [4]]
+    assert make_batches(texts, batch_size=10, max_batch_tokens=9, counter=len) == [[0, 1], [2, 3], [4]]
+    # 单条超过预算的文本单独成组
+    assert make_batches(["x" * 50, "y"], batch_size=10, max_batch_tokens=10, counter=len) == [[0], [1]]
+
+@pytest.mark.asyncio
+async def test_embed_batches_requests_and_keeps_order():
+    requests = []
+    active = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal active, peak
+        body = json.loads(request.content)
+        requests.append(body["input"])
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        data = [{"index": i, "embedding": vector_for(text)} for i, text in enumerate(body["input"])]
+        # 上游可能乱序返回
+        return httpx.Response(200, json={"data": list(reversed(data))})
+
+    texts = [f"文本{i}" * (i % 3 + 1) for i in range(25)]
+    async with make_client(handler, batch_size=4, concurrency=2) as client:
+        vectors = await client.embed(texts)
+    assert vectors == [vector_for(text) for text in texts]
+    assert len(requests) == 7
+    assert all(len(batch) <= 4 for batch in requests)
+    assert peak <= 2
+
+@pytest.mark.asyncio
+async def test_embed_retries_on_429_and_5xx():
+    statuses = [429, 503, 200]
+
+    def handler(request):
+        status = statuses.pop(0)
+        if status != 200:
+            return httpx.Response(status, text="busy", headers={"Retry-After": "0"})
+        inputs = json.loads(request.content)["input"]
+        return httpx.Response(200, json={"data": [{"index": i, "embedding": [1.0]} for i in range(len(inputs))]})
+
+    async with make_client(handler) as client:
+        assert await client.embed(["a", "b"]) == [[1.0], [1.0]]
+    assert statuses == []
+
+@pytest.mark.asyncio
+async def test_embed_raises_on_client_error():
+    def handler(request):
+        return httpx.Response(400, text="bad input")
+
+    async with make_client(handler, max_retries=3) as client:
+        with pytest.raises(EmbeddingAPIError) as info:
+            await client.embed(["a"])
+    assert info.value.status_code == 400
+
+def test_embedding_cache_lru_and_normalization():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put("什么是  BM25？", [1.0])
+    assert cache.get(" 什么是 BM25? ") == [1.0]  # 空白和全角问号被规范化
+    cache.put("b", [2.0])
+    cache.put("c", [3.0])
+    assert cache.get("b") == [2.0] and cache.get("什么是 BM25？") is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    found, missing = cache.lookup(["b", "d", " d", "c", "e"])
+    assert set(found) == {"b", "c"} and missing == ["d", "e"]
+    vectors = cache.resolve(["b", "d", " d", "c", "e"], found, missing, [[4.0], [5.0]])
+    assert vectors == [[2.0], [4.0], [4.0], [3.0], [5.0]]
@@ -0,0 +1,46 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+import pytest
+from embedding_store import EmbeddingStore, normalize_rows
+
+@pytest.fixture
+def corpus():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 32)).astype(np.float32)
+    chunks = [{"text": f"第{i}块 text {i}", "page": i // 5} for i in range(50)]
+    return vectors, chunks
+
+def test_roundtrip_is_memory_mapped(tmp_path, corpus):
+    vectors, chunks = corpus
+    EmbeddingStore.save(tmp_path / "store", vectors, chunks, extra={"embedding_model": "bge-m3"})
+    store = EmbeddingStore.load(tmp_path / "store")
+    assert isinstance(store.vectors, np.memmap)
+    assert len(store) == 50 and store.dim == 32
+    assert store.meta["embedding_model"] == "bge-m3"
+    np.testing.assert_allclose(store.matrix(), normalize_rows(vectors), rtol=1e-6)
+    assert store.chunks[7] == chunks[7]
+    assert store.texts[-1] == chunks[-1]["text"]
+    assert store.texts[1:3] == [chunks[1]["text"], chunks[2]["text"]]
+    store.close()
+
+@pytest.mark.parametrize("dtype,atol,ratio", [("float16", 1e-3, 2), ("int8", 2e-2, 4)])
+def test_quantized_storage(tmp_path, corpus, dtype, atol, ratio):
+    vectors, chunks = corpus
+    full = EmbeddingStore.save(tmp_path / "f32", vectors, chunks)
+    small = EmbeddingStore.save(tmp_path / dtype, vectors, chunks, dtype=dtype)
+    assert small.dtype == dtype
+    np.testing.assert_allclose(small.matrix(), full.matrix(), atol=atol)
+    size_f32 = (tmp_path / "f32" / "vectors.npy").stat().st_size
+    size_small = (tmp_path / dtype / "vectors.npy").stat().st_size
+    assert size_small < size_f32 / ratio * 1.2
+
+def test_plain_text_chunks_and_mismatch(tmp_path):
+    store = EmbeddingStore.save(tmp_path / "s", [[3.0, 4.0], [0.0, 0.0]], ["a", "b"])
+    np.testing.assert_allclose(store.matrix(), [[0.6, 0.8], [0.0, 0.0]])
+    assert list(store.texts) == ["a", "b"]
+    with pytest.raises(ValueError):
+        EmbeddingStore.save(tmp_path / "bad", [[1.0, 0.0]], ["a", "b"])
+    with pytest.raises(ValueError):
+        EmbeddingStore.save(tmp_path / "bad", [[1.0, 0.0]], ["a"], dtype="int4")
@@ -0,0 +1,180 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import httpx
+import pytest
+from upstream_pool import UpstreamPool, build_upstream_url
+from health_checker import HealthChecker
+
+PROVIDERS = [
+    {"id": 1, "name": "healthy", "server_url": "https://healthy.example.com",
+     "server_key": "k1", "description": "", "models": ["gpt-4"]},
+    {"id": 2, "name": "broken", "server_url": "https://broken.example.com",
+     "server_key": "k2", "description": "", "models": ["gpt-4"]},
+    {"id": 3, "name": "no-models-endpoint", "server_url": "https://custom.example.com/api#",
+     "server_key": "k3", "description": "", "models": ["custom-model"]},
+]
+
+def stub_upstream(request: httpx.Request) -> httpx.Response:
+    """本地桩上游：healthy 正常，broken 返回 503，custom 只支持补全接口"""
+    host = request.url.host
+    if host == "healthy.example.com" and request.url.path == "/v1/models":
+        assert request.headers["Authorization"] == "Bearer k1"
+        return httpx.Response(200, json={"object": "list", "data": []})
+    if host == "broken.example.com":
+        return httpx.Response(503, text="Service Unavailable")
+    if host == "custom.example.com" and request.method == "POST":
+        return httpx.Response(200, json={"choices": [{"message": {"content": "p"}}]})
+    return httpx.Response(404)
+
+@pytest.fixture
+def checker():
+    pool = UpstreamPool(transport_factory=lambda proxy: httpx.MockTransport(stub_upstream))
+    return HealthChecker(pool, provider_loader=lambda: PROVIDERS, failure_threshold=2)
+
+def test_build_upstream_url():
+    assert build_upstream_url("https://a.com") == "https://a.com/v1/chat/completions"
+    assert build_upstream_url("https://a.com/api/") == "https://a.com/api/chat/completions"
+    assert build_upstream_url("https://a.com/api#") == "https://a.com/api#"
+    assert build_upstream_url("https://a.com", "models") == "https://a.com/v1/models"
+    assert build_upstream_url("https://a.com/api#", "models") is None
+
+@pytest.mark.asyncio
+async def test_check_all_marks_states(checker):
+    await checker.check_all()
+    await checker.check_all()
+    snapshot = checker.snapshot()
+
+    assert snapshot[1]["available"] is True
+    assert snapshot[1]["latency_ms"] is not None
+    assert snapshot[2]["available"] is False
+    assert snapshot[2]["last_error"] == "HTTP 503"
+    # '#' 结尾的地址没有 /models，退化为补全探测
+    assert snapshot[3]["available"] is True
+
+@pytest.mark.asyncio
+async def test_pick_provider_prefers_available(checker):
+    await checker.check_all()
+    await checker.check_all()
+    assert checker.pick_provider([2, 1]) == 1
+    assert checker.pick_provider([2]) == 2
+    assert checker.pick_provider([]) is None
+
+def test_success_resets_failures(checker):
+    checker.record_failure(5, "timeout")
+    checker.record_failure(5, "timeout")
+    assert not checker.is_available(5)
+    checker.record_success(5, 12.0)
+    assert checker.is_available(5)
+    assert checker.states[5].latency_ms == 12.0
+
+@pytest.mark.asyncio
+async def test_removed_providers_are_dropped(checker):
+    await checker.check_all()
+    checker.provider_loader = lambda: PROVIDERS[:1]
+    await checker.check_all()
+    assert list(checker.snapshot()) == [1]
+
+def test_availability_change_notifies_and_snapshot_round_trips(checker):
+    import json
+    published = []
+    checker.on_change = published.append
+    checker.record_failure(5, "timeout")
+    checker.record_failure(5, "timeout")
+    assert len(published) == 1
+    checker.record_success(5, 8.0)
+    assert len(published) == 2
+
+    assert published[0]["provider_id"] == 5 and "latency_ms" not in published[0]
+
+    other = HealthChecker(checker.pool, provider_loader=lambda: [])
+    other.load_snapshot(json.loads(json.dumps(checker.snapshot())))
+    assert other.is_available(5)
+    assert other.states[5].latency_ms == 8.0
+    # 快照中已有之后的恢复，较早的熔断不再生效
+    other.apply_breaker_states(json.loads(json.dumps(published[:1])))
+    assert other.is_available(5)
+
+    fresh = HealthChecker(checker.pool, provider_loader=lambda: [])
+    fresh.apply_breaker_states(json.loads(json.dumps(published[:1])))
+    assert not fresh.is_available(5)
+    assert fresh.states[5].last_error == "timeout"
+
+def test_breaker_changes_merge_per_provider(checker):
+    worker_a = HealthChecker(checker.pool, provider_loader=lambda: [], failure_threshold=1)
+    worker_b = HealthChecker(checker.pool, provider_loader=lambda: [], failure_threshold=1)
+    published = {}
+    worker_a.on_change = worker_b.on_change = lambda change: published.__setitem__(change["provider_id"], change)
+    worker_b.record_success(2, 300.0)
+    # 两个进程几乎同时熔断不同的提供商，合并后两者都不可用
+    worker_a.record_failure(1, "timeout")
+    worker_b.record_failure(2, "HTTP 500")
+    for worker in (worker_a, worker_b):
+        worker.apply_breaker_states(published.values())
+        assert not worker.is_available(1) and not worker.is_available(2)
+    # 其他进程的延迟不会覆盖本进程的
+    assert worker_b.states[2].latency_ms == 300.0 and worker_a.states[2].latency_ms is None
+
+    # 旧的快照不会覆盖之后发生的熔断
+    snapshot = {1: {"provider_id": 1, "available": True, "changed_at": 0.0}}
+    worker_a.load_snapshot(snapshot)
+    assert not worker_a.is_available(1)
+
+def model_row(provider_id, model_name, success=True, ttft_ms=None):
+    return (provider_id, model_name, int(success), 1, ttft_ms, 30.0, 1.0,
+            None if success else "HTTP 500", "2025-01-01T00:00:00")
+
+def test_pick_provider_uses_model_health(checker):
+    checker.record_success(1, 50.0)
+    checker.record_success(2, 10.0)
+    checker.record_success(3, 20.0)
+    checker.load_model_health([
+        model_row(1, "gpt-4", ttft_ms=300.0),
+        model_row(2, "gpt-4", success=False),
+        model_row(3, "gpt-4", ttft_ms=120.0),
+    ])
+    # 巡检失败的排在后面，其余按首 token 延迟
+    assert checker.pick_provider([1, 2, 3], "gpt-4") == 3
+    assert checker.pick_provider([1, 2], "gpt-4") == 1
+    # 没有巡检结果的模型按探测延迟
+    assert checker.pick_provider([1, 2, 3], "other") == 2
+    assert checker.pick_provider([1, 2, 3]) == 2
+
+@pytest.mark.asyncio
+async def test_check_all_loads_model_health_into_snapshot(checker):
+    import json
+    checker.model_health_loader = lambda: [model_row(1, "gpt-4", ttft_ms=80.0)]
+    snapshot = await checker.check_all()
+    assert snapshot[1]["models"]["gpt-4"]["ttft_ms"] == 80.0
+
+    other = HealthChecker(checker.pool, provider_loader=lambda: [])
+    other.load_snapshot(json.loads(json.dumps(snapshot)))
+    assert other.states[1].models["gpt-4"]["success"] is True
+
+@pytest.mark.asyncio
+async def test_malformed_url_does_not_abort_sweep(checker):
+    checker.provider_loader = lambda: PROVIDERS + [
+        {"id": 4, "name": "bad", "server_url": "http://[::1", "server_key": "k4",
+         "description": "", "models": ["gpt-4"]}]
+    checker.failure_threshold = 1
+    snapshot = await checker.check_all()
+    assert snapshot[1]["available"] is True
+    assert snapshot[4]["available"] is False
+    assert snapshot[4]["last_error"].startswith("InvalidURL")
+
+@pytest.mark.asyncio
+async def test_warm_up_connects_to_every_provider():
+    seen = []
+
+    def upstream(request):
+        seen.append((request.url.host, request.headers["Authorization"]))
+        return stub_upstream(request)
+
+    pool = UpstreamPool(transport_factory=lambda proxy: httpx.MockTransport(upstream))
+    checker = HealthChecker(pool, provider_loader=lambda: PROVIDERS)
+    # 任何 HTTP 响应（包括 503、404）都说明连接已建立
+    assert await checker.warm_up() == 3
+    assert sorted(seen) == [("broken.example.com", "Bearer k2"), ("custom.example.com", "Bearer k3"),
+                            ("healthy.example.com", "Bearer k1")]
+    # 预热不计入健康状态
+    assert checker.snapshot() == {}
@@ -0,0 +1,87 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hashlib
+import numpy as np
+import pytest
+from corpus import DocumentCorpus
+from lexical_index import BM25Index, fused_search, reciprocal_rank_fusion, tokenize
+from vector_index import ExactIndex
+
+def vector(text):
+    digest = hashlib.sha256(text.encode()).digest()
+    return [b - 128.0 for b in digest[:16]]
+
+async def embed(texts):
+    return [vector(text) for text in texts]
+
+TEXTS = [
+    "连接上游服务超时，返回错误码 ERR_CONN-502，请检查网络。",
+    "The gateway retries failed requests with exponential backoff.",
+    "向量检索使用余弦相似度，适合语义相近的问题。",
+    "错误码 ERR_AUTH-401 表示密钥无效。",
+]
+
+def test_tokenize_cjk_bigrams_and_identifiers():
+    assert tokenize("向量检索") == ["向量", "量检", "检索"]
+    assert tokenize("是 A") == ["是", "a"]
+    # 全角字符规范化；标识符保留整体和各部分
+    assert tokenize("ＥＲＲ_CONN-502") == ["err_conn-502", "err", "conn", "502"]
+    assert tokenize("v1.2.3 ok") == ["v1.2.3", "v1", "2", "3", "ok"]
+
+def test_bm25_ranks_exact_match_first():
+    index = BM25Index.build(TEXTS)
+    ids, scores = index.search("ERR_CONN-502 是什么", k=3)
+    assert ids[0] == 0
+    assert list(scores) == sorted(scores, reverse=True)
+    # 只返回命中词项的文本块
+    ids, _ = index.search("backoff", k=3)
+    assert list(ids) == [1]
+    ids, scores = index.search("zzz", k=3)
+    assert len(ids) == 0 and len(scores) == 0
+
+def test_save_and_load_roundtrip(tmp_path):
+    index = BM25Index.build(TEXTS)
+    index.save(tmp_path / "lexical")
+    loaded = BM25Index.load(tmp_path / "lexical")
+    assert loaded.terms == index.terms
+    assert isinstance(loaded.doc_ids, np.memmap)
+    for query in ["密钥无效", "gateway retries", "错误码"]:
+        np.testing.assert_allclose(loaded.scores(query), index.scores(query))
+
+def test_reciprocal_rank_fusion():
+    ids, scores = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=2, rrf_k=60)
+    assert list(ids) == [1, 3]
+    assert scores[0] == pytest.approx(1 / 61 + 1 / 62)
+    ids, _ = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=1, weights=[0.1, 1.0])
+    assert list(ids) == [3]
+
+def test_fused_search_modes():
+    vectors = np.asarray([vector(text) for text in TEXTS], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index, lexical = ExactIndex(vectors), BM25Index.build(TEXTS)
+    query = [vector("ERR_AUTH-401")]
+    ((ids, _),) = fused_search(index, lexical, None, ["ERR_AUTH-401"], 2, mode="lexical")
+    assert ids[0] == 3
+    ((ids, _),) = fused_search(index, lexical, query, ["ERR_AUTH-401"], 2, mode="hybrid")
+    assert 3 in ids
+    with pytest.raises(ValueError):
+        fused_search(index, lexical, query, None, 2, mode="hybrid")
+    with pytest.raises(ValueError):
+        fused_search(index, lexical, query, ["x"], 2, mode="bm25")
+
+@pytest.mark.asyncio
+async def test_corpus_hybrid_search_finds_identifier(tmp_path):
+    corpus = DocumentCorpus(tmp_path / "c", "bge-m3")
+    await corpus.add_document("a.pdf", TEXTS + [f"第{i}条说明" for i in range(30)], embed)
+    corpus.save()
+    assert (tmp_path / "c" / "store" / "lexical" / "lexical.json").exists()
+
+    # 哈希向量与问题无关，向量检索找不到错误码所在的文本块，混合检索可以
+    question = "ERR_CONN-502 怎么处理"
+    corpus = DocumentCorpus(tmp_path / "c", "bge-m3")
+    assert TEXTS[0] not in [hit["text"] for hit in corpus.search(vector(question), k=3)]
+    hits = {hit["text"]: hit for hit in corpus.search(vector(question), k=3, query_text=question)}
+    assert hits[TEXTS[0]]["documents"] == ["a.pdf"]
+    hits = corpus.search(None, k=3, query_text=question, mode="lexical")
+    assert hits[0]["text"] == TEXTS[0]
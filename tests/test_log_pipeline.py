@@ -0,0 +1,62 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import logging
+from log_pipeline import (BackgroundQueueHandler, JsonFormatter, SamplingFilter,
+                          parse_levels, parse_rates)
+
+def make_record(name="nexusai.stream", level=logging.INFO, msg="chunk %s", args=("a",), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+def test_json_formatter_includes_extra_fields():
+    line = JsonFormatter().format(make_record(conversation_id="c1", prompt_tokens=3))
+    data = json.loads(line)
+    assert data["msg"] == "chunk a"
+    assert data["logger"] == "nexusai.stream"
+    assert data["conversation_id"] == "c1"
+    assert data["prompt_tokens"] == 3
+
+def test_sampling_filter_by_category():
+    sampler = SamplingFilter({"nexusai.stream": 0.0, "nexusai.stream.grok": 1.0})
+    assert not sampler.filter(make_record("nexusai.stream"))
+    assert sampler.filter(make_record("nexusai.stream.grok"))
+    assert sampler.filter(make_record("nexusai.request"))
+    # 警告及以上不采样
+    assert sampler.filter(make_record("nexusai.stream", logging.WARNING))
+    assert SamplingFilter({"nexusai.stream": 0.5}).rate_for("nexusai.streaming") == 1.0
+
+def test_background_handler_writes_in_listener_thread(tmp_path):
+    log_file = tmp_path / "test.log"
+    file_handler = logging.FileHandler(log_file, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    handler = BackgroundQueueHandler([file_handler])
+    logger = logging.getLogger("nexusai.test_pipeline")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    try:
+        payload = {"content": "hello"}
+        logger.info("请求体: %s", payload)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("失败")
+    finally:
+        handler.stop()
+        logger.removeHandler(handler)
+        file_handler.close()
+
+    lines = [json.loads(line) for line in log_file.read_text(encoding="utf-8").splitlines()]
+    assert lines[0]["msg"] == "请求体: {'content': 'hello'}"
+    assert lines[1]["level"] == "ERROR"
+    assert "ValueError: boom" in lines[1]["exc"]
+
+def test_parse_config():
+    assert parse_levels("nexusai.stream=debug, nexusai.health=WARNING") == {
+        "nexusai.stream": logging.DEBUG, "nexusai.health": logging.WARNING
+    }
+    assert parse_rates("nexusai.stream=0.01") == {"nexusai.stream": 0.01}
+    assert parse_levels("") == {}
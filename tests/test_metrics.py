@@ -0,0 +1,57 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import pytest
+from metrics import MetricsRegistry, merge_dumps, render
+
+def test_counter_and_gauge_render():
+    registry = MetricsRegistry()
+    requests = registry.counter("test_requests_total", "请求数", ["mode"])
+    requests.inc(mode="stream")
+    requests.inc(2, mode="stream")
+    pending = registry.gauge("test_pending", "进行中")
+    pending.inc()
+    pending.inc()
+    pending.dec()
+    text = render(registry.dump())
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{mode="stream"} 3' in text
+    assert "test_pending 1" in text
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_seconds", "耗时", ["provider"], buckets=(0.1, 1.0))
+    latency.observe(0.05, provider=1)
+    latency.observe(0.5, provider=1)
+    latency.observe(5, provider=1)
+    text = render(registry.dump())
+    assert 'test_seconds_bucket{provider="1",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{provider="1",le="1"} 2' in text
+    assert 'test_seconds_bucket{provider="1",le="+Inf"} 3' in text
+    assert 'test_seconds_count{provider="1"} 3' in text
+    assert latency.get(provider=1) == (pytest.approx(5.55), 3)
+
+def test_merge_dumps_from_workers():
+    worker_a, worker_b = MetricsRegistry(), MetricsRegistry()
+    for registry, value in ((worker_a, 0.05), (worker_b, 0.5)):
+        registry.counter("test_total", "计数", ["type"]).inc(type="timeout")
+        registry.histogram("test_seconds", "耗时", buckets=(0.1, 1.0)).observe(value)
+    worker_b.counter("test_total", "计数", ["type"]).inc(type="stream")
+
+    # 快照经过 JSON 往返（与共享状态中的存储方式一致）
+    merged = merge_dumps(json.loads(json.dumps(r.dump())) for r in (worker_a, worker_b))
+    text = render(merged)
+    assert 'test_total{type="timeout"} 2' in text
+    assert 'test_total{type="stream"} 1' in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1"} 2' in text
+    assert "test_seconds_count 2" in text
+
+def test_label_values_are_escaped_and_types_checked():
+    registry = MetricsRegistry()
+    registry.counter("test_total", "计数", ["model"]).inc(model='a"b\\c')
+    assert 'model="a\\"b\\\\c"' in render(registry.dump())
+    assert registry.counter("test_total", "计数", ["model"]) is registry.metrics["test_total"]
+    with pytest.raises(ValueError):
+        registry.gauge("test_total", "计数")
@@ -0,0 +1,58 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hashlib
+import pytest
+import pdf_pipeline
+from pdf_pipeline import abatches, iter_chunks, iter_pages
+from corpus import DocumentCorpus
+
+class FakePage:
+    def __init__(self, text):
+        self.text = text
+
+    def extract_text(self):
+        return self.text
+
+class FakeReader:
+    def __init__(self, texts):
+        self.pages = [FakePage(text) for text in texts]
+
+async def fake_embed(texts):
+    return [[b - 128.0 for b in hashlib.sha256(text.encode()).digest()[:8]] for text in texts]
+
+def test_iter_pages_and_chunks(monkeypatch):
+    monkeypatch.setattr(pdf_pipeline, "_open_reader", lambda path: FakeReader(["a b c", None, "  ", "d e"]))
+    pages = list(iter_pages("fake.pdf"))
+    assert pages == [(1, "a b c"), (2, ""), (3, "  "), (4, "d e")]
+
+    chunks = list(iter_chunks(pages, lambda text: text.split()))
+    assert chunks == [{"text": "a", "page": 1}, {"text": "b", "page": 1}, {"text": "c", "page": 1},
+                      {"text": "d", "page": 4}, {"text": "e", "page": 4}]
+
+@pytest.mark.asyncio
+async def test_abatches_order_and_errors():
+    batches = [batch async for batch in abatches(range(10), 4)]
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+    def broken():
+        yield 1
+        raise RuntimeError("提取失败")
+
+    with pytest.raises(RuntimeError):
+        async for _ in abatches(broken(), 1):
+            pass
+
+@pytest.mark.asyncio
+async def test_streaming_ingest_keeps_pages(tmp_path):
+    pages = ((page, f"第{page}页 内容") for page in range(1, 21))
+    corpus = DocumentCorpus(tmp_path / "c", "bge-m3")
+    stats = await corpus.add_document("doc", iter_chunks(pages, lambda text: text.split()), fake_embed,
+                                      batch_size=3, concurrency=2)
+    # "内容" 在每页重复，只嵌入一次
+    assert stats["chunks"] == 40 and stats["embedded"] == 21
+    corpus.save()
+    entries = corpus.documents["doc"]["chunks"]
+    assert [entry["page"] for entry in entries[:4]] == [1, 1, 2, 2]
+    hit = corpus.search((await fake_embed(["第7页"]))[0], k=1)[0]
+    assert hit["text"] == "第7页"
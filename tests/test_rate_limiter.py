@@ -0,0 +1,107 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from rate_limiter import RateLimiter, MemoryBucketStore, SQLiteBucketStore
+
+def limits_loader():
+    return [
+        ("key", "user-key", 2, 100, 0),
+        ("key", "quota-key", 0, 0, 50),
+        ("provider", "7", 0, 0, 0),
+    ]
+
+def test_bucket_refills_over_time():
+    store = MemoryBucketStore()
+    request = [("k:rpm", 2, 2 / 60.0, 1)]
+    assert store.acquire(request, now=0)[0][0]
+    assert store.acquire(request, now=0)[0][0]
+    allowed, remaining, wait = store.acquire(request, now=0)[0]
+    assert not allowed
+    assert wait == pytest.approx(30.0)
+    # 30 秒后补充 1 个令牌
+    assert store.acquire(request, now=30)[0][0]
+
+def test_acquire_is_all_or_nothing():
+    store = MemoryBucketStore()
+    rpm = ("k:rpm", 10, 10 / 60.0, 1)
+    tpm = ("k:tpm", 100, 100 / 60.0, 80)
+    assert store.acquire([rpm, tpm], now=0)[0][0]
+    results = store.acquire([rpm, tpm], now=0)
+    assert not results[0][0]
+    # 被拒绝时 rpm 桶不应被扣减
+    assert results[0][1] == pytest.approx(9)
+
+def test_oversized_cost_allowed_when_bucket_full():
+    store = MemoryBucketStore()
+    allowed, remaining, _ = store.acquire([("k:tpm", 100, 100 / 60.0, 150)], now=0)[0]
+    assert allowed
+    assert remaining == -50
+
+def test_sqlite_store_shared_between_instances(tmp_path):
+    db_path = tmp_path / "ratelimit.db"
+    worker_a = SQLiteBucketStore(db_path)
+    worker_b = SQLiteBucketStore(db_path)
+    request = [("k:rpm", 1, 1 / 60.0, 1)]
+    assert worker_a.acquire(request, now=100)[0][0]
+    assert not worker_b.acquire(request, now=100)[0][0]
+    assert worker_a.incr_daily("quota", 5) == 5
+    assert worker_b.incr_daily("quota", 3) == 8
+
+@pytest.mark.asyncio
+async def test_check_returns_429_headers():
+    limiter = RateLimiter(limits_loader=limits_loader)
+    assert (await limiter.check("user-key", 7, 10)).allowed
+    assert (await limiter.check("user-key", 7, 10)).allowed
+    result = await limiter.check("user-key", 7, 10)
+    assert not result.allowed
+    headers = result.headers()
+    assert headers["X-RateLimit-Limit-Requests"] == "2"
+    assert headers["X-RateLimit-Remaining-Requests"] == "0"
+    assert int(headers["Retry-After"]) >= 1
+    assert result.error_body()["error"]["code"] == 429
+
+@pytest.mark.asyncio
+async def test_daily_quota_fed_by_usage():
+    limiter = RateLimiter(limits_loader=limits_loader)
+    assert (await limiter.check("quota-key", 7, 10)).allowed
+    await limiter.record_usage("quota-key", 7, "gpt-4", 30, is_prompt=True)
+    await limiter.record_usage("quota-key", 7, "gpt-4", 25, is_prompt=False)
+    result = await limiter.check("quota-key", 7, 10)
+    assert not result.allowed
+    assert (await limiter.get_usage("quota-key"))["daily_tokens_used"] == 55
+
+@pytest.mark.asyncio
+async def test_completion_tokens_charge_tpm():
+    limiter = RateLimiter(limits_loader=limits_loader)
+    assert (await limiter.check("user-key", 7, 10)).allowed
+    await limiter.record_usage("user-key", 7, "gpt-4", 200, is_prompt=False)
+    result = await limiter.check("user-key", 7, 10)
+    assert not result.allowed
+    assert "tpm" in result.reason
+
+@pytest.mark.asyncio
+async def test_unconfigured_key_is_unlimited():
+    limiter = RateLimiter(limits_loader=limits_loader)
+    for _ in range(1000):
+        result = await limiter.check("other-key", 7, 10)
+        assert result.allowed and result.headers() == {}
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+async def test_refund_restores_quota(tmp_path, backend):
+    store = MemoryBucketStore() if backend == "memory" else SQLiteBucketStore(tmp_path / "ratelimit.db")
+    limiter = RateLimiter(store, limits_loader=limits_loader)
+    assert (await limiter.check("user-key", 7, 10)).allowed
+    assert (await limiter.check("user-key", 7, 10)).allowed
+    # 例如被准入控制拒绝：退还后可以再次通过
+    await limiter.refund("user-key", 7, 10)
+    assert (await limiter.check("user-key", 7, 10)).allowed
+    assert not (await limiter.check("user-key", 7, 10)).allowed
+    # 退还不会超过桶的容量
+    await limiter.refund("user-key", 7, 10)
+    await limiter.refund("user-key", 7, 10)
+    await limiter.refund("user-key", 7, 10)
+    assert (await limiter.check("user-key", 7, 10)).allowed
+    assert (await limiter.check("user-key", 7, 10)).allowed
+    assert not (await limiter.check("user-key", 7, 10)).allowed
@@ -0,0 +1,66 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+from routing import RoutingIndex, etag_matches
+
+def make_providers():
+    return [
+        {"id": 1, "name": "OpenAI", "server_url": "https://a.com", "server_key": "sk-a",
+         "personalized_key": "key-a", "description": "", "models": ["gpt-4", "gpt-4o"],
+         "model_records": [(1, "gpt-4", 1700000000), (2, "gpt-4o", 1700000001)]},
+        {"id": 2, "name": "Backup", "server_url": "https://b.com", "server_key": "sk-b",
+         "personalized_key": "key-a", "description": "proxy", "models": ["gpt-4"],
+         "model_records": [(3, "gpt-4", 1700000002)]},
+        {"id": 3, "name": "Other", "server_url": "https://c.com", "server_key": "sk-c",
+         "personalized_key": "key-b", "description": "", "models": ["claude"],
+         "model_records": [(4, "claude", 1700000003)]},
+    ]
+
+def test_candidates_and_provider_info():
+    index = RoutingIndex(make_providers)
+    assert index.candidates("key-a", "gpt-4") == [1, 2]
+    assert index.candidates("key-a", "claude") == []
+    assert index.candidates("missing", "gpt-4") == []
+    info = index.provider_info(2)
+    assert info["server_key"] == "sk-b"
+    assert info["description"] == "proxy"
+    assert "gpt-4" in info["models"]
+
+def test_models_payload_is_stable_and_cached():
+    index = RoutingIndex(make_providers)
+    body, etag = index.models_payload()
+    data = json.loads(body)
+    assert [m["id"] for m in data["data"]] == ["gpt-4", "gpt-4o", "gpt-4", "claude"]
+    assert data["data"][0]["created"] == 1700000000
+    assert data["data"][0]["permission"][0]["id"] == "modelperm-1"
+    assert index.models_payload() == (body, etag)
+    index.rebuild()
+    assert index.models_payload()[1] == etag
+
+def test_models_payload_filtered_by_key():
+    index = RoutingIndex(make_providers)
+    data = json.loads(index.models_payload("key-b")[0])
+    assert [m["id"] for m in data["data"]] == ["claude"]
+    assert json.loads(index.models_payload("unknown")[0])["data"] == []
+    # 未知密钥共用一个缓存项
+    for i in range(100):
+        assert index.models_payload(f"random-{i}") == index.models_payload("unknown")
+    assert len(index._models_cache) == 2
+
+def test_rebuild_changes_etag():
+    providers = make_providers()
+    index = RoutingIndex(lambda: providers)
+    etag = index.models_payload()[1]
+    providers[2]["models"].append("claude-2")
+    providers[2]["model_records"].append((5, "claude-2", 1700000004))
+    index.rebuild()
+    assert index.models_payload()[1] != etag
+    assert index.candidates("key-b", "claude-2") == [3]
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc", "def"', '"abc"')
+    assert etag_matches('*', '"abc"')
+    assert not etag_matches('"def"', '"abc"')
+    assert not etag_matches(None, '"abc"')
@@ -0,0 +1,88 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import multiprocessing
+import pytest
+from shared_state import SharedState
+
+def _publish_in_child(state):
+    state.publish("routing", {"version": 2})
+    state.set("breaker:1", {"available": False})
+
+@pytest.mark.asyncio
+async def test_publish_in_forked_worker_reaches_parent(tmp_path):
+    state = SharedState(tmp_path / "shared.db")
+    received = []
+    state.subscribe("routing", received.append)
+
+    process = multiprocessing.get_context("fork").Process(target=_publish_in_child, args=(state,))
+    process.start()
+    process.join(10)
+
+    assert state.generation("routing") == 1
+    assert await state.poll() == ["routing"]
+    assert received == [{"version": 2}]
+    assert state.get("breaker:1") == {"available": False}
+    # 没有新的变更时不再回调
+    assert await state.poll() == []
+    assert received == [{"version": 2}]
+
+@pytest.mark.asyncio
+async def test_publisher_does_not_notify_itself(tmp_path):
+    state = SharedState(tmp_path / "shared.db")
+    received = []
+    state.subscribe("admission", received.append)
+    state.publish("admission")
+    assert await state.poll() == []
+    assert received == []
+
+@pytest.mark.asyncio
+async def test_async_subscriber_and_errors_are_isolated(tmp_path):
+    state = SharedState(tmp_path / "shared.db")
+    received = []
+
+    def broken(value):
+        raise RuntimeError("boom")
+
+    async def handler(value):
+        received.append(value)
+
+    state.subscribe("proxies", broken)
+    state.subscribe("proxies", handler)
+    state._write_slot(state.topics["proxies"], 1)
+    state.set("proxies", ["http://127.0.0.1:7890"])
+    await state.poll()
+    assert received == [["http://127.0.0.1:7890"]]
+
+def test_kv(tmp_path):
+    state = SharedState(tmp_path / "shared.db")
+    assert state.get("missing", "default") == "default"
+    state.set("health", {"1": {"available": False}})
+    assert state.get("health") == {"1": {"available": False}}
+    state.set("breaker:2", {"available": True})
+    # 同一数据库的另一个实例可以读到相同的值
+    other = SharedState(tmp_path / "shared.db")
+    assert other.get("health") == {"1": {"available": False}}
+    assert other.items("breaker:") == [("breaker:2", {"available": True})]
+    other.delete("breaker:2")
+    assert state.items("breaker:") == []
+
+def test_leadership_taken_over_from_dead_process(tmp_path):
+    state = SharedState(tmp_path / "shared.db")
+    process = multiprocessing.get_context("fork").Process(target=state.try_lead)
+    process.start()
+    process.join(10)
+    # 领导进程已退出，当前进程接管
+    assert state.snapshot()["leader_pid"] == process.pid
+    assert state.try_lead()
+    assert state.is_leader()
+    assert state.snapshot()["leader_pid"] == os.getpid()
+
+def test_items_by_prefix_and_delete(tmp_path):
+    state = SharedState(tmp_path / "shared.db")
+    state.set("metrics:1", {"a": 1})
+    state.set("metrics:2", {"a": 2})
+    state.set("routing", None)
+    assert state.items("metrics:") == [("metrics:1", {"a": 1}), ("metrics:2", {"a": 2})]
+    state.delete("metrics:1")
+    assert [key for key, _ in state.items("metrics:")] == ["metrics:2"]
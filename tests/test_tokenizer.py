@@ -121,4 +121,12 @@ async def test_empty_response(tokenizer):
         text = "测试文本"
         result = await tokenizer.count_tokens(text, TOKENIZER_MODEL_ID)
         # 验证降级方案
-        assert result == len(text.encode('utf-8')) // 4 
\ No newline at end of file
+        assert result == len(text.encode('utf-8')) // 4 
+
+def test_count_tokens_local_estimate():
+    from my_tokenizer import count_tokens_local, estimate_tokens
+    # 中文逐字，英文约 4 字符 1 个，数字约 3 位 1 个，符号各 1 个
+    assert estimate_tokens("天空为什么这么蓝") == 8
+    assert estimate_tokens("hello world") == 4
+    assert estimate_tokens("12345!") == 3
+    assert count_tokens_local("") == 0
@@ -0,0 +1,64 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import time
+from tracing import Trace, TraceRecorder
+
+def make_trace(duration: float) -> Trace:
+    trace = Trace("chat.completions")
+    trace.root.start -= duration
+    return trace
+
+def test_spans_and_server_timing():
+    trace = Trace("chat.completions")
+    with trace.span("routing"):
+        pass
+    relay = trace.start_span("stream_relay")
+    header = trace.server_timing()
+    # 未结束的 span 不出现在 Server-Timing 中
+    assert header.startswith("routing;dur=")
+    assert "stream_relay" not in header
+    assert "total;dur=" in header
+    trace.end_span(relay)
+    assert "stream_relay;dur=" in trace.server_timing()
+    assert [span["name"] for span in trace.to_dict()["spans"]] == ["routing", "stream_relay"]
+
+def test_traceparent_is_continued():
+    trace_id = "0af7651916cd43dd8448eb211c80319c"
+    trace = Trace("chat.completions", f"00-{trace_id}-b7ad6b7169203331-01")
+    assert trace.trace_id == trace_id
+    assert trace.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["parentSpanId"] == "b7ad6b7169203331"
+    assert len(Trace("chat.completions", "garbage").trace_id) == 32
+
+def test_recorder_keeps_slowest():
+    recorder = TraceRecorder(capacity=3)
+    for duration in (0.01, 0.5, 0.02, 0.3, 0.001, 0.4):
+        recorder.record(make_trace(duration))
+    durations = [trace["duration_ms"] for trace in recorder.slowest()]
+    assert len(durations) == 3
+    assert durations == sorted(durations, reverse=True)
+    assert durations[-1] >= 300
+    assert len(recorder.slowest(1)) == 1
+
+def test_otlp_export(tmp_path):
+    export_path = tmp_path / "traces.jsonl"
+    recorder = TraceRecorder(capacity=5, export_path=str(export_path))
+    trace = Trace("chat.completions")
+    trace.attributes.update({"model": "gpt-4", "stream": True, "provider_id": 3})
+    with trace.span("upstream", attempts=2):
+        pass
+    recorder.record(trace)
+
+    for _ in range(100):
+        if export_path.exists() and export_path.read_text(encoding="utf-8"):
+            break
+        time.sleep(0.01)
+    data = json.loads(export_path.read_text(encoding="utf-8").splitlines()[0])
+    spans = data["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root, upstream = spans
+    assert root["traceId"] == trace.trace_id and root["kind"] == 2
+    assert upstream["parentSpanId"] == root["spanId"]
+    assert int(upstream["endTimeUnixNano"]) >= int(upstream["startTimeUnixNano"])
+    assert {"key": "attempts", "value": {"intValue": "2"}} in upstream["attributes"]
+    assert {"key": "stream", "value": {"boolValue": True}} in root["attributes"]
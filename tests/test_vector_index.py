@@ -0,0 +1,76 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+import pytest
+from embedding_store import normalize_rows
+from vector_index import ExactIndex, IVFIndex, build_index, load_index, top_k_rows
+
+def clustered(count, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    points = centers[rng.integers(0, clusters, count)] + 0.3 * rng.normal(size=(count, dim))
+    return normalize_rows(points)
+
+def test_top_k_rows_matches_full_sort():
+    rng = np.random.default_rng(1)
+    scores = rng.normal(size=(4, 100))
+    indices, top = top_k_rows(scores, 5)
+    expected = np.argsort(-scores, axis=1)[:, :5]
+    np.testing.assert_array_equal(indices, expected)
+    np.testing.assert_allclose(top, np.take_along_axis(scores, expected, axis=1))
+    # k 大于列数时返回全部
+    assert top_k_rows(scores[:, :3], 10)[0].shape == (4, 3)
+
+def test_exact_index_normalizes_query():
+    matrix = clustered(200)
+    index = ExactIndex(matrix)
+    query = matrix[17] * 5
+    indices, scores = index.search(query, 3)
+    assert indices[0] == 17
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+    assert list(scores) == sorted(scores, reverse=True)
+
+def test_ivf_recall_and_roundtrip(tmp_path):
+    matrix = clustered(5000)
+    exact = ExactIndex(matrix)
+    ivf = IVFIndex.build(matrix, nlist=64, nprobe=8)
+    assert sorted(ivf.list_ids.tolist()) == list(range(5000))
+
+    rng = np.random.default_rng(2)
+    queries = matrix[rng.choice(5000, 50, replace=False)] + 0.05 * rng.normal(size=(50, 32))
+    hits = 0
+    for query in queries:
+        expected = set(exact.search(query, 10)[0].tolist())
+        hits += len(expected & set(ivf.search(query, 10)[0].tolist()))
+    assert hits / 500 >= 0.9
+
+    ivf.save(tmp_path / "index")
+    loaded = load_index(tmp_path / "index", matrix)
+    assert isinstance(loaded, IVFIndex) and loaded.nprobe == 8
+    np.testing.assert_array_equal(loaded.search(queries[0], 5)[0], ivf.search(queries[0], 5)[0])
+
+def test_build_index_switches_on_size():
+    matrix = clustered(300)
+    assert isinstance(build_index(matrix, exact_threshold=1000), ExactIndex)
+    assert isinstance(build_index(matrix, exact_threshold=100, nlist=8), IVFIndex)
+
+def test_search_batch_matches_single_search():
+    matrix = clustered(3000)
+    rng = np.random.default_rng(3)
+    queries = matrix[rng.choice(3000, 20, replace=False)] + 0.05 * rng.normal(size=(20, 32))
+    for index in (ExactIndex(matrix), IVFIndex.build(matrix, nlist=32, nprobe=4)):
+        batch = index.search_batch(queries, 5)
+        assert len(batch) == 20
+        for query, (indices, scores) in zip(queries, batch):
+            expected_indices, expected_scores = index.search(query, 5)
+            np.testing.assert_array_equal(indices, expected_indices)
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+        assert index.search_batch([], 5) == []
+
+def test_exact_search_batch_blocks_queries(monkeypatch):
+    import vector_index
+    matrix = clustered(500)
+    monkeypatch.setattr(vector_index, "BATCH_SCORE_ELEMENTS", 1000)  # 每块 2 个查询
+    batch = ExactIndex(matrix).search_batch(matrix[:7], 1)
+    assert [int(indices[0]) for indices, _ in batch] == list(range(7))
@@ -0,0 +1,219 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import json
+import httpx
+import pytest
+from starlette.websockets import WebSocketDisconnect
+from conversations import ConversationStore
+from upstream_pool import UpstreamPool
+from ws_chat import ChatSocketSession, DeltaBatcher
+
+PROVIDERS = {
+    1: {"id": 1, "name": "p", "server_url": "https://up.example.com", "server_key": "k",
+        "description": "", "models": ["gpt-4", "slow"]},
+}
+
+class FakeWebSocket:
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.sent = []
+
+    async def receive_text(self):
+        text = await self.incoming.get()
+        if text is None:
+            raise WebSocketDisconnect()
+        return text
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    def frames(self, stream_id, kind=None):
+        return [f for f in self.sent if f.get("id") == stream_id and (kind is None or f["type"] == kind)]
+
+class FakeTokenizer:
+    async def count_tokens(self, text, provider_key=None):
+        return len(text)
+
+class FakeStats:
+    def __init__(self):
+        self.records = []
+
+    async def record_chat(self, **kwargs):
+        self.records.append(kwargs)
+
+def sse(words):
+    return "".join(
+        f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n" for word in words
+    ) + "data: [DONE]\n\n"
+
+async def slow_stream():
+    for index in range(1000):
+        yield f"data: {json.dumps({'choices': [{'delta': {'content': str(index)}}]})}\n\n".encode()
+        await asyncio.sleep(0.01)
+
+UPSTREAM_BODIES = []
+
+def upstream(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.content)
+    UPSTREAM_BODIES.append(body)
+    assert request.headers["Authorization"] == "Bearer k"
+    if body["model"] == "slow":
+        return httpx.Response(200, content=slow_stream(), headers={"Content-Type": "text/event-stream"})
+    return httpx.Response(200, text=sse([f"w{i} " for i in range(50)]),
+                          headers={"Content-Type": "text/event-stream"})
+
+def make_session(**kwargs):
+    pool = UpstreamPool(transport_factory=lambda proxy: httpx.MockTransport(upstream))
+    websocket = FakeWebSocket()
+    stats = FakeStats()
+    session = ChatSocketSession(websocket, pool, PROVIDERS.get, FakeTokenizer(), stats, **kwargs)
+    return session, websocket, stats
+
+async def wait_done(websocket, stream_id, timeout=5.0):
+    for _ in range(int(timeout / 0.01)):
+        if websocket.frames(stream_id, "done"):
+            return websocket.frames(stream_id, "done")[0]
+        await asyncio.sleep(0.01)
+    raise AssertionError("未收到 done 帧")
+
+@pytest.mark.asyncio
+async def test_deltas_are_batched_with_sequence_numbers():
+    session, websocket, stats = make_session(batch_window=0.05, max_batch_chars=40)
+    runner = asyncio.create_task(session.run())
+    await websocket.incoming.put(json.dumps(
+        {"type": "chat", "id": "a", "message": "hi", "provider_id": 1, "model_name": "gpt-4"}))
+    done = await wait_done(websocket, "a")
+
+    deltas = websocket.frames("a", "delta")
+    assert [frame["seq"] for frame in deltas] == list(range(len(deltas)))
+    assert "".join(frame["content"] for frame in deltas) == "".join(f"w{i} " for i in range(50))
+    # 50 个细碎增量被合并为少量帧，而不是每块发送一次完整内容
+    assert len(deltas) < 50
+    assert done["finish_reason"] == "stop"
+    assert done["seq"] == len(deltas)
+    assert websocket.frames("a", "start")[0]["conversation_id"]
+
+    # prompt 与 completion 各记录一次
+    assert [record["is_prompt"] for record in stats.records] == [True, False]
+    assert stats.records[1]["tokens_count"] == done["completion_tokens"]
+
+    await websocket.incoming.put(None)
+    with pytest.raises(WebSocketDisconnect):
+        await runner
+
+@pytest.mark.asyncio
+async def test_multiplexed_streams_and_cancel():
+    session, websocket, stats = make_session(batch_window=0.01)
+    runner = asyncio.create_task(session.run())
+    await websocket.incoming.put(json.dumps(
+        {"type": "chat", "id": "slow", "message": "hi", "provider_id": 1, "model_name": "slow"}))
+    await websocket.incoming.put(json.dumps(
+        {"type": "chat", "id": "fast", "message": "hi", "provider_id": 1, "model_name": "gpt-4"}))
+
+    assert (await wait_done(websocket, "fast"))["finish_reason"] == "stop"
+    while not websocket.frames("slow", "delta"):
+        await asyncio.sleep(0.01)
+    assert not websocket.frames("slow", "done")
+
+    await websocket.incoming.put(json.dumps({"type": "cancel", "id": "slow"}))
+    done = await wait_done(websocket, "slow")
+    assert done["finish_reason"] == "cancelled"
+    # 取消时记录已生成的部分
+    partial = [r for r in stats.records if not r["is_prompt"] and r["message"].startswith("0")]
+    assert len(partial) == 1
+    assert session.streams == {}
+
+    await websocket.incoming.put(None)
+    with pytest.raises(WebSocketDisconnect):
+        await runner
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_streams_and_errors_end_with_done():
+    session, websocket, stats = make_session()
+    runner = asyncio.create_task(session.run())
+    await websocket.incoming.put(json.dumps(
+        {"type": "chat", "id": "bad", "message": "hi", "provider_id": 9, "model_name": "gpt-4"}))
+    done = await wait_done(websocket, "bad")
+    assert done["finish_reason"] == "error"
+    assert websocket.frames("bad", "error")[0]["error"] == "无效的提供商ID"
+
+    # 旧格式消息（没有 type 和 id）仍可使用
+    await websocket.incoming.put(json.dumps({"message": "hi", "provider_id": 1, "model_name": "slow"}))
+    while not session.streams:
+        await asyncio.sleep(0.01)
+    await websocket.incoming.put(None)
+    with pytest.raises(WebSocketDisconnect):
+        await runner
+    assert session.streams == {}
+
+@pytest.mark.asyncio
+async def test_delta_batcher_flushes_on_window():
+    sent = []
+
+    async def send(frame):
+        sent.append(frame)
+
+    batcher = DeltaBatcher(send, "x", window=0.02, max_chars=1000)
+    await batcher.add("a")
+    await batcher.add("b")
+    assert sent == []
+    await asyncio.sleep(0.05)
+    assert sent == [{"type": "delta", "id": "x", "seq": 0, "content": "ab"}]
+    await batcher.add("c")
+    await batcher.close()
+    assert sent[-1] == {"type": "delta", "id": "x", "seq": 1, "content": "c"}
+
+@pytest.mark.asyncio
+async def test_multi_turn_history_uses_cached_token_counts():
+    async def loader(conversation_id):
+        return []
+
+    store = ConversationStore(loader, max_context_tokens=300)
+    session, websocket, stats = make_session(conversations=store)
+    counted = []
+    count_tokens = session.tokenizer.count_tokens
+
+    async def tracking_count(text, provider_key=None):
+        counted.append(text)
+        return await count_tokens(text)
+
+    session.tokenizer.count_tokens = tracking_count
+    runner = asyncio.create_task(session.run())
+
+    await websocket.incoming.put(json.dumps(
+        {"type": "chat", "id": "t1", "message": "first", "provider_id": 1, "model_name": "gpt-4"}))
+    await wait_done(websocket, "t1")
+    conversation_id = websocket.frames("t1", "start")[0]["conversation_id"]
+
+    UPSTREAM_BODIES.clear()
+    await websocket.incoming.put(json.dumps(
+        {"type": "chat", "id": "t2", "message": "second", "provider_id": 1, "model_name": "gpt-4",
+         "conversation_id": conversation_id}))
+    await wait_done(websocket, "t2")
+    assert websocket.frames("t2", "start")[0]["conversation_id"] == conversation_id
+
+    reply = "".join(f"w{i} " for i in range(50))
+    assert UPSTREAM_BODIES[0]["messages"] == [
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": reply},
+        {"role": "user", "content": "second"},
+    ]
+    # 每条消息只计算一次 token
+    assert counted == ["first", reply, "second", reply]
+    prompt = [r for r in stats.records if r["is_prompt"]][-1]
+    assert prompt["message_tokens"] == len("second")
+    assert prompt["tokens_count"] == len("first") + len(reply) + len("second")
+
+    # 超出预算时只带最近的历史
+    UPSTREAM_BODIES.clear()
+    await websocket.incoming.put(json.dumps(
+        {"type": "chat", "id": "t3", "message": "third", "provider_id": 1, "model_name": "gpt-4",
+         "conversation_id": conversation_id}))
+    await wait_done(websocket, "t3")
+    assert [m["content"] for m in UPSTREAM_BODIES[0]["messages"]] == ["second", reply, "third"]
+
+    await websocket.incoming.put(None)
+    with pytest.raises(WebSocketDisconnect):
+        await runner
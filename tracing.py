@@ -0,0 +1,205 @@
+import heapq
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def _new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+class Span:
+    __slots__ = ("name", "span_id", "start", "end", "attributes")
+
+    def __init__(self, name: str, start: float, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.span_id = _new_span_id()
+        self.start = start
+        self.end: Optional[float] = None
+        self.attributes = attributes or {}
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+
+class Trace:
+    """
+    单个请求的追踪：一个根 span（整个请求）加若干阶段 span
+
+    阶段 span 用 perf_counter 计时，导出时再换算为 Unix 时间。
+    """
+
+    def __init__(self, name: str, traceparent: Optional[str] = None):
+        match = _TRACEPARENT.match(traceparent or "")
+        self.trace_id = match.group(1) if match else uuid.uuid4().hex
+        self.parent_span_id = match.group(2) if match else None
+        self.root = Span(name, time.perf_counter())
+        self.start_unix_ns = time.time_ns()
+        self.spans: List[Span] = []
+        self.attributes: Dict[str, Any] = {}
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """记录代码块耗时"""
+        span = Span(name, time.perf_counter(), attributes)
+        self.spans.append(span)
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter()
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """开始一个需要手动结束的 span（例如跨越生成器的流式转发）"""
+        span = Span(name, time.perf_counter(), attributes)
+        self.spans.append(span)
+        return span
+
+    def end_span(self, span: Span):
+        if span.end is None:
+            span.end = time.perf_counter()
+
+    def finish(self):
+        for span in self.spans:
+            self.end_span(span)
+        self.end_span(self.root)
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    def server_timing(self) -> str:
+        """生成 Server-Timing 响应头，包含已完成的阶段和到目前为止的总耗时"""
+        parts = []
+        for span in self.spans:
+            if span.end is not None:
+                parts.append(f"{span.name};dur={span.duration_ms:.1f}")
+        parts.append(f"total;dur={self.duration_ms:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "start": self.start_unix_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 2),
+            "attributes": self.attributes,
+            "spans": [{
+                "name": span.name,
+                "offset_ms": round((span.start - self.root.start) * 1000, 2),
+                "duration_ms": round(span.duration_ms, 2),
+                "attributes": span.attributes
+            } for span in self.spans]
+        }
+
+    def _unix_ns(self, perf: float) -> str:
+        return str(self.start_unix_ns + int((perf - self.root.start) * 1e9))
+
+    def to_otlp(self, service_name: str = "nexusai") -> Dict[str, Any]:
+        """转换为 OTLP/JSON 的 ResourceSpans 格式"""
+
+        def attributes(values: Dict[str, Any]) -> List[Dict[str, Any]]:
+            result = []
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    result.append({"key": key, "value": {"boolValue": value}})
+                elif isinstance(value, int):
+                    result.append({"key": key, "value": {"intValue": str(value)}})
+                elif isinstance(value, float):
+                    result.append({"key": key, "value": {"doubleValue": value}})
+                else:
+                    result.append({"key": key, "value": {"stringValue": str(value)}})
+            return result
+
+        def otlp_span(span: Span, parent: Optional[str], kind: int, values: Dict[str, Any]) -> Dict[str, Any]:
+            data = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": kind,
+                "startTimeUnixNano": self._unix_ns(span.start),
+                "endTimeUnixNano": self._unix_ns(span.end if span.end is not None else span.start),
+                "attributes": attributes(values)
+            }
+            if parent:
+                data["parentSpanId"] = parent
+            return data
+
+        # kind: 2 = SERVER（整个请求），1 = INTERNAL（阶段）
+        spans = [otlp_span(self.root, self.parent_span_id, 2, self.attributes)]
+        spans += [otlp_span(span, self.root.span_id, 1, span.attributes) for span in self.spans]
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": attributes({"service.name": service_name})},
+                "scopeSpans": [{"scope": {"name": "nexusai.tracing"}, "spans": spans}]
+            }]
+        }
+
+
+class TraceRecorder:
+    """
+    保存最慢的 N 个请求追踪，并可选地以 OTLP/JSON（每行一个 ResourceSpans）导出到本地文件
+
+    导出在后台线程中写文件，不阻塞事件循环。
+    """
+
+    def __init__(self, capacity: int = 50, export_path: Optional[str] = None):
+        self.capacity = capacity
+        self.export_path = export_path
+        self._heap: List[Any] = []  # (duration_ms, 序号, trace 字典) 的小顶堆
+        self._counter = 0
+        self._queue: Optional[queue.SimpleQueue] = None
+        self._writer_pid = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger('nexusai.tracing')
+
+    def record(self, trace: Trace):
+        trace.finish()
+        duration = trace.duration_ms
+        self._counter += 1
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, (duration, self._counter, trace.to_dict()))
+        elif duration > self._heap[0][0]:
+            heapq.heapreplace(self._heap, (duration, self._counter, trace.to_dict()))
+        if self.export_path:
+            self._export(trace)
+
+    def slowest(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        traces = [item[2] for item in sorted(self._heap, key=lambda item: item[0], reverse=True)]
+        return traces[:limit] if limit else traces
+
+    def clear(self):
+        self._heap = []
+
+    def _export(self, trace: Trace):
+        if self._writer_pid != os.getpid():
+            with self._lock:
+                if self._writer_pid != os.getpid():
+                    # fork 后重新创建队列和写线程
+                    self._queue = queue.SimpleQueue()
+                    threading.Thread(target=self._write_forever, args=(self._queue,),
+                                     name="trace-exporter", daemon=True).start()
+                    self._writer_pid = os.getpid()
+        self._queue.put(trace.to_otlp())
+
+    def _write_forever(self, items: queue.SimpleQueue):
+        while True:
+            item = items.get()
+            try:
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                    # 顺带写出队列中已积压的记录
+                    while not items.empty():
+                        f.write(json.dumps(items.get(), ensure_ascii=False) + "\n")
+            except Exception as e:
+                self.logger.error(f"导出追踪数据失败: {str(e)}")
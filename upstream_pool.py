@@ -0,0 +1,76 @@
+import logging
+from typing import Callable, Dict, Optional
+
+import httpx
+from httpx import AsyncClient, AsyncHTTPTransport
+
+
+def build_upstream_url(server_url: str, endpoint: str = "chat/completions") -> Optional[str]:
+    """
+    根据提供商的 server_url 构建上游请求地址
+
+    - 以 '/' 结尾: 直接拼接 endpoint
+    - 以 '#' 结尾: 原样使用，只对 chat/completions 有效，其余 endpoint 返回 None
+    - 其他情况: 拼接 /v1/{endpoint}
+    """
+    base_url = server_url.rstrip('/')
+    if server_url.endswith('/'):
+        return f"{base_url}/{endpoint}"
+    if server_url.endswith('#'):
+        return base_url if endpoint == "chat/completions" else None
+    return f"{base_url}/v1/{endpoint}"
+
+
+class UpstreamPool:
+    """
+    上游 HTTP 客户端池
+
+    每个代理（包括直连）对应一个长期存活的 AsyncClient，复用 DNS 解析、
+    TCP 连接和 TLS 会话，避免每个请求都重新握手。
+    """
+
+    def __init__(self, max_connections: int = 200, max_keepalive_connections: int = 50,
+                 keepalive_expiry: float = 120.0,
+                 transport_factory: Optional[Callable[[Optional[str]], httpx.AsyncBaseTransport]] = None):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.transport_factory = transport_factory
+        self._clients: Dict[Optional[str], AsyncClient] = {}
+        self.logger = logging.getLogger('nexusai.pool')
+
+    def _create_transport(self, proxy: Optional[str]) -> httpx.AsyncBaseTransport:
+        if self.transport_factory:
+            return self.transport_factory(proxy)
+        return AsyncHTTPTransport(proxy=proxy, limits=self.limits)
+
+    def get_client(self, proxy: Optional[str] = None) -> AsyncClient:
+        """获取（或创建）指定代理对应的共享客户端，调用方不应关闭它"""
+        client = self._clients.get(proxy)
+        if client is None or client.is_closed:
+            client = AsyncClient(transport=self._create_transport(proxy))
+            self._clients[proxy] = client
+        return client
+
+    async def warm_up(self, url: str, proxy: Optional[str] = None,
+                      headers: Optional[Dict[str, str]] = None, timeout: float = 10.0) -> bool:
+        """
+        预热到指定地址的连接（DNS、TCP、TLS），返回是否成功建立连接
+
+        只要收到任何 HTTP 响应即视为预热成功，状态码不影响连接的复用。
+        """
+        try:
+            response = await self.get_client(proxy).get(url, headers=headers, timeout=timeout)
+            await response.aclose()
+            return True
+        except Exception as e:
+            self.logger.warning(f"连接预热失败: {url}, 代理: {proxy}, 错误: {str(e)}")
+            return False
+
+    async def aclose(self):
+        """关闭所有客户端"""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
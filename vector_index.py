@@ -0,0 +1,269 @@
+import json
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from embedding_store import normalize_rows
+
+# 向量数不超过该值时使用精确检索，否则使用 IVF
+DEFAULT_EXACT_THRESHOLD = 50_000
+# 分块计算相似度时每块的行数，限制临时矩阵的内存
+BLOCK_ROWS = 65_536
+# 批量检索时分数矩阵（查询数 x 向量数）每块的最大元素数（float32 约 64MB）
+BATCH_SCORE_ELEMENTS = 1 << 24
+
+INDEX_META_FILE = "index.json"
+IVF_FILE = "ivf.npz"
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    每行取分数最高的 k 个（argpartition 选出后只对这 k 个排序）
+
+    Returns:
+        (下标, 分数)，形状均为 (行数, k)，按分数从高到低
+    """
+    scores = np.atleast_2d(scores)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+
+def _normalize_query(query) -> np.ndarray:
+    query = np.asarray(query, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(query)
+    return query / norm if norm else query
+
+
+def _normalize_queries(queries) -> np.ndarray:
+    queries = np.asarray(queries, dtype=np.float32)
+    return normalize_rows(queries.reshape(len(queries), -1))
+
+
+class ExactIndex:
+    """精确检索：对归一化矩阵做一次矩阵向量乘，再用 argpartition 取 top-k"""
+
+    kind = "exact"
+
+    def __init__(self, matrix: np.ndarray, normalized: bool = True):
+        """
+        Args:
+            matrix: 向量矩阵（可以是 np.memmap）
+            normalized: 矩阵是否已按行归一化（EmbeddingStore 保存的矩阵已归一化）
+        """
+        self.matrix = matrix if normalized else normalize_rows(matrix)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def search(self, query, k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """返回与 query 余弦相似度最高的 k 个向量的 (下标, 分数)"""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.matrix @ _normalize_query(query)
+        indices, top_scores = top_k_rows(scores, k)
+        return indices[0], top_scores[0]
+
+    def search_batch(self, queries, k: int = 3) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        批量检索：每块查询与整个矩阵做一次矩阵乘，再按行取 top-k
+
+        查询按块处理，使每块的分数矩阵不超过 BATCH_SCORE_ELEMENTS 个元素。
+
+        Returns:
+            每个查询的 (下标, 分数)
+        """
+        if len(queries) == 0:
+            return []
+        queries = _normalize_queries(queries)
+        if len(self) == 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in range(len(queries))]
+        block = max(1, BATCH_SCORE_ELEMENTS // len(self))
+        results = []
+        for start in range(0, len(queries), block):
+            indices, top_scores = top_k_rows(queries[start:start + block] @ self.matrix.T, k)
+            results.extend(zip(indices, top_scores))
+        return results
+
+    def save(self, directory: Union[str, Path]):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / INDEX_META_FILE).write_text(json.dumps({"kind": self.kind}), encoding="utf-8")
+
+
+class IVFIndex:
+    """
+    倒排文件（IVF）近似检索
+
+    用球面 k-means 把向量分到 nlist 个簇，每个簇保存其中的向量下标。查询时只在与 query
+    最相近的 nprobe 个簇中计算相似度，计算量约为精确检索的 nprobe / nlist。
+    """
+
+    kind = "ivf"
+
+    def __init__(self, matrix: np.ndarray, centroids: np.ndarray, list_offsets: np.ndarray,
+                 list_ids: np.ndarray, nprobe: int = 16):
+        """
+        Args:
+            matrix: 归一化的向量矩阵
+            centroids: 簇中心，形状 (nlist, dim)
+            list_offsets: 每个簇在 list_ids 中的起止位置，长度 nlist + 1
+            list_ids: 按簇排列的向量下标
+            nprobe: 默认检索的簇数
+        """
+        self.matrix = matrix
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: Optional[int] = None, nprobe: Optional[int] = None,
+              iterations: int = 10, sample_size: Optional[int] = None, seed: int = 0) -> "IVFIndex":
+        """
+        训练簇中心并分配向量
+
+        Args:
+            matrix: 归一化的向量矩阵
+            nlist: 簇数，默认约 4 * sqrt(N)
+            nprobe: 默认检索的簇数，默认 nlist / 16（至少 8）
+            iterations: k-means 迭代次数
+            sample_size: 训练使用的样本数，默认 nlist * 64
+            seed: 随机种子
+        """
+        count = matrix.shape[0]
+        if count == 0:
+            raise ValueError("不能为空矩阵构建 IVF 索引")
+        nlist = max(1, min(nlist or int(4 * np.sqrt(count)), count))
+        nprobe = min(nlist, nprobe or max(8, nlist // 16))
+        rng = np.random.default_rng(seed)
+
+        sample_size = min(count, sample_size or nlist * 64)
+        sample_ids = np.sort(rng.choice(count, sample_size, replace=False))
+        sample = np.asarray(matrix[sample_ids], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = cls._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # 空簇重新取一个随机样本作为中心
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            centroids = normalize_rows(sums)
+
+        assignment = cls._assign(matrix, centroids)
+        list_ids = np.argsort(assignment, kind="stable").astype(np.int64)
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=nlist), out=list_offsets[1:])
+        return cls(matrix, centroids, list_offsets, list_ids, nprobe)
+
+    @staticmethod
+    def _assign(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """每个向量所属的簇（分块计算）"""
+        assignment = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            assignment[start:start + BLOCK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+        return assignment
+
+    def _candidates(self, probes: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.list_ids[self.list_offsets[probe]:self.list_offsets[probe + 1]]
+                               for probe in probes])
+
+    def search(self, query, k: int = 3, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """返回近似的 top-k (下标, 分数)"""
+        query = _normalize_query(query)
+        probes, _ = top_k_rows(self.centroids @ query, min(self.nlist, nprobe or self.nprobe))
+        return self._search_probes(query, probes[0], k)
+
+    def search_batch(self, queries, k: int = 3, nprobe: Optional[int] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        批量检索，结果与逐个 search 相同
+
+        按簇分组计算：每个簇的向量只读取一次，与所有探测该簇的查询做一次矩阵乘并取各自的
+        top-k，最后在每个查询的 nprobe * k 个候选中取 top-k。
+        """
+        if len(queries) == 0:
+            return []
+        queries = _normalize_queries(queries)
+        nprobe = min(self.nlist, nprobe or self.nprobe)
+        probes, _ = top_k_rows(queries @ self.centroids.T, nprobe)
+        count = len(queries)
+        candidate_ids = np.full((count, nprobe * k), -1, dtype=np.int64)
+        candidate_scores = np.full((count, nprobe * k), -np.inf, dtype=np.float32)
+
+        flat_probes = probes.ravel()
+        order = np.argsort(flat_probes, kind="stable")
+        clusters, starts = np.unique(flat_probes[order], return_index=True)
+        for cluster, start, end in zip(clusters, starts, np.append(starts[1:], len(order))):
+            ids = self.list_ids[self.list_offsets[cluster]:self.list_offsets[cluster + 1]]
+            if ids.size == 0:
+                continue
+            entries = order[start:end]
+            query_rows, slots = entries // nprobe, entries % nprobe
+            scores = queries[query_rows] @ np.asarray(self.matrix[ids], dtype=np.float32).T
+            top_ids, top_scores = top_k_rows(scores, k)
+            columns = slots[:, None] * k + np.arange(top_ids.shape[1])
+            candidate_ids[query_rows[:, None], columns] = ids[top_ids]
+            candidate_scores[query_rows[:, None], columns] = top_scores
+
+        positions, top_scores = top_k_rows(candidate_scores, k)
+        top_ids = np.take_along_axis(candidate_ids, positions, axis=1)
+        valid = top_ids >= 0  # 候选不足 k 个时的空位
+        return [(row_ids[row_valid], row_scores[row_valid])
+                for row_ids, row_scores, row_valid in zip(top_ids, top_scores, valid)]
+
+    def _search_probes(self, query: np.ndarray, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        candidates = self._candidates(probes)
+        if candidates.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        # 下标排序后读取，对内存映射的矩阵更接近顺序访问
+        candidates.sort()
+        scores = np.asarray(self.matrix[candidates], dtype=np.float32) @ query
+        positions, top_scores = top_k_rows(scores, k)
+        return candidates[positions[0]], top_scores[0]
+
+    def save(self, directory: Union[str, Path]):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.savez(directory / IVF_FILE, centroids=self.centroids, list_offsets=self.list_offsets,
+                 list_ids=self.list_ids)
+        (directory / INDEX_META_FILE).write_text(
+            json.dumps({"kind": self.kind, "nlist": self.nlist, "nprobe": self.nprobe}), encoding="utf-8")
+
+
+def build_index(matrix: np.ndarray, exact_threshold: int = DEFAULT_EXACT_THRESHOLD, **ivf_options):
+    """向量数不超过 exact_threshold 时返回 ExactIndex，否则构建 IVFIndex"""
+    if matrix.shape[0] <= exact_threshold:
+        return ExactIndex(matrix)
+    return IVFIndex.build(matrix, **ivf_options)
+
+
+def load_index(directory: Union[str, Path], matrix: np.ndarray):
+    """加载 save() 保存的索引（matrix 为对应的归一化向量矩阵，例如 EmbeddingStore.matrix()）"""
+    directory = Path(directory)
+    meta = json.loads((directory / INDEX_META_FILE).read_text(encoding="utf-8"))
+    if meta["kind"] == ExactIndex.kind:
+        return ExactIndex(matrix)
+    if meta["kind"] == IVFIndex.kind:
+        with np.load(directory / IVF_FILE) as data:
+            return IVFIndex(matrix, data["centroids"], data["list_offsets"], data["list_ids"], meta["nprobe"])
+    raise ValueError(f"未知的索引类型: {meta['kind']}")
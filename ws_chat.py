@@ -0,0 +1,336 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from chat_processing import SSE_DONE, delta_content, normalize_grok_chunk, parse_sse_line
+from conversations import Conversation, ConversationStore
+from upstream_pool import UpstreamPool, build_upstream_url
+
+# 增量合并的时间窗口（秒）和单帧最大字符数
+DEFAULT_BATCH_WINDOW = 0.05
+DEFAULT_MAX_BATCH_CHARS = 2048
+# 单个连接上同时进行的对话数上限
+DEFAULT_MAX_STREAMS = 8
+
+
+class DeltaBatcher:
+    """
+    把细碎的增量合并后再发送
+
+    第一个增量进入空缓冲区时开始计时，窗口到期或累计字符数超过上限时发出一帧；
+    每帧带递增的 seq，客户端按 seq 顺序拼接即可得到完整内容。
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], Awaitable[None]], stream_id: str,
+                 window: float = DEFAULT_BATCH_WINDOW, max_chars: int = DEFAULT_MAX_BATCH_CHARS):
+        self.send = send
+        self.stream_id = stream_id
+        self.window = window
+        self.max_chars = max_chars
+        self.seq = 0
+        self._parts: List[str] = []
+        self._size = 0
+        self._timer: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def add(self, text: str):
+        if not text:
+            return
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.max_chars:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            # 连接已关闭，由对话任务负责收尾
+            pass
+
+    async def flush(self):
+        """立即发出缓冲区中的内容"""
+        async with self._lock:
+            if self._timer is not None and self._timer is not asyncio.current_task():
+                self._timer.cancel()
+                self._timer = None
+            if not self._parts:
+                return
+            content = "".join(self._parts)
+            self._parts = []
+            self._size = 0
+            frame = {"type": "delta", "id": self.stream_id, "seq": self.seq, "content": content}
+            self.seq += 1
+            await self.send(frame)
+
+    async def close(self):
+        """停止计时器并发出剩余内容"""
+        await self.flush()
+
+
+class ChatSocketSession:
+    """
+    管理后台 /ws/chat 的一个 WebSocket 连接
+
+    客户端消息：
+        {"type": "chat", "id": "请求ID", "message": "...", "provider_id": 1, "model_name": "...",
+         "conversation_id": "可选，继续已有的多轮对话"}
+        {"type": "cancel", "id": "请求ID"}
+    服务端消息：
+        {"type": "start", "id": ..., "conversation_id": ...}
+        {"type": "delta", "id": ..., "seq": 0, "content": "增量文本"}
+        {"type": "done", "id": ..., "seq": n, "finish_reason": "stop" | "cancelled" | "error", "completion_tokens": ...}
+        {"type": "error", "id": ..., "error": "错误信息"}
+
+    每个对话以一个 done 帧结束（出错时先发送 error 帧），done 的 seq 为已发送的增量帧数。
+
+    同一连接上可以同时进行多个对话（按 id 区分），每个对话是一个独立的任务，可单独取消。
+    没有 type 的旧格式消息按 chat 处理。上游请求复用网关的连接池和路由索引。
+
+    配置了 conversations 时，服务端保存多轮历史：客户端只发送新消息和 start 帧返回的 conversation_id，
+    每轮请求携带 token 预算内的最近历史。同一会话的多个请求按顺序执行。
+    """
+
+    def __init__(self, websocket, pool: UpstreamPool,
+                 provider_lookup: Callable[[int], Optional[Dict[str, Any]]],
+                 tokenizer, stats_tracker,
+                 proxy_selector: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+                 conversations: Optional[ConversationStore] = None,
+                 batch_window: float = DEFAULT_BATCH_WINDOW,
+                 max_batch_chars: int = DEFAULT_MAX_BATCH_CHARS,
+                 max_streams: int = DEFAULT_MAX_STREAMS):
+        """
+        Args:
+            websocket: 已 accept 的 WebSocket
+            pool: 上游连接池
+            provider_lookup: 根据提供商ID返回提供商信息（例如 RoutingIndex.provider_info）
+            tokenizer: 用于计算 token 数
+            stats_tracker: 用于记录统计
+            proxy_selector: 根据提供商信息返回需要使用的代理（可选）
+            conversations: 多轮对话历史（可选，不提供时每次请求只包含当前消息）
+            batch_window: 增量合并的时间窗口（秒）
+            max_batch_chars: 单帧最大字符数
+            max_streams: 同时进行的对话数上限
+        """
+        self.websocket = websocket
+        self.pool = pool
+        self.provider_lookup = provider_lookup
+        self.tokenizer = tokenizer
+        self.stats_tracker = stats_tracker
+        self.proxy_selector = proxy_selector
+        self.conversations = conversations
+        self.batch_window = batch_window
+        self.max_batch_chars = max_batch_chars
+        self.max_streams = max_streams
+        self.streams: Dict[str, asyncio.Task] = {}
+        self._send_lock = asyncio.Lock()
+        self.logger = logging.getLogger('nexusai.ws')
+        self.request_logger = logging.getLogger('nexusai.request')
+
+    async def send(self, frame: Dict[str, Any]):
+        # 多个对话并发发送，需要串行化写入
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(frame, ensure_ascii=False))
+
+    async def run(self):
+        """读取客户端消息直到连接关闭，关闭时取消所有进行中的对话"""
+        try:
+            while True:
+                text = await self.websocket.receive_text()
+                try:
+                    await self.handle(json.loads(text))
+                except (json.JSONDecodeError, TypeError, ValueError, KeyError) as e:
+                    await self.send({"type": "error", "id": None, "error": f"无效的消息: {str(e)}"})
+        finally:
+            await self.cancel_all()
+
+    async def handle(self, message: Dict[str, Any]):
+        kind = message.get("type", "chat")
+        stream_id = str(message.get("id") or uuid.uuid4())
+        if kind == "cancel":
+            task = self.streams.get(stream_id)
+            if task is not None:
+                task.cancel()
+            return
+        if kind != "chat":
+            await self.send({"type": "error", "id": stream_id, "error": f"未知的消息类型: {kind}"})
+            return
+        if stream_id in self.streams:
+            await self.send({"type": "error", "id": stream_id, "error": "该请求ID正在进行中"})
+            return
+        if len(self.streams) >= self.max_streams:
+            await self.send({"type": "error", "id": stream_id,
+                             "error": f"同时进行的对话数不能超过 {self.max_streams}"})
+            return
+
+        task = asyncio.create_task(self.chat(
+            stream_id, message["message"], int(message["provider_id"]), message["model_name"],
+            message.get("conversation_id")
+        ))
+        self.streams[stream_id] = task
+        task.add_done_callback(lambda _: self.streams.pop(stream_id, None))
+
+    async def cancel_all(self):
+        tasks = list(self.streams.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def chat(self, stream_id: str, message: str, provider_id: int, model_name: str,
+                   conversation_id: Optional[str] = None):
+        """转发一次对话请求，以增量帧发送回复"""
+        conversation_id = str(conversation_id or uuid.uuid4())
+        conversation = None
+        holds_lock = False
+        batcher = DeltaBatcher(self.send, stream_id, self.batch_window, self.max_batch_chars)
+        parts: List[str] = []
+        finish_reason = "stop"
+        started = time.perf_counter()
+        try:
+            provider = self.provider_lookup(provider_id)
+            if not provider:
+                finish_reason = "error"
+                await self.send({"type": "error", "id": stream_id, "error": "无效的提供商ID"})
+                return
+            if model_name not in provider["models"]:
+                finish_reason = "error"
+                await self.send({"type": "error", "id": stream_id, "error": "该提供商未配置此模型"})
+                return
+
+            if self.conversations is not None:
+                conversation = await self.conversations.get(conversation_id)
+            else:
+                conversation = Conversation(conversation_id)
+            await conversation.lock.acquire()
+            holds_lock = True
+
+            # 只计算新消息的 token 数，历史消息使用缓存的值
+            message_tokens = await self.tokenizer.count_tokens(message)
+            conversation.append("user", message, message_tokens)
+            history = conversation.context(self.conversations.max_context_tokens
+                                           if self.conversations is not None else message_tokens)
+            prompt_tokens = sum(item.tokens for item in history)
+            self.request_logger.info("WebSocket 发送统计", extra={
+                "conversation_id": conversation_id,
+                "model": model_name,
+                "provider_id": provider_id,
+                "prompt_tokens": prompt_tokens,
+                "history_messages": len(history) - 1
+            })
+            await self.stats_tracker.record_chat(
+                conversation_id=conversation_id,
+                provider_id=provider_id,
+                model_name=model_name,
+                tokens_count=prompt_tokens,
+                is_prompt=True,
+                message=message,
+                message_tokens=message_tokens
+            )
+            await self.send({"type": "start", "id": stream_id, "conversation_id": conversation_id})
+
+            proxy = self.proxy_selector(provider) if self.proxy_selector else None
+            client = self.pool.get_client(proxy)
+            is_grok_model = "grok" in model_name.lower()
+            payload = {
+                "model": model_name,
+                "messages": [{"role": item.role, "content": item.content} for item in history],
+                "temperature": 0.7,
+                "stream": True
+            }
+            headers = {"Authorization": f"Bearer {provider['server_key']}", "Content-Type": "application/json"}
+
+            async with client.stream('POST', build_upstream_url(provider["server_url"]), json=payload,
+                                     headers=headers, timeout=300.0 if is_grok_model else 60.0) as response:
+                if response.status_code != 200:
+                    finish_reason = "error"
+                    await response.aread()
+                    self.logger.error(f"WebSocket 上游错误: {response.status_code}, 响应内容: {response.text[:500]}")
+                    await self.send({"type": "error", "id": stream_id, "error": f"服务器错误: {response.status_code}"})
+                    return
+
+                async for line in response.aiter_lines():
+                    data_str = parse_sse_line(line)
+                    if data_str is None:
+                        continue
+                    if data_str == SSE_DONE:
+                        break
+                    try:
+                        data = json.loads(data_str)
+                    except json.JSONDecodeError:
+                        continue
+                    if not isinstance(data, dict):
+                        continue
+                    if is_grok_model:
+                        content = normalize_grok_chunk(data, model_name)
+                    else:
+                        content = delta_content(data)
+                    if content:
+                        parts.append(content)
+                        await batcher.add(content)
+        except asyncio.CancelledError:
+            finish_reason = "cancelled"
+        except Exception as e:
+            self.logger.error(f"WebSocket 错误 [会话ID: {conversation_id}] 模型: {model_name}, "
+                              f"提供商ID: {provider_id}, {type(e).__name__}: {str(e)}")
+            finish_reason = "error"
+            await self._safe_send({"type": "error", "id": stream_id, "error": f"错误: {str(e)}"})
+        finally:
+            try:
+                await self._finish(stream_id, batcher, parts, conversation, conversation_id, provider_id,
+                                   model_name, finish_reason, started)
+            finally:
+                if holds_lock:
+                    conversation.lock.release()
+
+    async def _safe_send(self, frame: Dict[str, Any]):
+        try:
+            await self.send(frame)
+        except Exception:
+            # 连接已关闭
+            pass
+
+    async def _finish(self, stream_id: str, batcher: DeltaBatcher, parts: List[str],
+                      conversation: Optional[Conversation], conversation_id: str, provider_id: int,
+                      model_name: str, finish_reason: str, started: float):
+        """发出剩余增量和结束帧，并只记录一次完成统计（取消时记录已生成的部分）"""
+        try:
+            await batcher.close()
+        except Exception:
+            pass
+        content = "".join(parts)
+        completion_tokens = 0
+        if content:
+            completion_tokens = await self.tokenizer.count_tokens(content)
+            self.request_logger.info("WebSocket 接收统计", extra={
+                "conversation_id": conversation_id,
+                "model": model_name,
+                "provider_id": provider_id,
+                "completion_tokens": completion_tokens,
+                "finish_reason": finish_reason
+            })
+            await self.stats_tracker.record_chat(
+                conversation_id=conversation_id,
+                provider_id=provider_id,
+                model_name=model_name,
+                tokens_count=completion_tokens,
+                is_prompt=False,
+                message=content
+            )
+            if conversation is not None:
+                conversation.append("assistant", content, completion_tokens)
+        await self._safe_send({
+            "type": "done",
+            "id": stream_id,
+            "seq": batcher.seq,
+            "finish_reason": finish_reason,
+            "completion_tokens": completion_tokens,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        })